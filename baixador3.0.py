@@ -2,22 +2,45 @@ import os
 import re
 import json
 from datetime import datetime
-from typing import Optional, Dict, List
-from concurrent.futures import ThreadPoolExecutor
-from pytube import Search, YouTube
-from pytube.exceptions import PytubeError
-import yt_dlp
+from typing import Optional, Dict, List, Callable, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import queue
+import subprocess
+import hashlib
+import sqlite3
+import mmap
+import struct
+import bisect
+import heapq
+import math
+import sys
+import argparse
+import random
+from urllib.parse import urlparse, parse_qs, quote, unquote
 import warnings
-from tqdm import tqdm
-import eyed3
-import tkinter as tk
-from tkinter import ttk
-import pygame
 import threading
 import time
-from PIL import Image, ImageTk
-import requests
 from io import BytesIO
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Dependências pesadas (yt_dlp, eyed3, requests, PIL, tkinter, pygame...) são
+# importadas só onde são usadas, para o modo de linha de comando iniciar
+# rápido e funcionar sem display. Os módulos da interface gráfica são
+# carregados por _carregar_gui().
+tk = ttk = pygame = Image = ImageTk = None
+
+
+def _carregar_gui():
+    """Importa Tk, pygame e PIL para a interface gráfica."""
+    global tk, ttk, pygame, Image, ImageTk
+    import tkinter as tk
+    import tkinter.messagebox
+    from tkinter import ttk
+    import pygame
+    from PIL import Image, ImageTk
 
 # Suprimir warnings
 warnings.filterwarnings("ignore")
@@ -29,178 +52,4084 @@ class MusicInfo:
         self.duration = duration
         self.thumbnail = thumbnail
 
-from youtubesearchpython import VideosSearch
+    @classmethod
+    def from_dict(cls, dados: Dict) -> "MusicInfo":
+        return cls(dados['title'], dados['url'], dados.get('duration'), dados.get('thumbnail'))
 
-class MusicDownloader:
-    def __init__(self):
-        self.diretorio_downloads = os.path.join(os.path.expanduser("~"), "Downloads", "Musicas")
-        self.arquivo_historico = os.path.join(self.diretorio_downloads, "historico_downloads.json")
-        self.criar_diretorio()
-        self.historico = self.carregar_historico()
+    def to_dict(self) -> Dict:
+        return {'title': self.title, 'url': self.url, 'duration': self.duration, 'thumbnail': self.thumbnail}
 
-    def criar_diretorio(self):
-        """Cria o diretório de downloads se não existir."""
-        if not os.path.exists(self.diretorio_downloads):
-            os.makedirs(self.diretorio_downloads)
-            print(f"Diretório criado: {self.diretorio_downloads}")
+    def __repr__(self):
+        return f"MusicInfo({self.title!r}, {self.url!r})"
 
-    def carregar_historico(self) -> List[Dict]:
-        """Carrega o histórico de downloads do arquivo JSON."""
-        if os.path.exists(self.arquivo_historico):
-            try:
-                with open(self.arquivo_historico, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("Erro ao carregar histórico. Criando novo arquivo.")
-                return []
-        return []
-
-    def salvar_historico(self):
-        """Salva o histórico de downloads no arquivo JSON."""
-        with open(self.arquivo_historico, 'w', encoding='utf-8') as f:
-            json.dump(self.historico, f, ensure_ascii=False, indent=2)
+def buscar_videos(query: str, limite: int) -> List[Dict]:
+    """Backend de busca padrão: youtube-search-python."""
+    from youtubesearchpython import VideosSearch
+    results = VideosSearch(query, limit=limite).result()
+    return [{
+        'title': video['title'],
+        'url': video['link'],
+        'duration': video['duration'],
+        'thumbnail': video['thumbnails'][0]['url'] if video.get('thumbnails') else None,
+    } for video in results['result'][:limite]]
 
-    def buscar_musica(self, query: str) -> Optional[Dict]:
-        """Busca uma música no YouTube usando youtube-search-python."""
+
+def normalizar_busca(query: str) -> str:
+    """Chave de cache da busca: minúsculas e espaços simples."""
+    return " ".join(query.casefold().split())
+
+def baixar_imagem(url: str, session=None, timeout: float = 10) -> bytes:
+    """Baixa uma imagem, usando a sessão HTTP informada se houver."""
+    import requests
+    response = (session or requests).get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def preparar_capa(dados: bytes, tamanho_max: int = 500) -> bytes:
+    """Converte a imagem para JPEG (as miniaturas do YouTube podem vir em WebP)."""
+    from PIL import Image
+    img = Image.open(BytesIO(dados)).convert('RGB')
+    img.thumbnail((tamanho_max, tamanho_max), Image.LANCZOS)
+    saida = BytesIO()
+    img.save(saida, 'JPEG', quality=90)
+    return saida.getvalue()
+
+
+def ler_capa_embutida(arquivo: str) -> Optional[bytes]:
+    """Retorna a capa (frame APIC) gravada no MP3, se houver."""
+    import eyed3
+    audiofile = eyed3.load(arquivo)
+    if audiofile and audiofile.tag:
+        for imagem in audiofile.tag.images:
+            if imagem.image_data:
+                return imagem.image_data
+    return None
+
+
+def adicionar_metadados(arquivo: str, info: Dict):
+    """Adiciona metadados ao arquivo MP3.
+
+    Se ``info`` tiver a URL da miniatura, ela é gravada como capa (frame
+    APIC), para o player não precisar da rede ao tocar o arquivo.
+    """
+    import eyed3
+    try:
+        audiofile = eyed3.load(arquivo)
+        if audiofile and audiofile.tag is None:
+            audiofile.initTag()
+        if audiofile and audiofile.tag:
+            audiofile.tag.title = info.get('title', 'Desconhecido')
+            audiofile.tag.artist = info.get('uploader', 'Desconhecido')
+            if info.get('thumbnail'):
+                try:
+                    capa = preparar_capa(baixar_imagem(info['thumbnail']))
+                    audiofile.tag.images.set(eyed3.id3.frames.ImageFrame.FRONT_COVER, capa, 'image/jpeg')
+                except Exception as e:
+                    print(f"Aviso: Não foi possível adicionar a capa: {str(e)}")
+            audiofile.tag.save()
+    except Exception as e:
+        print(f"Aviso: Não foi possível adicionar metadados: {str(e)}")
+
+
+def calcular_checksum(arquivo: str) -> str:
+    """SHA-256 do conteúdo do arquivo, lido em blocos."""
+    sha = hashlib.sha256()
+    with open(arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+_ID_VIDEO = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def extrair_video_id(url: str) -> Optional[str]:
+    """Extrai o ID do vídeo de uma URL do YouTube.
+
+    Aceita ``watch?v=``, ``youtu.be/``, ``/shorts/``, ``/embed/``, entradas de
+    playlist (``watch?v=...&list=...&index=...``) e o próprio ID.
+    """
+    url = url.strip()
+    if _ID_VIDEO.match(url):
+        return url
+    if '://' not in url:
+        url = 'https://' + url
+    partes = urlparse(url)
+    host = partes.netloc.lower().split(':')[0]
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    if host == 'youtu.be':
+        candidato = partes.path.strip('/').split('/')[0]
+        return candidato if _ID_VIDEO.match(candidato) else None
+    if host not in ('youtube.com', 'music.youtube.com', 'youtube-nocookie.com'):
+        return None
+    candidato = parse_qs(partes.query).get('v', [None])[0]
+    if candidato is None:
+        caminho = partes.path.strip('/').split('/')
+        if len(caminho) >= 2 and caminho[0] in ('shorts', 'embed', 'v', 'live'):
+            candidato = caminho[1]
+    return candidato if candidato and _ID_VIDEO.match(candidato) else None
+
+
+def normalizar_url(url: str) -> str:
+    """Forma canônica ``watch?v=`` da URL, ou a própria URL se não for de vídeo."""
+    video_id = extrair_video_id(url)
+    return f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+
+
+FORMATO_DATA = "%d/%m/%Y %H:%M:%S"
+
+
+def _formatar_data(ts: Optional[int]) -> str:
+    return datetime.fromtimestamp(ts).strftime(FORMATO_DATA) if ts else ""
+
+
+def _ler_data(texto: Optional[str]) -> int:
+    """Converte uma data no formato do histórico antigo para timestamp."""
+    try:
+        return int(datetime.strptime(texto, FORMATO_DATA).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+class Database:
+    """Conexão SQLite compartilhada entre threads, protegida por um lock.
+
+    Usa WAL para que leituras não esperem as gravações e cada gravação seja
+    um append no log em vez de reescrever o arquivo.
+    """
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.lock = threading.RLock()
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.conexao.row_factory = sqlite3.Row
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+
+    def executar(self, sql: str, parametros=()) -> sqlite3.Cursor:
+        """Executa um comando e faz commit."""
+        with self.lock:
+            cursor = self.conexao.execute(sql, parametros)
+            self.conexao.commit()
+            return cursor
+
+    def executar_varios(self, sql: str, linhas):
+        """Executa o mesmo comando para várias linhas numa única transação."""
+        with self.lock:
+            self.conexao.executemany(sql, linhas)
+            self.conexao.commit()
+
+    def consultar(self, sql: str, parametros=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conexao.execute(sql, parametros).fetchall()
+
+    def script(self, sql: str):
+        with self.lock:
+            self.conexao.executescript(sql)
+
+    def fechar(self):
+        with self.lock:
+            self.conexao.close()
+
+
+class HistoryRecord:
+    """Um item do histórico de downloads, compacto para históricos grandes.
+
+    Usa ``__slots__``, guarda a data como timestamp inteiro (``data`` só
+    formata quando alguém pede) e o diretório do arquivo como uma string
+    compartilhada (``sys.intern``) por todos os itens da mesma pasta. Aceita
+    ``item['title']`` e ``item.get('url')``, como o dicionário que substituiu.
+    """
+
+    __slots__ = ('id', 'title', 'url', 'ts', '_diretorio', '_nome')
+    CAMPOS = ('id', 'title', 'url', 'data', 'arquivo')
+
+    def __init__(self, item_id: int, title: str, url: str, ts: int, arquivo: Optional[str]):
+        self.id = item_id
+        self.title = title
+        self.url = url
+        self.ts = ts
+        if arquivo:
+            diretorio, self._nome = os.path.split(arquivo)
+            self._diretorio = sys.intern(diretorio)
+        else:
+            self._diretorio, self._nome = None, arquivo
+
+    @property
+    def arquivo(self) -> Optional[str]:
+        if self._diretorio is None:
+            return self._nome
+        return os.path.join(self._diretorio, self._nome)
+
+    @property
+    def data(self) -> str:
+        return _formatar_data(self.ts)
+
+    def __getitem__(self, chave: str):
+        if chave not in self.CAMPOS:
+            raise KeyError(chave)
+        return getattr(self, chave)
+
+    def get(self, chave: str, padrao=None):
+        return getattr(self, chave) if chave in self.CAMPOS else padrao
+
+    def como_dict(self) -> Dict:
+        return {chave: getattr(self, chave) for chave in self.CAMPOS}
+
+    def __repr__(self) -> str:
+        return f"HistoryRecord({self.como_dict()!r})"
+
+
+class HistoryStore:
+    """Histórico de downloads em SQLite, só com inserções.
+
+    Cada download é um ``INSERT`` (O(1)) em vez de reescrever o arquivo todo.
+    Há índices por URL, título e data, e ``listar(desde_id=...)`` devolve só o
+    que entrou depois da última leitura. Na primeira execução o antigo
+    ``historico_downloads.json`` é importado e renomeado para ``.migrado``.
+    """
+
+    def __init__(self, db: Database, arquivo_json: Optional[str] = None):
+        self.db = db
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS historico (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                video_id TEXT,
+                ts INTEGER NOT NULL,
+                arquivo TEXT
+            );
+            CREATE INDEX IF NOT EXISTS historico_url ON historico(url);
+            CREATE INDEX IF NOT EXISTS historico_video_id ON historico(video_id);
+            CREATE INDEX IF NOT EXISTS historico_title ON historico(title COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS historico_ts ON historico(ts);
+        """)
+        if arquivo_json:
+            self.migrar_json(arquivo_json)
+
+    @staticmethod
+    def _item(linha: sqlite3.Row) -> HistoryRecord:
+        return HistoryRecord(linha['id'], linha['title'], linha['url'], linha['ts'], linha['arquivo'])
+
+    def migrar_json(self, arquivo_json: str) -> int:
+        """Importa o histórico JSON antigo, uma única vez."""
+        if not os.path.exists(arquivo_json):
+            return 0
         try:
-            search = VideosSearch(query, limit=1)
-            results = search.result()
+            with open(arquivo_json, 'r', encoding='utf-8') as f:
+                itens = json.load(f)
+        except json.JSONDecodeError:
+            print("Erro ao carregar histórico antigo. Ele não será importado.")
+            itens = []
+        self.db.executar_varios(
+            "INSERT INTO historico (title, url, video_id, ts, arquivo) VALUES (?, ?, ?, ?, ?)",
+            [(item.get('title', ''), item.get('url', ''), extrair_video_id(item.get('url', '')),
+              _ler_data(item.get('data')), item.get('arquivo')) for item in itens],
+        )
+        os.replace(arquivo_json, arquivo_json + ".migrado")
+        print(f"Histórico migrado para o banco de dados: {len(itens)} itens")
+        return len(itens)
 
-            if not results['result']:
-                print("Nenhum resultado encontrado.")
+    def adicionar(self, title: str, url: str, arquivo: str, ts: Optional[int] = None) -> HistoryRecord:
+        """Acrescenta um download ao histórico e retorna o item gravado."""
+        ts = ts or int(time.time())
+        cursor = self.db.executar(
+            "INSERT INTO historico (title, url, video_id, ts, arquivo) VALUES (?, ?, ?, ?, ?)",
+            (title, url, extrair_video_id(url), ts, arquivo),
+        )
+        return HistoryRecord(cursor.lastrowid, title, url, ts, arquivo)
+
+    def listar(self, desde_id: int = 0) -> List[HistoryRecord]:
+        """Itens em ordem de inserção, a partir do id seguinte a ``desde_id``."""
+        linhas = self.db.consultar("SELECT * FROM historico WHERE id > ? ORDER BY id", (desde_id,))
+        return [self._item(linha) for linha in linhas]
+
+    def ids(self, desde_id: int = 0) -> "array":
+        """Só os ids dos itens depois de ``desde_id``, em ordem, num ``array`` de inteiros."""
+        ids = array('q')
+        ids.extend(linha[0] for linha in
+                   self.db.consultar("SELECT id FROM historico WHERE id > ? ORDER BY id", (desde_id,)))
+        return ids
+
+    def intervalo(self, primeiro_id: int, ultimo_id: int) -> List[HistoryRecord]:
+        """Itens com id entre ``primeiro_id`` e ``ultimo_id`` (inclusive), em ordem."""
+        linhas = self.db.consultar(
+            "SELECT id, title, url, ts, arquivo FROM historico WHERE id BETWEEN ? AND ? ORDER BY id",
+            (primeiro_id, ultimo_id),
+        )
+        return [self._item(linha) for linha in linhas]
+
+    def atualizar_arquivo(self, item_id: int, arquivo: str):
+        """Corrige o caminho do MP3 de um item (por exemplo, quando o arquivo foi renomeado)."""
+        self.db.executar("UPDATE historico SET arquivo = ? WHERE id = ?", (arquivo, item_id))
+
+    def trocar_arquivo(self, antigo: str, novo: Optional[str]) -> int:
+        """Aponta para ``novo`` todos os itens que usavam ``antigo`` e retorna quantos mudaram."""
+        return self.db.executar("UPDATE historico SET arquivo = ? WHERE arquivo = ?", (novo, antigo)).rowcount
+
+    def por_url(self, url: str) -> List[HistoryRecord]:
+        video_id = extrair_video_id(url)
+        if video_id:
+            linhas = self.db.consultar("SELECT * FROM historico WHERE video_id = ? ORDER BY id", (video_id,))
+        else:
+            linhas = self.db.consultar("SELECT * FROM historico WHERE url = ? ORDER BY id", (url,))
+        return [self._item(linha) for linha in linhas]
+
+    def por_titulo(self, trecho: str) -> List[HistoryRecord]:
+        """Itens cujo título começa com ``trecho`` (sem diferenciar maiúsculas)."""
+        linhas = self.db.consultar(
+            "SELECT * FROM historico WHERE title >= ? COLLATE NOCASE AND title < ? COLLATE NOCASE ORDER BY id",
+            (trecho, trecho + "\uffff"),
+        )
+        return [self._item(linha) for linha in linhas]
+
+    def entre_datas(self, inicio: datetime, fim: datetime) -> List[HistoryRecord]:
+        linhas = self.db.consultar(
+            "SELECT * FROM historico WHERE ts BETWEEN ? AND ? ORDER BY ts",
+            (int(inicio.timestamp()), int(fim.timestamp())),
+        )
+        return [self._item(linha) for linha in linhas]
+
+    def __len__(self) -> int:
+        return self.db.consultar("SELECT COUNT(*) FROM historico")[0][0]
+
+
+class HistoryPages:
+    """O histórico como uma sequência somente leitura, lida do banco em páginas.
+
+    Só os ids ficam todos na memória (num ``array``, 8 bytes por item). Os
+    itens são lidos em páginas de ``TAMANHO_PAGINA`` quando alguém os acessa,
+    e só as ``MAX_PAGINAS`` usadas por último ficam guardadas. ``atualizar``
+    acrescenta o que entrou no banco desde a última leitura.
+    """
+
+    TAMANHO_PAGINA = 256
+    MAX_PAGINAS = 16
+
+    def __init__(self, store: HistoryStore):
+        self.store = store
+        self._ids = store.ids()
+        self._paginas: "OrderedDict[int, List[HistoryRecord]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def atualizar(self) -> List[HistoryRecord]:
+        """Lê do banco os itens que entraram desde a última leitura e os retorna."""
+        with self._lock:
+            novos = self.store.listar(desde_id=self._ids[-1] if self._ids else 0)
+            # Completa a última página, se estiver em cache, em vez de relê-la
+            ultima = self._paginas.get((len(self._ids) - 1) // self.TAMANHO_PAGINA) if self._ids else None
+            if ultima is not None:
+                ultima.extend(novos[:self.TAMANHO_PAGINA - len(ultima)])
+            self._ids.extend(item.id for item in novos)
+            return novos
+
+    @property
+    def ultimo_id(self) -> int:
+        return self._ids[-1] if self._ids else 0
+
+    def trocar_arquivo(self, antigo: str, novo: Optional[str]) -> int:
+        """``HistoryStore.trocar_arquivo`` que também descarta as páginas em cache."""
+        with self._lock:
+            alterados = self.store.trocar_arquivo(antigo, novo)
+            if alterados:
+                self._paginas.clear()
+            return alterados
+
+    def _pagina(self, numero: int) -> List[HistoryRecord]:
+        with self._lock:
+            pagina = self._paginas.get(numero)
+            if pagina is not None:
+                self._paginas.move_to_end(numero)
+                return pagina
+            inicio = numero * self.TAMANHO_PAGINA
+            fim = min(inicio + self.TAMANHO_PAGINA, len(self._ids)) - 1
+            pagina = self.store.intervalo(self._ids[inicio], self._ids[fim])
+            self._paginas[numero] = pagina
+            while len(self._paginas) > self.MAX_PAGINAS:
+                self._paginas.popitem(last=False)
+            return pagina
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self[i] for i in range(*indice.indices(len(self._ids)))]
+        if indice < 0:
+            indice += len(self._ids)
+        if not 0 <= indice < len(self._ids):
+            raise IndexError(indice)
+        return self._pagina(indice // self.TAMANHO_PAGINA)[indice % self.TAMANHO_PAGINA]
+
+    def __iter__(self):
+        for indice in range(len(self._ids)):
+            yield self[indice]
+
+
+class SearchCache:
+    """Cache em disco de resultados de busca, com validade (TTL) e limite LRU.
+
+    A chave é a busca normalizada (``normalizar_busca``). Uma entrada gravada
+    com ``limite`` resultados atende qualquer pedido de até ``limite``.
+    """
+
+    def __init__(self, db: Database, ttl: int = 7 * 24 * 3600, max_itens: int = 5000):
+        self.db = db
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.falhas = 0
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS busca_cache (
+                chave TEXT PRIMARY KEY,
+                limite INTEGER NOT NULL,
+                resultados TEXT NOT NULL,
+                criado INTEGER NOT NULL,
+                acessado INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS busca_cache_acessado ON busca_cache(acessado);
+        """)
+
+    def obter(self, query: str, limite: int) -> Optional[List[Dict]]:
+        chave = normalizar_busca(query)
+        agora = int(time.time())
+        linhas = self.db.consultar("SELECT * FROM busca_cache WHERE chave = ?", (chave,))
+        if not linhas or linhas[0]['criado'] + self.ttl < agora or linhas[0]['limite'] < limite:
+            self.falhas += 1
+            return None
+        self.acertos += 1
+        self.db.executar("UPDATE busca_cache SET acessado = ? WHERE chave = ?", (agora, chave))
+        return json.loads(linhas[0]['resultados'])[:limite]
+
+    def guardar(self, query: str, limite: int, resultados: List[Dict]):
+        agora = int(time.time())
+        self.db.executar(
+            "INSERT OR REPLACE INTO busca_cache VALUES (?, ?, ?, ?, ?)",
+            (normalizar_busca(query), limite, json.dumps(resultados, ensure_ascii=False), agora, agora),
+        )
+        excesso = len(self) - self.max_itens
+        if excesso > 0:
+            self.db.executar(
+                "DELETE FROM busca_cache WHERE chave IN "
+                "(SELECT chave FROM busca_cache ORDER BY acessado LIMIT ?)", (excesso,))
+
+    def limpar_expirados(self):
+        self.db.executar("DELETE FROM busca_cache WHERE criado < ?", (int(time.time()) - self.ttl,))
+
+    def __len__(self) -> int:
+        return self.db.consultar("SELECT COUNT(*) FROM busca_cache")[0][0]
+
+
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+
+def _cabecalho_mp3(dados, pos: int) -> Optional[Tuple[int, int, int, int]]:
+    """Decodifica o cabeçalho de frame MPEG em ``pos``.
+
+    Retorna (tamanho do frame, amostras por frame, taxa de amostragem,
+    tamanho do side info) ou ``None`` se não houver um frame válido ali.
+    """
+    if pos + 4 > len(dados) or dados[pos] != 0xFF or dados[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b2, b3, b4 = dados[pos + 1], dados[pos + 2], dados[pos + 3]
+    versao = {0: 25, 2: 2, 3: 1}.get((b2 >> 3) & 3)
+    camada = {1: 3, 2: 2, 3: 1}.get((b2 >> 1) & 3)
+    indice_bitrate, indice_taxa = (b3 >> 4) & 0xF, (b3 >> 2) & 3
+    if versao is None or camada is None or indice_bitrate in (0, 15) or indice_taxa == 3:
+        return None
+    bitrate = _BITRATES[(1 if versao == 1 else 2, camada)][indice_bitrate] * 1000
+    taxa = _SAMPLE_RATES[versao][indice_taxa]
+    padding = (b3 >> 1) & 1
+    mono = (b4 >> 6) & 3 == 3
+    if camada == 1:
+        amostras = 384
+        tamanho = (12 * bitrate // taxa + padding) * 4
+    else:
+        amostras = 1152 if camada == 2 or versao == 1 else 576
+        tamanho = amostras // 8 * bitrate // taxa + padding
+    if versao == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    return tamanho, amostras, taxa, side_info
+
+
+def duracao_mp3(arquivo: str) -> float:
+    """Duração do MP3 em segundos, lida dos cabeçalhos sem decodificar o áudio.
+
+    Usa o cabeçalho Xing/Info ou VBRI do primeiro frame quando existe; senão
+    percorre os cabeçalhos dos frames (só pula de um frame para o outro).
+    """
+    with open(arquivo, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0.0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as dados:
+            pos = 0
+            if dados[:3] == b'ID3' and len(dados) >= 10:
+                tamanho_tag = ((dados[6] & 0x7F) << 21 | (dados[7] & 0x7F) << 14 |
+                               (dados[8] & 0x7F) << 7 | (dados[9] & 0x7F))
+                pos = 10 + tamanho_tag + (10 if dados[5] & 0x10 else 0)
+
+            # Primeiro frame: exige que o próximo cabeçalho também seja válido
+            while True:
+                pos = dados.find(b'\xff', pos)
+                if pos < 0:
+                    return 0.0
+                cabecalho = _cabecalho_mp3(dados, pos)
+                if cabecalho and (pos + cabecalho[0] >= len(dados) or
+                                  _cabecalho_mp3(dados, pos + cabecalho[0])):
+                    break
+                pos += 1
+
+            tamanho, amostras, taxa, side_info = cabecalho
+            xing = pos + 4 + side_info
+            if dados[xing:xing + 4] in (b'Xing', b'Info'):
+                flags = struct.unpack('>I', dados[xing + 4:xing + 8])[0]
+                if flags & 1:
+                    return struct.unpack('>I', dados[xing + 8:xing + 12])[0] * amostras / taxa
+            vbri = pos + 4 + 32
+            if dados[vbri:vbri + 4] == b'VBRI':
+                return struct.unpack('>I', dados[vbri + 14:vbri + 18])[0] * amostras / taxa
+
+            total = 0.0
+            fim = len(dados) - (128 if dados[-128:-125] == b'TAG' else 0)
+            while pos < fim:
+                cabecalho = _cabecalho_mp3(dados, pos)
+                if cabecalho is None or cabecalho[0] <= 0:
+                    pos = dados.find(b'\xff', pos + 1, fim)
+                    if pos < 0:
+                        break
+                    continue
+                total += cabecalho[1] / cabecalho[2]
+                pos += cabecalho[0]
+            return total
+
+
+class DurationService:
+    """Duração dos MP3 a partir dos cabeçalhos, com cache por arquivo.
+
+    A entrada do cache vale enquanto o arquivo tiver a mesma data de
+    modificação e o mesmo tamanho.
+    """
+
+    def __init__(self, max_itens: int = 4096):
+        self.max_itens = max_itens
+        self._cache: "OrderedDict[str, Tuple[float, int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def duracao(self, arquivo: str) -> float:
+        info = os.stat(arquivo)
+        with self._lock:
+            item = self._cache.get(arquivo)
+            if item and item[:2] == (info.st_mtime, info.st_size):
+                self._cache.move_to_end(arquivo)
+                return item[2]
+        valor = duracao_mp3(arquivo)
+        with self._lock:
+            self._cache[arquivo] = (info.st_mtime, info.st_size, valor)
+            while len(self._cache) > self.max_itens:
+                self._cache.popitem(last=False)
+        return valor
+
+
+duracoes = DurationService()
+
+
+def ler_metadados_mp3(arquivo: str) -> Dict:
+    """Lê título, artista, duração e ganho ReplayGain do MP3 pelos cabeçalhos e tags ID3."""
+    import eyed3
+    titulo = artista = ganho = None
+    audiofile = eyed3.load(arquivo)
+    if audiofile and audiofile.tag:
+        titulo = audiofile.tag.title
+        artista = audiofile.tag.artist
+        ganho = ler_replaygain(audiofile.tag)[0]
+    return {'titulo': titulo, 'artista': artista, 'duracao': duracoes.duracao(arquivo), 'ganho': ganho}
+
+
+class LibraryIndex:
+    """Índice persistente das músicas do diretório de downloads.
+
+    Guarda caminho, data de modificação, tamanho, título, artista, duração e
+    ganho ReplayGain da faixa (nulo enquanto o arquivo não foi analisado).
+    ``sincronizar`` compara o diretório com o índice e só relê os arquivos
+    novos ou alterados, então abrir o player ou trocar de música não precisa
+    abrir os MP3.
+    """
+
+    def __init__(self, db: Database, diretorio: str):
+        self.db = db
+        self.diretorio = diretorio
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS biblioteca (
+                caminho TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                tamanho INTEGER NOT NULL,
+                titulo TEXT,
+                artista TEXT,
+                duracao REAL,
+                ganho REAL
+            );
+        """)
+        colunas = {linha['name'] for linha in self.db.consultar("PRAGMA table_info(biblioteca)")}
+        if 'ganho' not in colunas:
+            # Índices criados antes do ReplayGain; o ganho fica nulo até a análise de loudness
+            self.db.executar("ALTER TABLE biblioteca ADD COLUMN ganho REAL")
+
+    @staticmethod
+    def _item(linha: sqlite3.Row) -> Dict:
+        return dict(linha)
+
+    def _ler(self, caminho: str, mtime: float, tamanho: int) -> Tuple:
+        try:
+            dados = ler_metadados_mp3(caminho)
+        except Exception:
+            dados = {'titulo': None, 'artista': None, 'duracao': 0.0, 'ganho': None}
+        return (caminho, mtime, tamanho, dados['titulo'], dados['artista'], dados['duracao'], dados['ganho'])
+
+    def sincronizar(self) -> Tuple[List[str], List[str], List[str]]:
+        """Atualiza o índice com o diretório; retorna (novos, alterados, removidos)."""
+        conhecidos = {linha['caminho']: (linha['mtime'], linha['tamanho'])
+                      for linha in self.db.consultar("SELECT caminho, mtime, tamanho FROM biblioteca")}
+        novos, alterados, linhas = [], [], []
+        presentes = set()
+        if os.path.isdir(self.diretorio):
+            with os.scandir(self.diretorio) as entradas:
+                for entrada in entradas:
+                    if not entrada.name.endswith(".mp3") or not entrada.is_file():
+                        continue
+                    info = entrada.stat()
+                    presentes.add(entrada.path)
+                    anterior = conhecidos.get(entrada.path)
+                    if anterior == (info.st_mtime, info.st_size):
+                        continue
+                    (alterados if anterior else novos).append(entrada.path)
+                    linhas.append(self._ler(entrada.path, info.st_mtime, info.st_size))
+        removidos = [caminho for caminho in conhecidos if caminho not in presentes]
+        if linhas:
+            self.db.executar_varios("INSERT OR REPLACE INTO biblioteca VALUES (?, ?, ?, ?, ?, ?, ?)", linhas)
+        if removidos:
+            self.db.executar_varios("DELETE FROM biblioteca WHERE caminho = ?", [(c,) for c in removidos])
+        return novos, alterados, removidos
+
+    def atualizar_arquivo(self, caminho: str) -> Optional[Dict]:
+        """Indexa (ou reindexa) um único arquivo, por exemplo um download recém-concluído."""
+        try:
+            info = os.stat(caminho)
+        except OSError:
+            self.db.executar("DELETE FROM biblioteca WHERE caminho = ?", (caminho,))
+            return None
+        self.db.executar("INSERT OR REPLACE INTO biblioteca VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         self._ler(caminho, info.st_mtime, info.st_size))
+        return self.obter(caminho)
+
+    def obter(self, caminho: str) -> Optional[Dict]:
+        linhas = self.db.consultar("SELECT * FROM biblioteca WHERE caminho = ?", (caminho,))
+        return self._item(linhas[0]) if linhas else None
+
+    def sem_ganho(self) -> List[str]:
+        """Arquivos que ainda não têm ganho ReplayGain."""
+        return [linha['caminho'] for linha in
+                self.db.consultar("SELECT caminho FROM biblioteca WHERE ganho IS NULL ORDER BY caminho")]
+
+    def listar(self) -> List[Dict]:
+        """Todas as músicas indexadas, em ordem de nome de arquivo."""
+        return [self._item(linha) for linha in self.db.consultar("SELECT * FROM biblioteca ORDER BY caminho")]
+
+    def __len__(self) -> int:
+        return self.db.consultar("SELECT COUNT(*) FROM biblioteca")[0][0]
+
+
+ESTADO_NA_FILA = 'na_fila'
+ESTADO_BAIXANDO = 'baixando'
+ESTADO_CONVERTENDO = 'convertendo'
+ESTADO_MARCADO = 'marcado'
+ESTADO_CONCLUIDO = 'concluido'
+ESTADO_FALHOU = 'falhou'
+# Estados finais: o job não volta para a fila ao retomar a execução
+ESTADOS_FINAIS = (ESTADO_CONCLUIDO, ESTADO_FALHOU)
+
+
+class JobJournal:
+    """Diário persistente dos jobs de download, para retomar depois de uma queda.
+
+    Cada execução (uma playlist ou os downloads avulsos de uma sessão) tem
+    seus jobs, que passam por na_fila → baixando → convertendo → marcado →
+    concluido (ou falhou). Cada mudança de estado é gravada na hora, então
+    depois de uma queda dá para saber o que faltou.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS execucoes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origem TEXT,
+                ts INTEGER NOT NULL,
+                concluida INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                execucao INTEGER NOT NULL REFERENCES execucoes(id),
+                url TEXT NOT NULL,
+                video_id TEXT,
+                estado TEXT NOT NULL,
+                arquivo TEXT,
+                erro TEXT,
+                atualizado INTEGER NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_execucao_url ON jobs(execucao, url);
+            CREATE INDEX IF NOT EXISTS jobs_estado ON jobs(execucao, estado);
+        """)
+
+    def nova_execucao(self, origem: Optional[str] = None) -> int:
+        return self.db.executar("INSERT INTO execucoes (origem, ts) VALUES (?, ?)",
+                                (origem, int(time.time()))).lastrowid
+
+    def concluir_execucao(self, execucao: int):
+        self.db.executar("UPDATE execucoes SET concluida = 1 WHERE id = ?", (execucao,))
+
+    def enfileirar(self, execucao: int, url: str, video_id: Optional[str] = None) -> int:
+        """Registra um job na fila; se a execução já tiver esse URL, reaproveita o job."""
+        with self.db.lock:
+            linhas = self.db.consultar("SELECT id, estado FROM jobs WHERE execucao = ? AND url = ?",
+                                       (execucao, url))
+            if linhas:
+                if linhas[0]['estado'] != ESTADO_CONCLUIDO:
+                    self.atualizar(linhas[0]['id'], ESTADO_NA_FILA)
+                return linhas[0]['id']
+            return self.db.executar(
+                "INSERT INTO jobs (execucao, url, video_id, estado, atualizado) VALUES (?, ?, ?, ?, ?)",
+                (execucao, url, video_id, ESTADO_NA_FILA, int(time.time())),
+            ).lastrowid
+
+    def atualizar(self, job_id: int, estado: str, arquivo: Optional[str] = None, erro: Optional[str] = None):
+        self.db.executar(
+            "UPDATE jobs SET estado = ?, arquivo = COALESCE(?, arquivo), erro = ?, atualizado = ? WHERE id = ?",
+            (estado, arquivo, erro, int(time.time()), job_id),
+        )
+
+    def pendentes(self, execucao: int) -> List[Dict]:
+        """Jobs da execução que não chegaram a um estado final (concluído ou falhou)."""
+        return [dict(linha) for linha in self.db.consultar(
+            "SELECT * FROM jobs WHERE execucao = ? AND estado NOT IN (?, ?) ORDER BY id",
+            (execucao, *ESTADOS_FINAIS))]
+
+    def ultima_incompleta(self) -> Optional[Dict]:
+        """A execução mais recente que não terminou ou que tem jobs pendentes.
+
+        Jobs que falharam não contam como pendentes: sem isso, um único vídeo
+        indisponível deixaria a execução "incompleta" para sempre. Execuções
+        avulsas em que só sobraram falhas são marcadas como concluídas.
+        """
+        with self.db.lock:
+            self.db.executar("""
+                UPDATE execucoes SET concluida = 1
+                WHERE origem IS NULL AND concluida = 0
+                  AND NOT EXISTS (SELECT 1 FROM jobs j WHERE j.execucao = execucoes.id AND j.estado NOT IN (?, ?))
+            """, ESTADOS_FINAIS)
+            linhas = self.db.consultar("""
+                SELECT * FROM execucoes e
+                WHERE (e.origem IS NOT NULL AND e.concluida = 0)
+                   OR EXISTS (SELECT 1 FROM jobs j WHERE j.execucao = e.id AND j.estado NOT IN (?, ?))
+                ORDER BY e.id DESC LIMIT 1
+            """, ESTADOS_FINAIS)
+        return dict(linhas[0]) if linhas else None
+
+
+class DownloadIndex:
+    """Índice persistente dos downloads concluídos, indexado pelo ID do vídeo.
+
+    Cada entrada guarda o caminho do MP3, o tamanho e o SHA-256. Uma consulta
+    só é considerada um acerto se o arquivo ainda existir com o mesmo tamanho
+    (e, com ``reverificar=True``, o mesmo checksum).
+    """
+
+    def __init__(self, db: Database, arquivo_json: Optional[str] = None):
+        self.db = db
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS indice (
+                video_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                arquivo TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                sha256 TEXT,
+                ts INTEGER NOT NULL
+            );
+        """)
+        if arquivo_json and os.path.exists(arquivo_json):
+            self._migrar_json(arquivo_json)
+
+    def _migrar_json(self, arquivo_json: str):
+        try:
+            with open(arquivo_json, 'r', encoding='utf-8') as f:
+                entradas = json.load(f)
+        except json.JSONDecodeError:
+            entradas = {}
+        self.db.executar_varios(
+            "INSERT OR IGNORE INTO indice VALUES (?, ?, ?, ?, ?, ?)",
+            [(video_id, e['url'], e['arquivo'], e['tamanho'], e.get('sha256'), _ler_data(e.get('data')))
+             for video_id, e in entradas.items()],
+        )
+        os.replace(arquivo_json, arquivo_json + ".migrado")
+
+    def __len__(self) -> int:
+        return self.db.consultar("SELECT COUNT(*) FROM indice")[0][0]
+
+    def __contains__(self, video_id: str) -> bool:
+        return bool(self.db.consultar("SELECT 1 FROM indice WHERE video_id = ?", (video_id,)))
+
+    def consultar(self, video_id: Optional[str], reverificar: bool = False) -> Optional[str]:
+        """Retorna o caminho do MP3 se o download estiver no índice e íntegro."""
+        if not video_id:
+            return None
+        linhas = self.db.consultar("SELECT * FROM indice WHERE video_id = ?", (video_id,))
+        if not linhas:
+            return None
+        entrada = linhas[0]
+        arquivo = entrada['arquivo']
+        try:
+            if os.path.getsize(arquivo) != entrada['tamanho']:
+                return None
+        except OSError:
+            return None
+        if reverificar or not entrada['sha256']:
+            checksum = calcular_checksum(arquivo)
+            if entrada['sha256'] and checksum != entrada['sha256']:
                 return None
+            if not entrada['sha256']:
+                self.db.executar("UPDATE indice SET sha256 = ? WHERE video_id = ?", (checksum, video_id))
+        return arquivo
+
+    def registrar(self, video_id: str, url: str, arquivo: str,
+                  tamanho: Optional[int] = None, sha256: Optional[str] = None):
+        """Adiciona ou substitui a entrada de um vídeo."""
+        self.db.executar(
+            "INSERT OR REPLACE INTO indice VALUES (?, ?, ?, ?, ?, ?)",
+            (video_id, url, arquivo, tamanho if tamanho is not None else os.path.getsize(arquivo),
+             sha256, int(time.time())),
+        )
+
+    def remover(self, video_id: str):
+        """Remove a entrada de um vídeo, se existir."""
+        self.db.executar("DELETE FROM indice WHERE video_id = ?", (video_id,))
+
+    def remover_arquivo(self, arquivo: str):
+        """Remove as entradas que apontam para ``arquivo``."""
+        self.db.executar("DELETE FROM indice WHERE arquivo = ?", (arquivo,))
+
+    def importar_historico(self, historico: List[Dict]) -> int:
+        """Preenche o índice com os itens do histórico cujo MP3 ainda existe.
+
+        O checksum desses itens fica para a primeira consulta.
+        """
+        linhas = []
+        for item in historico:
+            video_id = extrair_video_id(item.get('url', ''))
+            arquivo = item.get('arquivo')
+            if not video_id or not arquivo:
+                continue
+            try:
+                tamanho = os.path.getsize(arquivo)
+            except OSError:
+                continue
+            linhas.append((video_id, normalizar_url(item['url']), arquivo, tamanho, None,
+                           _ler_data(item.get('data'))))
+        self.db.executar_varios("INSERT OR IGNORE INTO indice VALUES (?, ?, ?, ?, ?, ?)", linhas)
+        return len(linhas)
+
+
+def transcodificar_e_marcar(origem: str, destino: str, info: Dict, replaygain: bool = False,
+                            impressao: bool = False) -> Dict:
+    """Converte o áudio bruto para MP3 320 kbps e grava os metadados.
+
+    Roda num processo separado (``ProcessPoolExecutor``), por isso recebe e
+    devolve apenas dados simples. O MP3 é gravado num arquivo temporário e
+    renomeado no final, e o arquivo bruto é removido. ``tempo_ffmpeg`` e
+    ``tempo_tags`` separam o tempo da conversão e o da gravação das tags.
+    Com ``replaygain=True`` o loudness é medido e gravado antes da renomeação
+    (``ganho`` e ``tempo_loudness`` no resultado). Com ``impressao=True`` a
+    impressão digital do áudio bruto vem em ``impressao`` (None se falhar,
+    com o motivo em ``erro_impressao``).
+    """
+    inicio = time.monotonic()
+    digital, erro_impressao = None, None
+    if impressao:
+        try:
+            digital = calcular_impressao(origem)
+        except Exception as e:
+            erro_impressao = str(e)
+    fim_impressao = time.monotonic()
+    temporario = destino + ".tmp.mp3"
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-i', origem, '-vn',
+         '-codec:a', 'libmp3lame', '-b:a', '320k', temporario],
+        check=True, stdin=subprocess.DEVNULL,
+    )
+    fim_conversao = time.monotonic()
+    adicionar_metadados(temporario, info)
+    fim_tags = time.monotonic()
+    ganho = None
+    if replaygain:
+        loudness = marcar_replaygain(temporario)
+        if loudness['erro']:
+            print(f"Aviso: Não foi possível medir o loudness: {loudness['erro']}")
+        ganho = loudness['ganho']
+    os.replace(temporario, destino)
+    if os.path.abspath(origem) != os.path.abspath(destino):
+        os.remove(origem)
+    return {
+        'arquivo': destino,
+        'tamanho': os.path.getsize(destino),
+        'sha256': calcular_checksum(destino),
+        'tempo': time.monotonic() - inicio,
+        'tempo_impressao': fim_impressao - inicio,
+        'tempo_ffmpeg': fim_conversao - fim_impressao,
+        'tempo_tags': fim_tags - fim_conversao,
+        'tempo_loudness': time.monotonic() - fim_tags,
+        'ganho': ganho,
+        'impressao': digital,
+        'erro_impressao': erro_impressao,
+    }
+
+
+class Histogram:
+    """Histograma com baldes logarítmicos (quatro por oitava, erro de ~19%).
+
+    Guarda só a contagem de cada balde, então o custo de memória não cresce
+    com o número de observações. Os percentis devolvem o limite superior do
+    balde em que caem.
+    """
+
+    DIVISOES_POR_OITAVA = 4
+
+    def __init__(self):
+        self.baldes: Dict[int, int] = {}
+        self.contagem = 0
+        self.soma = 0.0
+        self.minimo = float('inf')
+        self.maximo = 0.0
+
+    def observar(self, valor: float):
+        balde = math.floor(math.log2(valor) * self.DIVISOES_POR_OITAVA) if valor > 0 else -10**6
+        self.baldes[balde] = self.baldes.get(balde, 0) + 1
+        self.contagem += 1
+        self.soma += valor
+        self.minimo = min(self.minimo, valor)
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p: float) -> float:
+        if not self.contagem:
+            return 0.0
+        alvo = p / 100 * self.contagem
+        acumulado = 0
+        for balde in sorted(self.baldes):
+            acumulado += self.baldes[balde]
+            if acumulado >= alvo:
+                return min(2 ** ((balde + 1) / self.DIVISOES_POR_OITAVA), self.maximo)
+        return self.maximo
+
+    def snapshot(self) -> Dict:
+        return {
+            'contagem': self.contagem,
+            'media': self.soma / self.contagem if self.contagem else 0.0,
+            'min': self.minimo if self.contagem else 0.0,
+            'p50': self.percentil(50),
+            'p95': self.percentil(95),
+            'p99': self.percentil(99),
+            'max': self.maximo,
+        }
+
+
+class Metrics:
+    """Interface de métricas do pipeline; esta implementação não faz nada.
+
+    ``span`` mede o tempo de uma etapa de um job (busca, extração, download,
+    transcodificação, tags, histórico). ``incrementar`` soma contadores (bytes
+    recebidos, por exemplo) e ``observar`` alimenta histogramas (vazão,
+    latência). Para mandar as métricas a outro sistema basta herdar desta
+    classe e sobrescrever ``registrar_span``, ``incrementar`` e ``observar``.
+    """
+
+    @contextmanager
+    def span(self, nome: str, **atributos):
+        inicio = time.monotonic()
+        sucesso = False
+        try:
+            yield atributos
+            sucesso = True
+        finally:
+            self.registrar_span(nome, time.monotonic() - inicio, sucesso, **atributos)
+
+    def registrar_span(self, nome: str, duracao: float, sucesso: bool = True, **atributos):
+        """Registra uma etapa já medida (por exemplo, num processo do pool)."""
+
+    def incrementar(self, nome: str, valor: float = 1):
+        pass
 
-            video = results['result'][0]
+    def observar(self, nome: str, valor: float):
+        pass
+
+    def resumo(self) -> Dict:
+        return {}
+
+    def imprimir_resumo(self):
+        pass
+
+    def fechar(self):
+        pass
+
+
+class JsonLinesExporter:
+    """Grava cada evento de métrica como uma linha JSON num arquivo."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._arquivo = open(caminho, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, evento: Dict):
+        linha = json.dumps(evento, ensure_ascii=False)
+        with self._lock:
+            self._arquivo.write(linha + "\n")
+
+    def fechar(self):
+        with self._lock:
+            self._arquivo.close()
+
+
+class MetricsCollector(Metrics):
+    """Agrega spans, contadores e histogramas em memória e repassa aos exportadores.
+
+    Cada span vira um evento ``{"tipo": "span", ...}`` para os exportadores e
+    alimenta o histograma de latência da etapa. Contadores e histogramas só
+    são exportados no evento ``resumo`` gravado por ``fechar``.
+    """
+
+    def __init__(self, exportadores: Optional[List[Callable[[Dict], None]]] = None):
+        self.exportadores = list(exportadores or [])
+        self.contadores: Dict[str, float] = {}
+        self.histogramas: Dict[str, Histogram] = {}
+        self.falhas: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _exportar(self, evento: Dict):
+        for exportador in self.exportadores:
+            try:
+                exportador(evento)
+            except Exception as e:
+                print(f"Erro ao exportar métricas: {str(e)}")
+
+    def _histograma(self, nome: str) -> Histogram:
+        histograma = self.histogramas.get(nome)
+        if histograma is None:
+            histograma = self.histogramas[nome] = Histogram()
+        return histograma
+
+    def registrar_span(self, nome: str, duracao: float, sucesso: bool = True, **atributos):
+        with self._lock:
+            self._histograma(nome).observar(duracao)
+            if not sucesso:
+                self.falhas[nome] = self.falhas.get(nome, 0) + 1
+        if self.exportadores:
+            self._exportar({'tipo': 'span', 'nome': nome, 'duracao': round(duracao, 6),
+                            'sucesso': sucesso, 'ts': time.time(), **atributos})
+
+    def incrementar(self, nome: str, valor: float = 1):
+        with self._lock:
+            self.contadores[nome] = self.contadores.get(nome, 0) + valor
+
+    def observar(self, nome: str, valor: float):
+        with self._lock:
+            self._histograma(nome).observar(valor)
+
+    def resumo(self) -> Dict:
+        with self._lock:
             return {
-                'title': video['title'],
-                'url': video['link'],
-                'duration': video['duration'],
-                'thumbnail': video['thumbnails'][0]['url'],
+                'contadores': dict(self.contadores),
+                'histogramas': {nome: h.snapshot() for nome, h in self.histogramas.items()},
+                'falhas': dict(self.falhas),
             }
-        except Exception as e:
-            print(f"Erro ao buscar música: {str(e)}")
-            return None
 
-    # Restante do código da classe...
-    
-    def baixar_musica(self, url: str) -> Optional[str]:
-        """Baixa uma música a partir da URL do YouTube."""
-        try:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '320',
-                }],
-                'outtmpl': os.path.join(self.diretorio_downloads, '%(title)s.%(ext)s'),
-                'quiet': True,
-                'no_warnings': True,
-                'progress_hooks': [lambda d: self._mostrar_progresso(d)],
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                titulo = info.get('title', 'Música desconhecida')
-                arquivo = os.path.join(self.diretorio_downloads, f"{titulo}.mp3")
-                
-                # Adicionar metadados ao MP3
-                self._adicionar_metadados(arquivo, info)
-                
-                # Registrar no histórico
-                self.historico.append({
-                    'title': titulo,
-                    'url': url,
-                    'data': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-                    'arquivo': arquivo
-                })
-                self.salvar_historico()
-                
-                print(f"\nDownload concluído: {titulo}")
-                print(f"Salvo em: {arquivo}")
-                return arquivo
-                
-        except Exception as e:
-            print(f"Erro ao baixar música: {str(e)}")
-            return None
-    
-    def _mostrar_progresso(self, d):
-        """Callback para mostrar progresso do download."""
-        if d['status'] == 'downloading':
-            p = re.search(r'(\d+\.\d+)%', d.get('_percent_str', '0%'))
-            if p:
-                progresso = float(p.group(1))
-                print(f"Baixando: {progresso:.1f}%", end='\r')
-    
-    def _adicionar_metadados(self, arquivo: str, info: Dict):
-        """Adiciona metadados ao arquivo MP3."""
-        try:
-            audiofile = eyed3.load(arquivo)
-            if audiofile and audiofile.tag:
-                audiofile.tag.title = info.get('title', 'Desconhecido')
-                audiofile.tag.artist = info.get('uploader', 'Desconhecido')
-                audiofile.tag.save()
-        except Exception as e:
-            print(f"Aviso: Não foi possível adicionar metadados: {str(e)}")
-    
-    def baixar_playlist(self, url: str):
-        """Baixa todas as músicas de uma playlist."""
-        try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if 'entries' not in info:
-                    print("Esta URL não parece ser uma playlist válida.")
-                    return
-                
-                total_musicas = len(info['entries'])
-                print(f"\nPlaylist encontrada: {info.get('title', 'Desconhecida')}")
-                print(f"Total de músicas: {total_musicas}")
-                
-                confirmacao = input("Deseja prosseguir com o download? (s/n): ").lower()
-                if confirmacao != 's':
-                    print("Download cancelado.")
-                    return
-                
-                print("\nIniciando downloads...")
-                
-                # Baixar músicas com ThreadPoolExecutor
-                with ThreadPoolExecutor(max_workers=3) as executor:
-                    for i, entry in enumerate(tqdm(info['entries'], desc="Progresso da playlist")):
-                        if entry:
-                            video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                            executor.submit(self.baixar_musica, video_url)
-                
-                print("\nDownload da playlist concluído!")
-                
-        except Exception as e:
-            print(f"Erro ao baixar playlist: {str(e)}")
+    def imprimir_resumo(self):
+        """Mostra percentis de cada etapa e os contadores acumulados."""
+        resumo = self.resumo()
+        for nome, h in sorted(resumo['histogramas'].items()):
+            if not h['contagem']:
+                continue
+            falhas = resumo['falhas'].get(nome, 0)
+            print(f"  {nome}: n={h['contagem']} falhas={falhas} media={h['media']:.3f} "
+                  f"p50={h['p50']:.3f} p95={h['p95']:.3f} max={h['max']:.3f}")
+        for nome, valor in sorted(resumo['contadores'].items()):
+            print(f"  {nome}: {valor:.0f}")
+
+    def fechar(self):
+        if self.exportadores:
+            self._exportar({'tipo': 'resumo', 'ts': time.time(), **self.resumo()})
+        for exportador in self.exportadores:
+            if hasattr(exportador, 'fechar'):
+                exportador.fechar()
+        self.exportadores = []
+
+
+LOUDNESS_REFERENCIA = -18.0  # LUFS, referência do ReplayGain 2.0
+TAXA_LOUDNESS = 48000
+
+# Filtro de ponderação K da ITU-R BS.1770 a 48 kHz: shelving de altas e passa-altas (RLB)
+_FILTRO_K = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+
+def _resposta_k(n: int):
+    """|H|² da ponderação K nas frequências de uma ``rfft`` de ``n`` pontos a 48 kHz.
+
+    Já inclui o peso de cada frequência na soma de Parseval, então a potência
+    média de um bloco de ``n`` amostras é ``sum(|rfft|² * resposta) / n²``.
+    """
+    import numpy as np
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n))
+    resposta = np.ones(len(z))
+    for b, a in _FILTRO_K:
+        h = (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+        resposta = resposta * np.abs(h) ** 2
+    pesos = np.full(len(z), 2.0)
+    pesos[0] = 1.0
+    if n % 2 == 0:
+        pesos[-1] = 1.0
+    return resposta * pesos
+
+
+def _canais_audio(arquivo: str) -> int:
+    """Número de canais do primeiro stream de áudio, pelo ffprobe (2 se não der para ler)."""
+    try:
+        saida = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=channels',
+             '-of', 'csv=p=0', arquivo],
+            capture_output=True, text=True, check=True, stdin=subprocess.DEVNULL,
+        ).stdout
+        return int(saida.strip().split()[0])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return 2
+
+
+def _ler_pcm(arquivo: str, taxa: int, canais: int, quadros_por_leitura: int,
+             segundos: Optional[float] = None):
+    """Decodifica o arquivo com o FFmpeg e entrega o PCM float32 intercalado em pedaços.
+
+    Cada pedaço tem ``quadros_por_leitura`` quadros (o último pode ter
+    menos); ``segundos`` limita o trecho decodificado ao começo do arquivo.
+    """
+    import numpy as np
+    comando = ['ffmpeg', '-v', 'error', '-i', arquivo, '-vn']
+    if segundos:
+        comando += ['-t', str(segundos)]
+    comando += ['-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(canais), '-ar', str(taxa), '-']
+    processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    try:
+        while True:
+            dados = processo.stdout.read(quadros_por_leitura * canais * 4)
+            if not dados:
+                break
+            yield np.frombuffer(dados, dtype='<f4')
+    finally:
+        processo.stdout.close()
+        processo.wait()
+    if processo.returncode:
+        raise RuntimeError(f"FFmpeg terminou com código {processo.returncode}")
+
+
+def medir_loudness(arquivo: str, segundos_por_leitura: float = 10.0) -> Dict:
+    """Loudness integrado (EBU R128 / BS.1770) e pico de amostra do arquivo.
+
+    O FFmpeg decodifica para PCM float a 48 kHz e o áudio é lido em pedaços
+    de ``segundos_por_leitura``, então a memória não depende da duração. Cada
+    pedaço vira uma matriz de sub-blocos de 100 ms; a ponderação K é aplicada
+    no domínio da frequência (uma ``rfft`` por sub-bloco, tudo vetorizado) e
+    só a potência de cada sub-bloco é guardada. Os blocos de 400 ms com passo
+    de 100 ms saem da média de quatro sub-blocos, seguidos do gate absoluto
+    (-70 LUFS) e do relativo (-10 LU). Por filtrar cada sub-bloco isoladamente
+    o resultado pode diferir do filtro IIR contínuo; em ruído com um trecho
+    abaixo do gate a diferença medida ficou abaixo de 0,001 LU.
+    """
+    import numpy as np
+    canais = _canais_audio(arquivo)
+    sub_bloco = TAXA_LOUDNESS // 10
+    quadros_por_leitura = sub_bloco * max(1, int(segundos_por_leitura * 10))
+    resposta = _resposta_k(sub_bloco)[None, :, None]
+    potencias = []
+    pico = 0.0
+    for amostras in _ler_pcm(arquivo, TAXA_LOUDNESS, canais, quadros_por_leitura):
+        if len(amostras):
+            pico = max(pico, float(np.abs(amostras).max()))
+        n = len(amostras) // (canais * sub_bloco)
+        if not n:
+            continue  # Sobra final menor que 100 ms não entra em nenhum bloco
+        x = amostras[:n * sub_bloco * canais].reshape(n, sub_bloco, canais)
+        espectro = np.fft.rfft(x, axis=1)
+        potencia = (espectro.real ** 2 + espectro.imag ** 2) * resposta
+        # Em MP3 (mono ou estéreo) todos os canais têm peso 1
+        potencias.append(potencia.sum(axis=(1, 2)) / sub_bloco ** 2)
+
+    z = np.concatenate(potencias) if potencias else np.zeros(0)
+    resultado = {'loudness': None, 'ganho': 0.0, 'pico': pico}
+    if len(z) < 4:
+        return resultado
+    blocos = np.convolve(z, np.full(4, 0.25), mode='valid')
+    nivel = -0.691 + 10 * np.log10(np.maximum(blocos, 1e-20))
+    acima = nivel > -70.0
+    if not acima.any():
+        return resultado  # Silêncio: nada a corrigir
+    relativo = -0.691 + 10 * np.log10(blocos[acima].mean()) - 10.0
+    integrado = float(-0.691 + 10 * np.log10(blocos[acima & (nivel > relativo)].mean()))
+    resultado['loudness'] = integrado
+    resultado['ganho'] = LOUDNESS_REFERENCIA - integrado
+    return resultado
+
+
+def ler_replaygain(tag) -> Tuple[Optional[float], Optional[float]]:
+    """(ganho em dB, pico) das tags TXXX REPLAYGAIN_TRACK_*, ou None onde faltar."""
+    valores = []
+    for descricao in ('REPLAYGAIN_TRACK_GAIN', 'REPLAYGAIN_TRACK_PEAK'):
+        frame = tag.user_text_frames.get(descricao)
+        try:
+            valores.append(float(frame.text.replace('dB', '').strip()) if frame else None)
+        except ValueError:
+            valores.append(None)
+    return valores[0], valores[1]
+
+
+def marcar_replaygain(arquivo: str, refazer: bool = False) -> Dict:
+    """Mede o loudness e grava as tags ReplayGain da faixa.
+
+    Roda num processo separado. Arquivos que já têm ganho gravado só são
+    medidos de novo com ``refazer=True``. Erros voltam em ``erro``.
+    """
+    import eyed3
+    resultado = {'arquivo': arquivo, 'ganho': None, 'pico': None, 'medido': False, 'erro': None}
+    try:
+        audiofile = eyed3.load(arquivo)
+        if audiofile is None:
+            raise ValueError("não é um MP3 válido")
+        if audiofile.tag is None:
+            audiofile.initTag()
+        ganho, pico = ler_replaygain(audiofile.tag)
+        if ganho is None or refazer:
+            medida = medir_loudness(arquivo)
+            ganho, pico = medida['ganho'], medida['pico']
+            audiofile.tag.user_text_frames.set(f"{ganho:+.2f} dB", 'REPLAYGAIN_TRACK_GAIN')
+            audiofile.tag.user_text_frames.set(f"{pico:.6f}", 'REPLAYGAIN_TRACK_PEAK')
+            audiofile.tag.save()
+            resultado['medido'] = True
+        resultado['ganho'], resultado['pico'] = ganho, pico
+    except Exception as e:
+        resultado['erro'] = str(e)
+    return resultado
+
+
+TAXA_IMPRESSAO = 11025
+JANELA_IMPRESSAO = 4096
+PASSO_IMPRESSAO = JANELA_IMPRESSAO // 3  # ~8 quadros por segundo
+SEGUNDOS_IMPRESSAO = 120
+BITS_ESBOCO = 128
+FAIXAS_LSH = 8  # 8 faixas de 16 bits do esboço
+
+
+def _cromagrama(x):
+    """Energia por classe de altura (12 notas) de cada quadro do sinal mono ``x``.
+
+    Espectrograma com janelas de Hann de 4096 amostras e 2/3 de sobreposição,
+    calculado de uma vez com ``sliding_window_view`` e ``rfft``; as
+    frequências de 28 Hz a 3,5 kHz são somadas na nota mais próxima.
+    """
+    import numpy as np
+    if len(x) < JANELA_IMPRESSAO:
+        return np.zeros((0, 12))
+    quadros = np.lib.stride_tricks.sliding_window_view(x, JANELA_IMPRESSAO)[::PASSO_IMPRESSAO]
+    espectro = np.abs(np.fft.rfft(quadros * np.hanning(JANELA_IMPRESSAO), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(JANELA_IMPRESSAO, 1 / TAXA_IMPRESSAO)
+    usadas = (freqs >= 28) & (freqs <= 3520)
+    notas = np.round(12 * np.log2(freqs[usadas] / 440)).astype(int) % 12
+    mapa = np.zeros((usadas.sum(), 12))
+    mapa[np.arange(len(notas)), notas] = 1.0
+    croma = espectro[:, usadas] @ mapa
+    return croma / (np.linalg.norm(croma, axis=1, keepdims=True) + 1e-12)
+
+
+def _planos_esboco():
+    """Hiperplanos fixos do SimHash (a semente não pode mudar, ou os esboços gravados deixam de valer)."""
+    import numpy as np
+    return np.random.default_rng(1770).standard_normal((BITS_ESBOCO, 90))
+
+
+def calcular_impressao(arquivo: str) -> Dict:
+    """Impressão digital do áudio, no estilo do Chromaprint, e um esboço para o índice LSH.
+
+    Usa os primeiros ``SEGUNDOS_IMPRESSAO`` segundos em mono a 11 kHz. Cada
+    quadro do cromagrama (suavizado em 4 quadros) vira uma palavra de 32
+    bits: 12 comparações entre notas vizinhas, 12 entre o quadro e o
+    anterior e 8 entre notas a uma terça maior. O esboço é um SimHash de 128
+    bits de estatísticas do cromagrama que não dependem do alinhamento
+    (média, desvio e correlação entre notas), então versões da mesma música
+    com introduções diferentes ainda caem nos mesmos baldes.
+    Roda num processo separado e devolve só bytes e números.
+    """
+    import numpy as np
+    partes = list(_ler_pcm(arquivo, TAXA_IMPRESSAO, 1, TAXA_IMPRESSAO * 10, SEGUNDOS_IMPRESSAO))
+    x = np.concatenate(partes) if partes else np.zeros(0, dtype='<f4')
+    croma = _cromagrama(x)
+    if len(croma) < 8:
+        raise ValueError("áudio curto demais para a impressão digital")
+    acumulado = np.cumsum(np.vstack([np.zeros((1, 12)), croma]), axis=0)
+    suave = (acumulado[4:] - acumulado[:-4]) / 4
+    atual, anterior = suave[1:], suave[:-1]
+    bits = np.hstack([
+        atual > np.roll(atual, -1, axis=1),
+        atual > anterior,
+        atual[:, :8] > atual[:, 4:12],
+    ])
+    palavras = np.packbits(bits, axis=1, bitorder='little').view('<u4').ravel()
+
+    def centrar(v):
+        v = v - v.mean()
+        return v / (np.linalg.norm(v) + 1e-12)
+    correlacao = np.corrcoef(croma.T)[np.triu_indices(12, 1)]
+    caracteristicas = np.concatenate([centrar(croma.mean(axis=0)), centrar(croma.std(axis=0)),
+                                      centrar(np.nan_to_num(correlacao))])
+    esboco = np.packbits(_planos_esboco() @ caracteristicas > 0)
+    return {'dados': palavras.tobytes(), 'esboco': esboco.tobytes(),
+            'duracao': len(x) / TAXA_IMPRESSAO}
+
+
+def comparar_impressoes(a: bytes, b: bytes, max_deslocamento: int = 240,
+                        minimo: int = 80) -> Tuple[float, int]:
+    """Semelhança (1 - taxa de bits diferentes) no melhor alinhamento e o deslocamento em quadros.
+
+    Testa deslocamentos de até ``max_deslocamento`` quadros (~30 s) e exige
+    pelo menos ``minimo`` quadros (~10 s) em comum. Áudios sem relação ficam
+    perto de 0.5.
+    """
+    import numpy as np
+    x = np.frombuffer(a, dtype='<u4')
+    y = np.frombuffer(b, dtype='<u4')
+    melhor, deslocamento = 0.0, 0
+    for d in range(-max_deslocamento, max_deslocamento + 1):
+        xs = x[max(0, d):]
+        ys = y[max(0, -d):]
+        n = min(len(xs), len(ys))
+        if n < minimo:
+            continue
+        diferentes = np.unpackbits((xs[:n] ^ ys[:n]).view(np.uint8)).sum()
+        semelhanca = 1 - diferentes / (32 * n)
+        if semelhanca > melhor:
+            melhor, deslocamento = semelhanca, d
+    return float(melhor), deslocamento
+
+
+class FingerprintIndex:
+    """Índice de impressões digitais para achar o mesmo áudio com títulos diferentes.
+
+    A impressão completa fica na tabela ``impressoes``; o esboço de 128 bits
+    é dividido em ``FAIXAS_LSH`` faixas de 16 bits gravadas em
+    ``impressoes_lsh`` com índice por (faixa, valor). Uma busca consulta só
+    os baldes das faixas do esboço (sub-linear no tamanho da biblioteca) e
+    compara a impressão completa apenas com os candidatos desses baldes.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS impressoes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                caminho TEXT UNIQUE NOT NULL,
+                video_id TEXT,
+                duracao REAL,
+                esboco BLOB NOT NULL,
+                dados BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS impressoes_lsh (
+                faixa INTEGER NOT NULL,
+                valor INTEGER NOT NULL,
+                impressao INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS impressoes_lsh_balde ON impressoes_lsh(faixa, valor);
+            CREATE INDEX IF NOT EXISTS impressoes_lsh_impressao ON impressoes_lsh(impressao);
+        """)
+
+    @staticmethod
+    def _faixas(esboco: bytes) -> List[Tuple[int, int]]:
+        passo = len(esboco) // FAIXAS_LSH
+        return [(i, int.from_bytes(esboco[i * passo:(i + 1) * passo], 'little')) for i in range(FAIXAS_LSH)]
+
+    def __len__(self) -> int:
+        return self.db.consultar("SELECT COUNT(*) FROM impressoes")[0][0]
+
+    def __contains__(self, caminho: str) -> bool:
+        return bool(self.db.consultar("SELECT 1 FROM impressoes WHERE caminho = ?", (caminho,)))
+
+    def registrar(self, caminho: str, video_id: Optional[str], impressao: Dict):
+        """Adiciona ou substitui a impressão de um arquivo."""
+        self.remover(caminho)
+        cursor = self.db.executar(
+            "INSERT INTO impressoes (caminho, video_id, duracao, esboco, dados) VALUES (?, ?, ?, ?, ?)",
+            (caminho, video_id, impressao['duracao'], impressao['esboco'], impressao['dados']),
+        )
+        self.db.executar_varios("INSERT INTO impressoes_lsh VALUES (?, ?, ?)",
+                                [(faixa, valor, cursor.lastrowid) for faixa, valor in self._faixas(impressao['esboco'])])
+
+    def remover(self, caminho: str):
+        linhas = self.db.consultar("SELECT id FROM impressoes WHERE caminho = ?", (caminho,))
+        for linha in linhas:
+            self.db.executar("DELETE FROM impressoes_lsh WHERE impressao = ?", (linha['id'],))
+            self.db.executar("DELETE FROM impressoes WHERE id = ?", (linha['id'],))
+
+    def procurar(self, impressao: Dict, limiar: float = 0.7, ignorar: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Arquivos com áudio parecido, do mais para o menos semelhante.
+
+        ``limiar`` é a semelhança mínima de ``comparar_impressoes``.
+        """
+        condicoes = " OR ".join(["(faixa = ? AND valor = ?)"] * FAIXAS_LSH)
+        parametros = [v for par in self._faixas(impressao['esboco']) for v in par]
+        linhas = self.db.consultar(
+            f"SELECT caminho, dados FROM impressoes WHERE id IN "
+            f"(SELECT DISTINCT impressao FROM impressoes_lsh WHERE {condicoes})",
+            parametros,
+        )
+        parecidos = []
+        for linha in linhas:
+            if linha['caminho'] == ignorar:
+                continue
+            semelhanca, _ = comparar_impressoes(impressao['dados'], linha['dados'])
+            if semelhanca >= limiar:
+                parecidos.append((linha['caminho'], semelhanca))
+        return sorted(parecidos, key=lambda item: -item[1])
+
+
+def impressao_arquivo(arquivo: str) -> Dict:
+    """``calcular_impressao`` para o pool de processos, devolvendo o erro em vez de propagar."""
+    try:
+        return {'arquivo': arquivo, 'impressao': calcular_impressao(arquivo), 'erro': None}
+    except Exception as e:
+        return {'arquivo': arquivo, 'impressao': None, 'erro': str(e)}
+
+
+def _processar_em_pool(funcao: Callable, tarefas: List[Tuple], workers: int,
+                       ao_concluir: Callable, descricao: str = "Processando"):
+    """Roda ``funcao(*tarefa)`` para cada tarefa num pool de processos.
+
+    No máximo ``workers * 4`` tarefas ficam no pool ao mesmo tempo, então a
+    memória não cresce com o tamanho da lista. ``ao_concluir`` recebe cada
+    resultado nesta thread, na ordem em que terminam.
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    from tqdm import tqdm
+    fila = iter(tarefas)
+    with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(total=len(tarefas), desc=descricao) as barra:
+        em_andamento = set()
+        while True:
+            for tarefa in fila:
+                em_andamento.add(pool.submit(funcao, *tarefa))
+                if len(em_andamento) >= workers * 4:
+                    break
+            if not em_andamento:
+                break
+            prontos, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+            for future in prontos:
+                ao_concluir(future.result())
+                barra.update(1)
+
+
+def reparar_arquivo(arquivo: str, info: Dict, online: bool = False) -> Dict:
+    """Confere as tags de um MP3 da biblioteca e preenche o que faltar.
+
+    Roda num processo separado, como ``transcodificar_e_marcar``. ``info``
+    traz título, URL e ID do vídeo vindos do histórico. Título e artista vazios
+    são preenchidos e a capa é embutida se o arquivo não tiver uma. Com
+    ``online=True`` título, canal e miniatura vêm do yt_dlp; sem isso o artista
+    só é preenchido se ``info`` o tiver e a capa é a miniatura padrão do vídeo.
+    Erros voltam em ``erro``, para um arquivo ruim não interromper a passada.
+    """
+    import eyed3
+    resultado = {'arquivo': arquivo, 'alteracoes': [], 'erro': None}
+    try:
+        if online and info.get('url'):
+            import yt_dlp
+            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'skip_download': True}) as ydl:
+                extraido = ydl.extract_info(info['url'], download=False)
+            info = dict(info, title=extraido.get('title') or info.get('title'),
+                        uploader=extraido.get('uploader'), thumbnail=extraido.get('thumbnail'))
+        elif info.get('video_id') and not info.get('thumbnail'):
+            info = dict(info, thumbnail=f"https://i.ytimg.com/vi/{info['video_id']}/hqdefault.jpg")
+
+        audiofile = eyed3.load(arquivo)
+        if audiofile is None:
+            raise ValueError("não é um MP3 válido")
+        if audiofile.tag is None:
+            audiofile.initTag()
+        tag = audiofile.tag
+        if not tag.title and info.get('title'):
+            tag.title = info['title']
+            resultado['alteracoes'].append('titulo')
+        if not tag.artist and info.get('uploader'):
+            tag.artist = info['uploader']
+            resultado['alteracoes'].append('artista')
+        if info.get('thumbnail') and not any(imagem.image_data for imagem in tag.images):
+            capa = preparar_capa(baixar_imagem(info['thumbnail']))
+            tag.images.set(eyed3.id3.frames.ImageFrame.FRONT_COVER, capa, 'image/jpeg')
+            resultado['alteracoes'].append('capa')
+        if resultado['alteracoes']:
+            tag.save()
+    except Exception as e:
+        resultado['erro'] = str(e)
+    try:
+        estado = os.stat(arquivo)
+        resultado['mtime'], resultado['tamanho'] = estado.st_mtime, estado.st_size
+    except OSError:
+        resultado['mtime'], resultado['tamanho'] = None, None
+    return resultado
+
+
+class LibraryRepair:
+    """Manutenção em lote da biblioteca: tags, caminhos do histórico e órfãos.
+
+    Uma passada faz três coisas:
+
+    * itens do histórico cujo MP3 não existe mais no caminho gravado são
+      procurados pelo caminho do índice de downloads, pelo nome que o yt_dlp
+      daria ao título e pelo título gravado nas tags; quando o arquivo é
+      achado, histórico e índice passam a apontar para ele;
+    * cada MP3 com item no histórico passa por ``reparar_arquivo`` num pool de
+      processos;
+    * MP3 sem item no histórico e itens do histórico sem arquivo são listados
+      como órfãos e ausentes.
+
+    Cada arquivo processado fica na tabela ``reparos`` com mtime e tamanho, e
+    a próxima passada pula os que não mudaram. Com ``limite`` uma biblioteca
+    grande pode ser tratada em várias passadas.
+    """
+
+    def __init__(self, db: Database, historico: HistoryStore, indice: DownloadIndex,
+                 biblioteca: LibraryIndex, nome_arquivo: Callable[[str], str]):
+        self.db = db
+        self.historico = historico
+        self.indice = indice
+        self.biblioteca = biblioteca
+        self.nome_arquivo = nome_arquivo
+        self._checkpoint: List[Tuple] = []
+        self.db.script("""
+            CREATE TABLE IF NOT EXISTS reparos (
+                caminho TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                tamanho INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                alteracoes TEXT,
+                erro TEXT
+            );
+        """)
+
+    def recomecar(self):
+        """Esquece as passadas anteriores; a próxima confere a biblioteca inteira."""
+        self.db.executar("DELETE FROM reparos")
+
+    def _reconciliar(self, musicas: List[Dict]) -> Tuple[Dict[str, Dict], int, List[Dict]]:
+        """Corrige os caminhos do histórico; retorna (info por arquivo, corrigidos, ausentes)."""
+        por_titulo = {}
+        for musica in musicas:
+            if musica['titulo']:
+                por_titulo.setdefault(musica['titulo'].casefold(), musica['caminho'])
+        diretorio = self.biblioteca.diretorio
+        por_arquivo: Dict[str, Dict] = {}
+        corrigidos = 0
+        ausentes = []
+        for item in self.historico.listar():
+            video_id = extrair_video_id(item['url'])
+            arquivo = item['arquivo']
+            if not arquivo or not os.path.exists(arquivo):
+                candidatos = []
+                if video_id:
+                    linhas = self.db.consultar("SELECT arquivo FROM indice WHERE video_id = ?", (video_id,))
+                    candidatos.extend(linha['arquivo'] for linha in linhas)
+                candidatos.append(os.path.join(diretorio, self.nome_arquivo(item['title']) + ".mp3"))
+                candidatos.append(por_titulo.get(item['title'].casefold()))
+                encontrado = next((c for c in candidatos if c and os.path.exists(c)), None)
+                if encontrado is None:
+                    ausentes.append(item)
+                    continue
+                self.historico.atualizar_arquivo(item['id'], encontrado)
+                if video_id:
+                    self.indice.registrar(video_id, item['url'], encontrado)
+                arquivo = encontrado
+                corrigidos += 1
+            por_arquivo[arquivo] = {'title': item['title'], 'url': item['url'], 'video_id': video_id}
+        return por_arquivo, corrigidos, ausentes
+
+    def _pendentes(self, arquivos: List[str]) -> List[str]:
+        """Arquivos ainda não conferidos, alterados desde a última passada ou que falharam."""
+        feitos = {linha['caminho']: (linha['mtime'], linha['tamanho'])
+                  for linha in self.db.consultar("SELECT caminho, mtime, tamanho FROM reparos WHERE erro IS NULL")}
+        pendentes = []
+        for arquivo in arquivos:
+            try:
+                estado = os.stat(arquivo)
+            except OSError:
+                continue
+            if feitos.get(arquivo) != (estado.st_mtime, estado.st_size):
+                pendentes.append(arquivo)
+        return pendentes
+
+    def executar(self, workers: Optional[int] = None, online: bool = False,
+                 limite: Optional[int] = None, lote: int = 50) -> Dict:
+        """Faz uma passada e retorna o relatório.
+
+        O progresso é gravado a cada ``lote`` arquivos e quando a passada é
+        interrompida.
+        """
+        self.biblioteca.sincronizar()
+        musicas = self.biblioteca.listar()
+        por_arquivo, corrigidos, ausentes = self._reconciliar(musicas)
+        orfaos = [musica['caminho'] for musica in musicas if musica['caminho'] not in por_arquivo]
+        pendentes = self._pendentes([arquivo for arquivo in por_arquivo if os.path.exists(arquivo)])
+        restantes = 0
+        if limite is not None and len(pendentes) > limite:
+            restantes = len(pendentes) - limite
+            pendentes = pendentes[:limite]
+
+        relatorio = {'verificados': 0, 'alterados': 0, 'alteracoes': {}, 'caminhos_corrigidos': corrigidos,
+                     'falhas': [], 'orfaos': orfaos, 'ausentes': [item['title'] for item in ausentes],
+                     'restantes': restantes}
+        workers = workers or os.cpu_count() or 1
+        try:
+            self._processar(pendentes, por_arquivo, online, workers, relatorio, lote)
+        finally:
+            self._gravar_checkpoint()
+        return relatorio
+
+    def _gravar_checkpoint(self):
+        if self._checkpoint:
+            self.db.executar_varios("INSERT OR REPLACE INTO reparos VALUES (?, ?, ?, ?, ?, ?)", self._checkpoint)
+            self._checkpoint = []
+
+    def _processar(self, pendentes: List[str], por_arquivo: Dict[str, Dict], online: bool,
+                   workers: int, relatorio: Dict, lote: int):
+        """Passa os arquivos pelo pool e junta os resultados no relatório."""
+        def concluir(r: Dict):
+            relatorio['verificados'] += 1
+            if r['erro']:
+                relatorio['falhas'].append((r['arquivo'], r['erro']))
+            if r['alteracoes']:
+                relatorio['alterados'] += 1
+                for alteracao in r['alteracoes']:
+                    relatorio['alteracoes'][alteracao] = relatorio['alteracoes'].get(alteracao, 0) + 1
+                self.biblioteca.atualizar_arquivo(r['arquivo'])
+            if r['mtime'] is not None:
+                self._checkpoint.append((r['arquivo'], r['mtime'], r['tamanho'], int(time.time()),
+                                         ",".join(r['alteracoes']), r['erro']))
+            if len(self._checkpoint) >= lote:
+                self._gravar_checkpoint()
+
+        _processar_em_pool(reparar_arquivo, [(arquivo, por_arquivo[arquivo], online) for arquivo in pendentes],
+                           workers, concluir, "Reparando")
+
+
+class StageStats:
+    """Contadores e tempos de um estágio do pipeline de download."""
+
+    def __init__(self, nome: str, workers: int):
+        self.nome = nome
+        self.workers = workers
+        self.na_fila = 0
+        self.em_execucao = 0
+        self.concluidos = 0
+        self.falhas = 0
+        self.tempo_total = 0.0
+        self.tempo_max = 0.0
+        self._lock = threading.Lock()
+
+    def enfileirar(self):
+        with self._lock:
+            self.na_fila += 1
+
+    def desenfileirar(self):
+        with self._lock:
+            self.na_fila -= 1
+
+    def iniciar(self):
+        with self._lock:
+            self.em_execucao += 1
+
+    def concluir(self, duracao: float, sucesso: bool = True):
+        with self._lock:
+            self.em_execucao -= 1
+            if sucesso:
+                self.concluidos += 1
+            else:
+                self.falhas += 1
+            self.tempo_total += duracao
+            self.tempo_max = max(self.tempo_max, duracao)
+
+    def snapshot(self) -> Dict:
+        """Retorna uma cópia dos contadores do estágio.
+
+        ``fila`` conta os jobs esperando um worker livre, inclusive os que já
+        foram entregues ao pool mas ainda não começaram a rodar.
+        """
+        with self._lock:
+            finalizados = self.concluidos + self.falhas
+            return {
+                'estagio': self.nome,
+                'workers': self.workers,
+                'fila': self.na_fila + max(0, self.em_execucao - self.workers),
+                'ativos': min(self.em_execucao, self.workers),
+                'concluidos': self.concluidos,
+                'falhas': self.falhas,
+                'tempo_medio': self.tempo_total / finalizados if finalizados else 0.0,
+                'tempo_max': self.tempo_max,
+            }
+
+
+class TokenBucket:
+    """Limite de banda compartilhado por todos os downloads (token bucket).
+
+    Cada byte recebido consome um token; os tokens voltam a ``taxa`` bytes por
+    segundo até ``capacidade``. ``consumir`` bloqueia a thread que chamou até
+    haver tokens, o que desacelera aquele download. Com ``taxa=None`` não há
+    limite, mas os bytes continuam sendo contados para medir a vazão total.
+    """
+
+    def __init__(self, taxa: Optional[float] = None, capacidade: Optional[float] = None):
+        self.taxa = taxa
+        self.capacidade = capacidade or (taxa or 0)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.inicio = time.monotonic()
+
+    def consumir(self, quantidade: int):
+        with self._lock:
+            self.total_bytes += quantidade
+        if not self.taxa:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= min(quantidade, self.capacidade):
+                    self._tokens -= quantidade
+                    return
+                espera = (min(quantidade, self.capacidade) - self._tokens) / self.taxa
+            time.sleep(espera)
+
+    def vazao(self) -> float:
+        """Vazão total medida, em bytes por segundo."""
+        duracao = time.monotonic() - self.inicio
+        return self.total_bytes / duracao if duracao > 0 else 0.0
+
+
+class HostRateLimiter:
+    """Limita quantas requisições por segundo são feitas a cada host.
+
+    Só as chamadas que passam por ``aguardar`` são limitadas: no
+    ``MusicDownloader``, a extração de metadados e a leitura de playlists. As
+    requisições de mídia (Range e fragmentos) ficam com o yt_dlp, limitadas
+    só pela banda (``TokenBucket``).
+    """
+
+    def __init__(self, requisicoes_por_segundo: float = 2.0):
+        self.intervalo = 1.0 / requisicoes_por_segundo if requisicoes_por_segundo else 0.0
+        self._proxima: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def aguardar(self, url: str):
+        """Bloqueia até ser a vez de uma nova requisição ao host da URL."""
+        if not self.intervalo:
+            return
+        host = urlparse(url if '://' in url else 'https://' + url).netloc.lower()
+        with self._lock:
+            agora = time.monotonic()
+            horario = max(agora, self._proxima.get(host, 0.0))
+            self._proxima[host] = horario + self.intervalo
+        if horario > agora:
+            time.sleep(horario - agora)
+
+
+_HTTP_429 = re.compile(r'\bHTTP Error 429\b|Too Many Requests')
+
+
+def _eh_limitacao(erro: BaseException) -> bool:
+    """Indica se o erro é uma resposta de limitação do servidor (HTTP 429).
+
+    Confere o status do erro (ou do erro original, que o yt_dlp guarda em
+    ``exc_info``) e só então a mensagem, para não confundir um "429" num ID
+    de vídeo, numa URL ou numa contagem de bytes com limitação.
+    """
+    original = getattr(erro, 'exc_info', None)
+    for candidato in (erro, original[1] if original else None, erro.__cause__):
+        if candidato is not None and getattr(candidato, 'code', None) == 429:
+            return True
+        resposta = getattr(candidato, 'response', None)
+        if resposta is not None and getattr(resposta, 'status', None) == 429:
+            return True
+    return bool(_HTTP_429.search(str(erro)))
+
+
+def com_backoff(funcao: Callable, *args, tentativas: int = 6, base: float = 1.0, maximo: float = 60.0):
+    """Chama ``funcao`` repetindo com backoff exponencial quando o servidor limita.
+
+    Usa "full jitter": espera um tempo aleatório entre 0 e
+    ``min(maximo, base * 2**tentativa)``, para os workers não voltarem todos
+    ao mesmo tempo. Outros erros são propagados na hora.
+    """
+    for tentativa in range(tentativas):
+        try:
+            return funcao(*args)
+        except Exception as e:
+            if not _eh_limitacao(e) or tentativa == tentativas - 1:
+                raise
+            espera = random.uniform(0, min(maximo, base * 2 ** tentativa))
+            print(f"\nServidor limitando requisições; nova tentativa em {espera:.1f}s")
+            time.sleep(espera)
+
+
+class YoutubeDLPool:
+    """Pool de instâncias ``yt_dlp.YoutubeDL`` de vida longa.
+
+    Cada instância é usada por uma thread de cada vez (``with pool.obter()``)
+    e volta para o pool depois, mantendo extratores já inicializados e as
+    conexões HTTP keep-alive abertas para o próximo download. As instâncias
+    são criadas sob demanda, até ``tamanho``.
+    """
+
+    def __init__(self, opcoes: Dict, tamanho: int):
+        self.opcoes = opcoes
+        self.tamanho = tamanho
+        self.criadas = 0
+        self.usos = 0
+        self._livres = queue.LifoQueue()
+        self._todas = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def obter(self):
+        ydl = self._pegar()
+        try:
+            yield ydl
+        finally:
+            self._livres.put(ydl)
+
+    def _pegar(self):
+        try:
+            ydl = self._livres.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                criar = self.criadas < self.tamanho
+                if criar:
+                    self.criadas += 1
+            if criar:
+                import yt_dlp
+                ydl = yt_dlp.YoutubeDL(self.opcoes)
+                with self._lock:
+                    self._todas.append(ydl)
+            else:
+                ydl = self._livres.get()
+        with self._lock:
+            self.usos += 1
+        return ydl
+
+    def fechar(self):
+        """Fecha todas as instâncias (e suas conexões)."""
+        with self._lock:
+            todas, self._todas = self._todas, []
+            self.criadas = 0
+        self._livres = queue.LifoQueue()
+        for ydl in todas:
+            ydl.close()
+
+
+def _encadear(origem: Future, destino: Future, transformar: Callable = None):
+    """Propaga o resultado de ``origem`` para ``destino`` quando terminar."""
+    def copiar(f: Future):
+        if f.cancelled():
+            destino.cancel()
+            return
+        erro = f.exception()
+        if erro is not None:
+            destino.set_exception(erro)
+            return
+        try:
+            resultado = f.result()
+            destino.set_result(transformar(resultado) if transformar else resultado)
+        except BaseException as e:
+            destino.set_exception(e)
+    origem.add_done_callback(copiar)
+
+
+class DownloadSummary:
+    """Resumo de uma execução de downloads: sucessos, falhas e vazão."""
+
+    def __init__(self):
+        self.sucessos: List[Tuple[str, str]] = []
+        self.falhas: List[Tuple[str, str]] = []
+        self.ja_baixados: List[Tuple[str, str]] = []
+        self.inicio = time.monotonic()
+        self.fim: Optional[float] = None
+        self.primeiro_agendamento: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def registrar(self, url: str, future: Future):
+        """Registra o resultado (ou o erro) de um job concluído."""
+        with self._lock:
+            if future.cancelled():
+                self.falhas.append((url, "cancelado"))
+                return
+            erro = future.exception()
+            if erro is not None:
+                self.falhas.append((url, str(erro)))
+            else:
+                self.sucessos.append((url, future.result()))
+
+    def marcar_agendamento(self):
+        """Guarda o momento em que o primeiro job foi agendado."""
+        if self.primeiro_agendamento is None:
+            self.primeiro_agendamento = time.monotonic()
+
+    def registrar_existente(self, url: str, arquivo: str):
+        """Registra um item pulado porque já estava baixado."""
+        with self._lock:
+            self.ja_baixados.append((url, arquivo))
+
+    def finalizar(self):
+        """Marca o fim da execução."""
+        self.fim = time.monotonic()
+
+    @property
+    def total(self) -> int:
+        return len(self.sucessos) + len(self.falhas) + len(self.ja_baixados)
+
+    @property
+    def duracao(self) -> float:
+        return (self.fim or time.monotonic()) - self.inicio
+
+    @property
+    def vazao(self) -> float:
+        """Downloads concluídos com sucesso por minuto."""
+        if self.duracao <= 0:
+            return 0.0
+        return len(self.sucessos) / self.duracao * 60
+
+    def imprimir(self):
+        """Mostra o resumo da execução no terminal."""
+        print(f"\nConcluídos: {len(self.sucessos)} | Já baixados: {len(self.ja_baixados)} | "
+              f"Falhas: {len(self.falhas)} | Tempo: {self.duracao:.1f}s | Vazão: {self.vazao:.1f} músicas/min")
+        if self.primeiro_agendamento is not None:
+            print(f"Primeiro download agendado após {self.primeiro_agendamento - self.inicio:.2f}s")
+        for url, erro in self.falhas:
+            print(f"  Falhou: {url} ({erro})")
+
+
+ESTADO_PAUSADO = 'pausado'
+ESTADO_CANCELADO = 'cancelado'
+
+# Números menores saem primeiro da fila
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 10
+
+
+class DownloadJob:
+    """Um job na ``DownloadQueue``; ``future`` termina com o resultado da tarefa."""
+
+    def __init__(self, job_id: int, tarefa: Callable[[str], object], url: str, prioridade: int,
+                 descricao: str, ao_sair_da_fila: Optional[Callable[[], None]] = None):
+        self.id = job_id
+        self.tarefa = tarefa
+        self.url = url
+        self.prioridade = prioridade
+        self.descricao = descricao
+        self.estado = ESTADO_NA_FILA
+        self.future = Future()
+        self._ao_sair_da_fila = ao_sair_da_fila
+
+    def __lt__(self, outro: "DownloadJob") -> bool:
+        return (self.prioridade, self.id) < (outro.prioridade, outro.id)
+
+    def sair_da_fila(self):
+        """Avisa (uma vez só) que o job começou ou foi cancelado antes de começar."""
+        if self._ao_sair_da_fila is not None:
+            funcao, self._ao_sair_da_fila = self._ao_sair_da_fila, None
+            funcao()
+
+    def como_dict(self) -> Dict:
+        return {'id': self.id, 'url': self.url, 'descricao': self.descricao,
+                'prioridade': self.prioridade, 'estado': self.estado}
+
+
+class DownloadQueue:
+    """Fila de downloads com prioridade, compartilhada por todo o ``MusicDownloader``.
+
+    Os workers sempre pegam o job de menor ``prioridade`` (e, no empate, o
+    mais antigo), então um download pedido na interface passa na frente das
+    entradas de playlist que ainda estão esperando; os que já começaram não
+    são interrompidos. Jobs na fila podem ser pausados, retomados e
+    cancelados, e ``pausar()`` sem id segura a fila inteira. Cada mudança
+    chama as funções de ``ouvintes`` (de qualquer thread).
+    """
+
+    MAX_RECENTES = 20
+
+    def __init__(self, max_workers: int = 3):
+        if max_workers < 1:
+            raise ValueError("max_workers deve ser pelo menos 1")
+        self.max_workers = max_workers
+        self.pausada = False
+        self.ouvintes: List[Callable[[], None]] = []
+        self._heap: List[DownloadJob] = []
+        self._pausados: Dict[int, DownloadJob] = {}
+        self._jobs: Dict[int, DownloadJob] = {}  # na fila, pausados ou em andamento
+        self._recentes: "OrderedDict[int, DownloadJob]" = OrderedDict()
+        self._proximo_id = 1
+        self._workers: List[threading.Thread] = []
+        self._encerrando = False
+        self._cond = threading.Condition()
+
+    def garantir_workers(self, quantidade: int):
+        """Sobe o número de workers para pelo menos ``quantidade``."""
+        with self._cond:
+            self.max_workers = max(self.max_workers, quantidade)
+            self._encerrando = False
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._executar, name=f"download-{len(self._workers)}",
+                                          daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def enviar(self, tarefa: Callable[[str], object], url: str, prioridade: int = PRIORIDADE_LOTE,
+               descricao: Optional[str] = None,
+               ao_sair_da_fila: Optional[Callable[[], None]] = None) -> DownloadJob:
+        """Põe ``tarefa(url)`` na fila e retorna o job. Não bloqueia."""
+        self.garantir_workers(self.max_workers)
+        with self._cond:
+            job = DownloadJob(self._proximo_id, tarefa, url, prioridade, descricao or url, ao_sair_da_fila)
+            self._proximo_id += 1
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, job)
+            self._cond.notify()
+        job.future.add_done_callback(lambda _f: self._finalizado(job))
+        self._avisar()
+        return job
+
+    def cancelar(self, job_id: int) -> bool:
+        """Cancela um job que ainda não começou; retorna se conseguiu."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.estado not in (ESTADO_NA_FILA, ESTADO_PAUSADO):
+                return False
+            # Jobs cancelados continuam no heap e são descartados quando saem
+            self._pausados.pop(job_id, None)
+            job.estado = ESTADO_CANCELADO
+        job.sair_da_fila()
+        job.future.cancel()
+        return True
+
+    def pausar(self, job_id: Optional[int] = None) -> bool:
+        """Pausa um job que ainda não começou, ou a fila inteira se ``job_id`` for None."""
+        with self._cond:
+            if job_id is None:
+                self.pausada = True
+            else:
+                job = self._jobs.get(job_id)
+                if job is None or job.estado != ESTADO_NA_FILA:
+                    return False
+                job.estado = ESTADO_PAUSADO
+                self._pausados[job_id] = job
+        self._avisar()
+        return True
+
+    def retomar(self, job_id: Optional[int] = None) -> bool:
+        """Devolve um job pausado à fila (na mesma posição), ou solta a fila inteira."""
+        with self._cond:
+            if job_id is None:
+                self.pausada = False
+            else:
+                job = self._pausados.pop(job_id, None)
+                if job is None:
+                    return False
+                job.estado = ESTADO_NA_FILA
+                heapq.heappush(self._heap, job)
+            self._cond.notify_all()
+        self._avisar()
+        return True
+
+    def estado(self) -> List[Dict]:
+        """Jobs em andamento, depois os da fila na ordem em que vão sair, depois os terminados."""
+        with self._cond:
+            ativos = [job for job in self._jobs.values() if job.estado in (ESTADO_BAIXANDO, ESTADO_CONVERTENDO)]
+            esperando = sorted(job for job in self._jobs.values() if job.estado in (ESTADO_NA_FILA, ESTADO_PAUSADO))
+            recentes = list(reversed(self._recentes.values()))
+            return [job.como_dict() for job in ativos + esperando + recentes]
+
+    def encerrar(self):
+        """Cancela o que ainda está na fila e espera os workers terminarem o job atual."""
+        with self._cond:
+            esperando = [job for job in self._jobs.values() if job.estado in (ESTADO_NA_FILA, ESTADO_PAUSADO)]
+        for job in esperando:
+            self.cancelar(job.id)
+        with self._cond:
+            self._encerrando = True
+            self._cond.notify_all()
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join()
+
+    def _avisar(self):
+        for ouvinte in list(self.ouvintes):
+            try:
+                ouvinte()
+            except Exception as e:
+                print(f"Aviso: Erro ao avisar mudança na fila: {str(e)}")
+
+    def _proximo(self) -> Optional[DownloadJob]:
+        """Espera e tira do heap o próximo job a executar; None para encerrar o worker."""
+        with self._cond:
+            while True:
+                if self._encerrando:
+                    return None
+                while self._heap and self._heap[0].estado != ESTADO_NA_FILA:
+                    heapq.heappop(self._heap)  # cancelado ou pausado
+                if self._heap and not self.pausada:
+                    job = heapq.heappop(self._heap)
+                    job.estado = ESTADO_BAIXANDO
+                    return job
+                self._cond.wait()
+
+    def _executar(self):
+        while True:
+            job = self._proximo()
+            if job is None:
+                return
+            job.sair_da_fila()
+            self._avisar()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                resultado = job.tarefa(job.url)
+            except BaseException as e:
+                job.future.set_exception(e)
+                continue
+            if isinstance(resultado, Future):
+                # O worker fica livre; o job termina quando o próximo estágio terminar
+                if not resultado.done():
+                    job.estado = ESTADO_CONVERTENDO
+                    self._avisar()
+                _encadear(resultado, job.future)
+            else:
+                job.future.set_result(resultado)
+
+    def _finalizado(self, job: DownloadJob):
+        f = job.future
+        with self._cond:
+            if f.cancelled():
+                job.estado = ESTADO_CANCELADO
+            else:
+                job.estado = ESTADO_FALHOU if f.exception() is not None else ESTADO_CONCLUIDO
+            self._jobs.pop(job.id, None)
+            self._recentes[job.id] = job
+            while len(self._recentes) > self.MAX_RECENTES:
+                self._recentes.popitem(last=False)
+        self._avisar()
+
+
+class DownloadScheduler:
+    """Agenda um lote de downloads (por exemplo, uma playlist) numa ``DownloadQueue``.
+
+    ``agendar`` bloqueia quando há ``tamanho_fila`` jobs do lote esperando,
+    então quem produz os jobs (por exemplo, a lista de entradas de uma
+    playlist) nunca fica muito à frente dos workers. Se a tarefa devolver um
+    ``Future`` (o estágio seguinte do pipeline), o worker fica livre na hora e
+    o job só termina quando esse ``Future`` terminar. Sem ``fila``, o lote usa
+    uma fila própria com ``max_workers`` workers; com a fila compartilhada do
+    ``MusicDownloader``, os jobs entram com ``prioridade``.
+    """
+
+    def __init__(self, tarefa: Callable[[str], Optional[str]], max_workers: int = 3,
+                 tamanho_fila: Optional[int] = None,
+                 ao_concluir: Optional[Callable[[str, Future], None]] = None,
+                 estagio: Optional[StageStats] = None,
+                 fila: Optional[DownloadQueue] = None, prioridade: int = PRIORIDADE_LOTE):
+        if max_workers < 1:
+            raise ValueError("max_workers deve ser pelo menos 1")
+        self.tarefa = tarefa
+        self.max_workers = max_workers
+        self.ao_concluir = ao_concluir
+        self.estagio = estagio
+        self.prioridade = prioridade
+        self.resumo = DownloadSummary()
+        self._propria = fila is None
+        self.fila = fila if fila is not None else DownloadQueue(max_workers)
+        self._vagas = threading.Semaphore(tamanho_fila or max_workers * 2)
+        self._pendentes = 0
+        self._sem_pendentes = threading.Condition()
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.encerrar()
+
+    def iniciar(self):
+        """Garante que a fila tenha pelo menos ``max_workers`` workers."""
+        self.fila.garantir_workers(self.max_workers)
+
+    def agendar(self, url: str) -> Future:
+        """Coloca um job na fila, bloqueando enquanto houver jobs demais do lote esperando."""
+        self._vagas.acquire()
+        self.resumo.marcar_agendamento()
+        with self._sem_pendentes:
+            self._pendentes += 1
+        if self.estagio:
+            self.estagio.enfileirar()
+
+        def sair_da_fila():
+            self._vagas.release()
+            if self.estagio:
+                self.estagio.desenfileirar()
+        job = self.fila.enviar(self.tarefa, url, self.prioridade, ao_sair_da_fila=sair_da_fila)
+        job.future.add_done_callback(lambda f: self._concluido(url, f))
+        return job.future
+
+    def encerrar(self):
+        """Espera os jobs pendentes do lote terminarem (e finaliza a fila, se for própria)."""
+        # Jobs encadeados em outro estágio podem terminar depois dos workers
+        with self._sem_pendentes:
+            self._sem_pendentes.wait_for(lambda: self._pendentes == 0)
+        if self._propria:
+            self.fila.encerrar()
+        self.resumo.finalizar()
+
+    def _concluido(self, url: str, future: Future):
+        try:
+            self.resumo.registrar(url, future)
+            if self.ao_concluir:
+                self.ao_concluir(url, future)
+        finally:
+            with self._sem_pendentes:
+                self._pendentes -= 1
+                self._sem_pendentes.notify_all()
+
+
+class MusicDownloader:
+    def __init__(self, max_workers: int = 3, workers_transcodificacao: Optional[int] = None,
+                 limite_banda: Optional[float] = None, requisicoes_por_host: float = 2.0,
+                 metricas: Optional[Metrics] = None, replaygain: bool = False,
+                 duplicatas: Optional[str] = None):
+        self.max_workers = max_workers
+        # Mede o loudness e grava as tags ReplayGain de cada download
+        self.replaygain = replaygain
+        # Spans, contadores e histogramas de cada job (ver Metrics)
+        self.metricas = metricas if metricas is not None else MetricsCollector()
+        # Limites compartilhados por todos os downloads deste processo: banda
+        # para a mídia, requisições por segundo para extração e playlists
+        self.banda = TokenBucket(limite_banda)
+        self.limite_hosts = HostRateLimiter(requisicoes_por_host)
+        self._bytes_vistos: Dict[str, int] = {}
+        self._bytes_lock = threading.Lock()
+        # Instâncias do yt_dlp reaproveitadas entre downloads (ver _buscar_audio)
+        self._ydl_audio: Optional[YoutubeDLPool] = None
+        self._ydl_playlist: Optional[YoutubeDLPool] = None
+        self.workers_transcodificacao = workers_transcodificacao or os.cpu_count() or 1
+        self.diretorio_downloads = os.path.join(os.path.expanduser("~"), "Downloads", "Musicas")
+        self.diretorio_brutos = os.path.join(self.diretorio_downloads, ".brutos")
+        self.arquivo_historico = os.path.join(self.diretorio_downloads, "historico_downloads.json")
+        self.arquivo_indice = os.path.join(self.diretorio_downloads, "indice_downloads.json")
+        self.arquivo_banco = os.path.join(self.diretorio_downloads, "baixador.db")
+        self.criar_diretorio()
+        self.db = Database(self.arquivo_banco)
+        migrando_historico = os.path.exists(self.arquivo_historico)
+        self.historico_store = HistoryStore(self.db, self.arquivo_historico)
+        self.indice = DownloadIndex(self.db, self.arquivo_indice)
+        self._historico_lock = threading.Lock()
+        self.historico = self.carregar_historico()
+        self.cache_busca = SearchCache(self.db)
+        self.biblioteca = LibraryIndex(self.db, self.diretorio_downloads)
+        self.journal = JobJournal(self.db)
+        self.impressoes = FingerprintIndex(self.db)
+        # O que fazer quando o áudio baixado já está na biblioteca com outro título:
+        # None (não verifica), 'avisar', 'pular', 'substituir' ou 'perguntar'
+        if duplicatas == 'perguntar' and not sys.stdin.isatty():
+            print("Aviso: --duplicatas perguntar precisa de um terminal; usando 'avisar'")
+            duplicatas = 'avisar'
+        self.duplicatas = duplicatas
+        # Com 'perguntar', as duplicatas ficam aqui até o lote terminar: os
+        # workers não podem parar esperando o input() do usuário
+        self._duplicatas_pendentes: List[Tuple[str, Optional[str], str, str, str]] = []
+        self._pergunta_lock = threading.Lock()
+        self._execucao_avulsa: Optional[int] = None
+        # Função (query, limite) -> lista de resultados; pode ser trocada por um backend falso
+        self.backend_busca: Callable[[str, int], List[Dict]] = buscar_videos
+        if migrando_historico and not os.path.exists(self.arquivo_indice + ".migrado"):
+            self.indice.importar_historico(self.historico)
+        # Fila única de downloads: os pedidos da interface passam na frente das playlists
+        self.fila = DownloadQueue(self.max_workers)
+        # Downloads em andamento por ID, para não baixar o mesmo vídeo duas vezes
+        self._em_andamento: Dict[str, Future] = {}
+        self._em_andamento_lock = threading.Lock()
+
+        # Pipeline em dois estágios: threads para a rede, processos para o FFmpeg
+        self.estagio_download = StageStats("download", self.max_workers)
+        self.estagio_transcodificacao = StageStats("transcodificacao", self.workers_transcodificacao)
+        self._pool_transcodificacao: Optional[ProcessPoolExecutor] = None
+        # Threads que terminam cada conversão (duplicatas, índice, histórico),
+        # fora da thread de resultados do pool de processos
+        self._executor_finalizacao: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # Limita quantos áudios brutos podem esperar pelo FFmpeg ao mesmo tempo
+        self._vagas_transcodificacao = threading.BoundedSemaphore(self.workers_transcodificacao * 2)
+
+    def criar_diretorio(self):
+        """Cria o diretório de downloads se não existir."""
+        if not os.path.exists(self.diretorio_downloads):
+            os.makedirs(self.diretorio_downloads)
+            print(f"Diretório criado: {self.diretorio_downloads}")
+        os.makedirs(self.diretorio_brutos, exist_ok=True)
+
+    def carregar_historico(self) -> HistoryPages:
+        """Abre o histórico de downloads do banco de dados, lido em páginas sob demanda."""
+        return HistoryPages(self.historico_store)
+
+    def atualizar_historico(self) -> List[HistoryRecord]:
+        """Traz para ``self.historico`` só os itens novos e os retorna."""
+        with self._historico_lock:
+            return self.historico.atualizar()
+
+    def buscar_musica(self, query: str) -> Optional[Dict]:
+        """Busca uma música no YouTube usando youtube-search-python."""
+        try:
+            resultados = self._buscar(query, 1)
+
+            if not resultados:
+                print("Nenhum resultado encontrado.")
+                return None
+
+            return resultados[0]
+        except Exception as e:
+            print(f"Erro ao buscar música: {str(e)}")
+            return None
+
+    def _buscar(self, query: str, limite: int) -> List[Dict]:
+        """Busca passando pelo cache em disco."""
+        with self.metricas.span('busca', query=query) as atributos:
+            resultados = self.cache_busca.obter(query, limite)
+            atributos['cache'] = resultados is not None
+            if resultados is None:
+                resultados = self.backend_busca(query, limite)
+                self.cache_busca.guardar(query, limite, resultados)
+        return resultados
+
+    async def buscar_musicas_async(self, queries: List[str], limite: int = 5,
+                                   max_concorrencia: int = 8) -> Dict[str, List[MusicInfo]]:
+        """Resolve várias buscas ao mesmo tempo, com no máximo ``max_concorrencia`` em paralelo.
+
+        Retorna, para cada busca, os ``limite`` primeiros resultados. Buscas
+        repetidas (depois de normalizadas) são feitas uma vez só, e o que
+        já está no cache não vai à rede. Uma busca que falha fica com lista vazia.
+        """
+        loop = asyncio.get_running_loop()
+        semaforo = asyncio.Semaphore(max_concorrencia)
+        unicas: Dict[str, str] = {}
+        for query in queries:
+            unicas.setdefault(normalizar_busca(query), query)
+
+        with ThreadPoolExecutor(max_workers=max_concorrencia) as executor:
+            async def resolver(query: str) -> List[MusicInfo]:
+                async with semaforo:
+                    try:
+                        resultados = await loop.run_in_executor(executor, self._buscar, query, limite)
+                    except Exception as e:
+                        print(f"Erro ao buscar '{query}': {str(e)}")
+                        return []
+                return [MusicInfo.from_dict(r) for r in resultados]
+
+            chaves = list(unicas)
+            respostas = await asyncio.gather(*(resolver(unicas[chave]) for chave in chaves))
+
+        por_chave = dict(zip(chaves, respostas))
+        return {query: por_chave[normalizar_busca(query)] for query in queries}
+
+    def buscar_musicas(self, queries: List[str], limite: int = 5,
+                       max_concorrencia: int = 8) -> Dict[str, List[MusicInfo]]:
+        """Versão síncrona de ``buscar_musicas_async``."""
+        return asyncio.run(self.buscar_musicas_async(queries, limite, max_concorrencia))
+
+    # Restante do código da classe...
+    
+    def baixar_musica(self, url: str, forcar: bool = False, reverificar: bool = False) -> Optional[str]:
+        """Baixa uma música a partir da URL do YouTube.
+
+        Se o vídeo já estiver no índice de downloads e o MP3 estiver íntegro,
+        retorna o arquivo existente sem baixar nada. ``reverificar`` confere
+        também o checksum e ``forcar`` baixa de novo de qualquer forma.
+        """
+        try:
+            return self._baixar_musica(url, forcar, reverificar)
+        except Exception as e:
+            print(f"Erro ao baixar música: {str(e)}")
+            return None
+
+    def _baixar_musica(self, url: str, forcar: bool = False, reverificar: bool = False) -> str:
+        """Baixa uma música e propaga qualquer erro para quem chamou."""
+        return self.enfileirar_download(url, forcar=forcar, reverificar=reverificar).future.result()
+
+    def enfileirar_download(self, url: str, descricao: Optional[str] = None,
+                            prioridade: int = PRIORIDADE_INTERATIVA, forcar: bool = False,
+                            reverificar: bool = False) -> DownloadJob:
+        """Põe o download de uma música na fila compartilhada e retorna o job sem esperar.
+
+        Com a prioridade padrão ele passa na frente das entradas de playlist
+        que ainda não começaram. ``job.future`` termina com o caminho do MP3.
+        """
+        return self.fila.enviar(lambda u: self._baixar_musica_async(u, forcar, reverificar),
+                                url, prioridade, descricao)
+
+    def _baixar_musica_async(self, url: str, forcar: bool = False, reverificar: bool = False,
+                             execucao: Optional[int] = None) -> Future:
+        """Baixa o áudio bruto nesta thread e agenda a conversão para MP3.
+
+        Retorna um ``Future`` que termina quando o MP3 estiver pronto, com
+        metadados e registrado no histórico. A thread que chamou fica livre
+        assim que o download bruto termina. Acertos no índice e pedidos
+        repetidos de um vídeo que já está sendo baixado não baixam de novo.
+        Cada etapa fica registrada no diário de jobs da ``execucao``.
+        """
+        url = normalizar_url(url)
+        video_id = extrair_video_id(url)
+        if execucao is None:
+            execucao = self._execucao_sessao()
+        job_id = self.journal.enfileirar(execucao, url, video_id)
+        if not forcar:
+            existente = self.indice.consultar(video_id, reverificar)
+            if existente:
+                print(f"Já baixado: {existente}")
+                self.journal.atualizar(job_id, ESTADO_CONCLUIDO, existente)
+                resultado = Future()
+                resultado.set_result(existente)
+                return resultado
+        resultado = self._compartilhar_download(url, video_id, job_id)
+
+        def registrar_fim(f: Future):
+            if f.cancelled() or f.exception() is not None:
+                erro = "cancelado" if f.cancelled() else str(f.exception())
+                self.journal.atualizar(job_id, ESTADO_FALHOU, erro=erro)
+            else:
+                self.journal.atualizar(job_id, ESTADO_CONCLUIDO, f.result())
+        resultado.add_done_callback(registrar_fim)
+        return resultado
+
+    def _execucao_sessao(self) -> int:
+        """Execução do diário que agrupa os downloads avulsos desta sessão."""
+        with self._em_andamento_lock:
+            if self._execucao_avulsa is None:
+                self._execucao_avulsa = self.journal.nova_execucao()
+            return self._execucao_avulsa
+
+    def _compartilhar_download(self, url: str, video_id: Optional[str], job_id: int) -> Future:
+        """Inicia o download ou reaproveita o que já está em andamento para o vídeo."""
+        if not video_id:
+            return self._iniciar_download(url, None, job_id)
+
+        with self._em_andamento_lock:
+            andamento = self._em_andamento.get(video_id)
+            if andamento is not None:
+                return andamento
+            resultado = Future()
+            resultado.set_running_or_notify_cancel()
+            self._em_andamento[video_id] = resultado
+
+        def liberar(_f: Future):
+            with self._em_andamento_lock:
+                self._em_andamento.pop(video_id, None)
+        resultado.add_done_callback(liberar)
+        try:
+            _encadear(self._iniciar_download(url, video_id, job_id), resultado)
+        except BaseException as e:
+            resultado.set_exception(e)
+        return resultado
+
+    def _iniciar_download(self, url: str, video_id: Optional[str], job_id: int) -> Future:
+        """Baixa o áudio bruto e entrega a conversão ao pool de processos."""
+        self.journal.atualizar(job_id, ESTADO_BAIXANDO)
+        info, bruto = self._buscar_audio(url)
+        titulo = info.get('title', 'Música desconhecida')
+        self.journal.atualizar(job_id, ESTADO_CONVERTENDO, bruto)
+        arquivo = os.path.join(self.diretorio_downloads, self._nome_arquivo(titulo) + ".mp3")
+        metadados = {
+            'title': titulo,
+            'uploader': info.get('uploader', 'Desconhecido'),
+            'thumbnail': info.get('thumbnail'),
+        }
+
+        finalizacao = self._pool_finalizacao()
+        self._vagas_transcodificacao.acquire()
+        self.estagio_transcodificacao.iniciar()
+        try:
+            conversao = self._pool().submit(transcodificar_e_marcar, bruto, arquivo, metadados, self.replaygain,
+                                            bool(self.duplicatas))
+        except BaseException:
+            self._vagas_transcodificacao.release()
+            self.estagio_transcodificacao.concluir(0.0, sucesso=False)
+            raise
+
+        def liberar(f: Future):
+            self._vagas_transcodificacao.release()
+            sucesso = not f.cancelled() and f.exception() is None
+            self.estagio_transcodificacao.concluir(f.result()['tempo'] if sucesso else 0.0, sucesso)
+            if sucesso:
+                r = f.result()
+                self.metricas.registrar_span('transcodificacao', r['tempo_ffmpeg'], video_id=video_id)
+                self.metricas.registrar_span('tags', r['tempo_tags'], video_id=video_id)
+                if self.replaygain:
+                    self.metricas.registrar_span('loudness', r['tempo_loudness'], video_id=video_id)
+                self.metricas.incrementar('bytes_mp3', r['tamanho'])
+                self.journal.atualizar(job_id, ESTADO_MARCADO, r['arquivo'])
+            else:
+                self.metricas.registrar_span('transcodificacao', 0.0, False, video_id=video_id)
+
+        def finalizar(r: Dict) -> str:
+            # Roda no pool de finalização: a impressão foi calculada no mesmo
+            # processo, então nenhum worker de download fica esperando o pool
+            duplicata = self._procurar_duplicata(video_id, r) if self.duplicatas else None
+            acao = self._decidir_duplicata(titulo, duplicata) if duplicata else None
+            if acao == 'pular':
+                os.remove(r['arquivo'])
+                if video_id:
+                    self.indice.registrar(video_id, url, duplicata)
+                print(f"Pulado: '{titulo}' tem o mesmo áudio de {duplicata}")
+                return duplicata
+            with self.metricas.span('historico', video_id=video_id):
+                if video_id:
+                    self.indice.registrar(video_id, url, r['arquivo'], r['tamanho'], r['sha256'])
+                if r['impressao']:
+                    self.impressoes.registrar(r['arquivo'], video_id, r['impressao'])
+                if duplicata:
+                    if acao == 'substituir':
+                        self._remover_arquivo(duplicata, r['arquivo'])
+                    elif acao == 'perguntar':
+                        with self._pergunta_lock:
+                            self._duplicatas_pendentes.append((titulo, video_id, url, r['arquivo'], duplicata))
+                return self._registrar_download(url, titulo, r['arquivo'])
+
+        resultado = Future()
+        resultado.set_running_or_notify_cancel()
+
+        def concluir(f: Future):
+            try:
+                liberar(f)
+            except Exception as e:
+                print(f"Aviso: Erro ao registrar a conversão: {str(e)}")
+            _encadear(f, resultado, finalizar)
+
+        # O callback roda na thread de resultados do pool de processos, que
+        # não pode ficar presa no banco ou no disco: ele só repassa o trabalho
+        conversao.add_done_callback(lambda f: finalizacao.submit(concluir, f))
+        return resultado
+
+    def _procurar_duplicata(self, video_id: Optional[str], r: Dict) -> Optional[str]:
+        """Procura na biblioteca o mesmo áudio do MP3 recém-convertido.
+
+        ``r`` é o resultado de ``transcodificar_e_marcar``, que já traz a
+        impressão do áudio bruto. Retorna o arquivo mais parecido (que não seja
+        o próprio MP3) ou None; se a impressão falhou o download segue normalmente.
+        """
+        self.metricas.registrar_span('impressao', r['tempo_impressao'], r['impressao'] is not None,
+                                     video_id=video_id)
+        if r['impressao'] is None:
+            print(f"Aviso: Não foi possível verificar duplicatas: {r['erro_impressao']}")
+            return None
+        try:
+            parecidos = self.impressoes.procurar(r['impressao'], ignorar=r['arquivo'])
+        except Exception as e:
+            print(f"Aviso: Não foi possível verificar duplicatas: {str(e)}")
+            return None
+        return parecidos[0][0] if parecidos else None
+
+    def _decidir_duplicata(self, titulo: str, duplicata: str) -> str:
+        """Aplica a política de duplicatas: 'pular', 'substituir', 'perguntar' ou 'manter'.
+
+        'perguntar' não pergunta nada aqui (isto roda nos workers): o download
+        segue e a pergunta fica para ``resolver_duplicatas``.
+        """
+        if self.duplicatas in ('pular', 'substituir', 'perguntar'):
+            return self.duplicatas
+        print(f"Aviso: '{titulo}' parece ter o mesmo áudio de {duplicata}")
+        return 'manter'
+
+    def resolver_duplicatas(self):
+        """Pergunta, na thread principal, o que fazer com as duplicatas do lote.
+
+        Só tem efeito com ``duplicatas='perguntar'``; deve ser chamado depois
+        que os downloads terminarem.
+        """
+        with self._pergunta_lock:
+            pendentes, self._duplicatas_pendentes = self._duplicatas_pendentes, []
+        for titulo, video_id, url, arquivo, duplicata in pendentes:
+            if not (os.path.exists(arquivo) and os.path.exists(duplicata)):
+                continue
+            resposta = input(f"\n'{titulo}' tem o mesmo áudio de {os.path.basename(duplicata)}. "
+                             f"(p)ular o novo, (s)ubstituir o antigo ou (m)anter os dois? ").strip().lower()
+            if resposta[:1] == 'p':
+                self._remover_arquivo(arquivo, duplicata)
+                if video_id:
+                    self.indice.registrar(video_id, url, duplicata)
+            elif resposta[:1] == 's':
+                self._remover_arquivo(duplicata, arquivo)
+
+    def _remover_arquivo(self, arquivo: str, substituto: str):
+        """Apaga um MP3 repetido e o tira da biblioteca, do índice e das impressões.
+
+        Os itens do histórico que apontavam para ele passam a apontar para
+        ``substituto``, o arquivo com o mesmo áudio que ficou.
+        """
+        try:
+            os.remove(arquivo)
+        except OSError as e:
+            print(f"Aviso: Não foi possível remover {arquivo}: {str(e)}")
+        self.biblioteca.atualizar_arquivo(arquivo)
+        self.indice.remover_arquivo(arquivo)
+        self.impressoes.remover(arquivo)
+        with self._historico_lock:
+            self.historico.trocar_arquivo(arquivo, substituto)
+        print(f"Removido: {arquivo}")
+
+    def indexar_impressoes(self, workers: Optional[int] = None, limite: Optional[int] = None) -> Dict:
+        """Calcula as impressões que faltam na biblioteca e lista os áudios repetidos.
+
+        Arquivos já indexados são pulados, então a biblioteca pode ser tratada
+        em passadas de até ``limite`` arquivos.
+        """
+        self.biblioteca.sincronizar()
+        arquivos = [item['caminho'] for item in self.biblioteca.listar() if item['caminho'] not in self.impressoes]
+        restantes = 0
+        if limite is not None and len(arquivos) > limite:
+            restantes = len(arquivos) - limite
+            arquivos = arquivos[:limite]
+        relatorio = {'indexados': 0, 'duplicatas': [], 'falhas': [], 'restantes': restantes}
+
+        def concluir(r: Dict):
+            if r['erro']:
+                relatorio['falhas'].append((r['arquivo'], r['erro']))
+                return
+            for parecido, semelhanca in self.impressoes.procurar(r['impressao'], ignorar=r['arquivo']):
+                relatorio['duplicatas'].append((r['arquivo'], parecido, semelhanca))
+            self.impressoes.registrar(r['arquivo'], None, r['impressao'])
+            relatorio['indexados'] += 1
+
+        _processar_em_pool(impressao_arquivo, [(arquivo,) for arquivo in arquivos],
+                           workers or self.workers_transcodificacao, concluir, "Impressões")
+        print(f"\nImpressões calculadas: {relatorio['indexados']} | Falhas: {len(relatorio['falhas'])} "
+              f"| Total no índice: {len(self.impressoes)}")
+        for arquivo, parecido, semelhanca in relatorio['duplicatas']:
+            print(f"  Mesmo áudio ({semelhanca:.0%}): {arquivo}\n      {parecido}")
+        for arquivo, erro in relatorio['falhas']:
+            print(f"  Falhou: {arquivo} ({erro})")
+        if restantes:
+            print(f"Faltam {restantes} arquivos; rode de novo para continuar.")
+        return relatorio
+
+    def _buscar_audio(self, url: str) -> Tuple[Dict, str]:
+        """Baixa o melhor stream de áudio sem conversão (estágio de rede).
+
+        O arquivo bruto tem o nome do ID do vídeo e fica como ``.part`` até
+        terminar; se o processo cair, a próxima tentativa continua de onde
+        parou com requisições HTTP Range em vez de baixar tudo de novo.
+        A extração dos metadados e o download são medidos em spans separados.
+        """
+        self.estagio_download.iniciar()
+        inicio = time.monotonic()
+        sucesso = False
+        video_id = extrair_video_id(url)
+        try:
+            with self._pool_ydl_audio().obter() as ydl:
+                def extrair():
+                    self.limite_hosts.aguardar(url)
+                    return ydl.extract_info(url, download=False)
+                with self.metricas.span('extracao', video_id=video_id):
+                    info = com_backoff(extrair)
+                with self.metricas.span('download', video_id=video_id) as atributos:
+                    inicio_download = time.monotonic()
+                    info = com_backoff(lambda: ydl.process_ie_result(info, download=True))
+                    baixados = info.get('requested_downloads') or []
+                    bruto = baixados[0].get('filepath') if baixados else None
+                    bruto = bruto or ydl.prepare_filename(info)
+                    tamanho = os.path.getsize(bruto) if os.path.exists(bruto) else 0
+                    atributos['bytes'] = tamanho
+                    duracao = time.monotonic() - inicio_download
+                    if tamanho and duracao > 0:
+                        self.metricas.observar('vazao_download', tamanho / duracao)
+            sucesso = True
+            return info, bruto
+        finally:
+            self.estagio_download.concluir(time.monotonic() - inicio, sucesso)
+
+    def _pool_ydl_audio(self) -> YoutubeDLPool:
+        """Pool de instâncias do yt_dlp para baixar o áudio bruto."""
+        with self._pool_lock:
+            if self._ydl_audio is None:
+                self._ydl_audio = YoutubeDLPool({
+                    'format': 'bestaudio/best',
+                    'outtmpl': os.path.join(self.diretorio_brutos, '%(id)s.%(ext)s'),
+                    'continuedl': True,
+                    'http_chunk_size': 10 * 1024 * 1024,
+                    'retries': 10,
+                    'fragment_retries': 10,
+                    'quiet': True,
+                    'no_warnings': True,
+                    'progress_hooks': [lambda d: self._mostrar_progresso(d)],
+                }, tamanho=self.max_workers)
+            return self._ydl_audio
+
+    def _pool_ydl_playlist(self) -> YoutubeDLPool:
+        """Pool de instâncias do yt_dlp para listar playlists."""
+        with self._pool_lock:
+            if self._ydl_playlist is None:
+                self._ydl_playlist = YoutubeDLPool({
+                    'quiet': True,
+                    'no_warnings': True,
+                    'extract_flat': True,
+                }, tamanho=1)
+            return self._ydl_playlist
+
+    def _registrar_download(self, url: str, titulo: str, arquivo: str) -> str:
+        """Registra um download concluído no histórico."""
+        self.historico_store.adicionar(titulo, url, arquivo)
+        self.atualizar_historico()
+        self.biblioteca.atualizar_arquivo(arquivo)
+
+        print(f"\nDownload concluído: {titulo}")
+        print(f"Salvo em: {arquivo}")
+        return arquivo
+
+    def _nome_arquivo(self, titulo: str) -> str:
+        """Nome de arquivo seguro para o título, como o yt_dlp faria."""
+        import yt_dlp
+        return yt_dlp.utils.sanitize_filename(titulo)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Pool de processos da transcodificação, criado sob demanda."""
+        with self._pool_lock:
+            if self._pool_transcodificacao is None:
+                self._pool_transcodificacao = ProcessPoolExecutor(max_workers=self.workers_transcodificacao)
+            return self._pool_transcodificacao
+
+    def _pool_finalizacao(self) -> ThreadPoolExecutor:
+        """Pool de threads que finaliza as conversões, criado sob demanda."""
+        with self._pool_lock:
+            if self._executor_finalizacao is None:
+                self._executor_finalizacao = ThreadPoolExecutor(max_workers=self.workers_transcodificacao,
+                                                                       thread_name_prefix="finalizacao")
+            return self._executor_finalizacao
+
+    def estatisticas_pipeline(self) -> List[Dict]:
+        """Profundidade de fila e tempos de cada estágio do pipeline."""
+        return [self.estagio_download.snapshot(), self.estagio_transcodificacao.snapshot()]
+
+    def imprimir_estatisticas_pipeline(self):
+        """Mostra fila, workers ativos e tempos de cada estágio, e a vazão total."""
+        for estagio in self.estatisticas_pipeline():
+            print(f"  {estagio['estagio']}: fila={estagio['fila']} ativos={estagio['ativos']}/"
+                  f"{estagio['workers']} concluidos={estagio['concluidos']} falhas={estagio['falhas']} "
+                  f"tempo medio={estagio['tempo_medio']:.2f}s max={estagio['tempo_max']:.2f}s")
+        limite = f" (limite {self.banda.taxa / 2**20:.2f} MB/s)" if self.banda.taxa else ""
+        print(f"  banda: {self.banda.total_bytes / 2**20:.1f} MB a {self.banda.vazao() / 2**20:.2f} MB/s{limite}")
+        self.metricas.imprimir_resumo()
+
+    def encerrar(self):
+        """Finaliza a fila de downloads e os pools de transcodificação e do yt_dlp.
+
+        Downloads que ainda estavam na fila são cancelados; as conversões
+        pendentes terminam antes.
+
+        Também fecha as métricas, o que grava o resumo nos exportadores.
+        """
+        self.fila.encerrar()
+        with self._pool_lock:
+            if self._pool_transcodificacao is not None:
+                self._pool_transcodificacao.shutdown(wait=True)
+                self._pool_transcodificacao = None
+            if self._executor_finalizacao is not None:
+                self._executor_finalizacao.shutdown(wait=True)
+                self._executor_finalizacao = None
+            for pool in (self._ydl_audio, self._ydl_playlist):
+                if pool is not None:
+                    pool.fechar()
+        self.metricas.fechar()
+        self.db.fechar()
+
+    def _contar_bytes(self, d):
+        """Passa os bytes recebidos desde a última chamada pelo limite de banda."""
+        chave = d.get('tmpfilename') or d.get('filename')
+        baixados = d.get('downloaded_bytes')
+        if not chave or baixados is None:
+            return
+        with self._bytes_lock:
+            # Na primeira chamada o arquivo pode já ter bytes de uma execução anterior
+            anterior = self._bytes_vistos.get(chave, baixados)
+            if d['status'] == 'downloading':
+                self._bytes_vistos[chave] = baixados
+            else:
+                self._bytes_vistos.pop(chave, None)
+        if baixados > anterior:
+            self.metricas.incrementar('bytes_baixados', baixados - anterior)
+            self.banda.consumir(baixados - anterior)
+
+    def _mostrar_progresso(self, d):
+        """Callback para mostrar progresso do download."""
+        self._contar_bytes(d)
+        if d['status'] == 'downloading':
+            baixados = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                print(f"Baixando: {100 * baixados / total:.1f}%", end='\r')
+            else:
+                print(f"Baixando: {baixados / 2**20:.1f} MB", end='\r')
+    
+    def _adicionar_metadados(self, arquivo: str, info: Dict):
+        """Adiciona metadados ao arquivo MP3."""
+        adicionar_metadados(arquivo, info)
+    
+    def baixar_playlist(self, url: str, max_workers: Optional[int] = None,
+                        tamanho_fila: Optional[int] = None, forcar: bool = False,
+                        reverificar: bool = False, execucao: Optional[int] = None,
+                        streaming: bool = False, confirmar: bool = True) -> Optional[DownloadSummary]:
+        """Baixa todas as músicas de uma playlist.
+
+        Os downloads passam por um ``DownloadScheduler`` na fila compartilhada,
+        com prioridade de lote (downloads pedidos na interface passam na
+        frente): a fila ganha pelo menos ``max_workers`` workers, guarda no
+        máximo ``tamanho_fila`` entradas da playlist e a barra de progresso avança quando cada
+        download termina. Entradas que já estão no índice de downloads são
+        puladas (veja ``baixar_musica``). Os jobs ficam no diário de uma nova
+        execução (ou de ``execucao``, ao retomar). Retorna o resumo da execução.
+
+        Com ``streaming=True`` a lista de entradas não é montada antes: cada
+        página da playlist é lida conforme a fila de downloads anda, então o
+        primeiro download começa sem esperar a playlist inteira. Nesse modo o
+        total só é mostrado se o site informar. ``confirmar=False`` não pergunta
+        antes de começar.
+        """
+        from tqdm import tqdm
+        try:
+            # A instância fica reservada enquanto as entradas são lidas
+            with self._pool_ydl_playlist().obter() as ydl:
+                info = self._extrair_playlist(ydl, url, streaming)
+
+                if not info or 'entries' not in info:
+                    print("Esta URL não parece ser uma playlist válida.")
+                    return None
+                
+                if streaming:
+                    entradas = (entry for entry in info['entries'] if entry)
+                    total_musicas = info.get('playlist_count')
+                else:
+                    entradas = [entry for entry in info['entries'] if entry]
+                    total_musicas = len(entradas)
+                print(f"\nPlaylist encontrada: {info.get('title', 'Desconhecida')}")
+                print(f"Total de músicas: {total_musicas if total_musicas is not None else 'desconhecido'}")
+                
+                if confirmar:
+                    confirmacao = input("Deseja prosseguir com o download? (s/n): ").lower()
+                    if confirmacao != 's':
+                        print("Download cancelado.")
+                        return None
+                
+                print("\nIniciando downloads...")
+                
+                if execucao is None:
+                    execucao = self.journal.nova_execucao(url)
+                workers = max_workers or self.max_workers
+                self.estagio_download.workers = workers
+                pool_ydl = self._pool_ydl_audio()
+                pool_ydl.tamanho = max(pool_ydl.tamanho, workers)
+                with tqdm(total=total_musicas, desc="Progresso da playlist") as barra:
+                    scheduler = DownloadScheduler(
+                        lambda u: self._baixar_musica_async(u, forcar, reverificar, execucao),
+                        max_workers=workers,
+                        tamanho_fila=tamanho_fila,
+                        ao_concluir=lambda _url, _future: barra.update(1),
+                        estagio=self.estagio_download,
+                        fila=self.fila,
+                    )
+                    with scheduler:
+                        self._agendar_entradas(scheduler, entradas, execucao, forcar, reverificar, barra)
+            
+            self.journal.concluir_execucao(execucao)
+            print("\nDownload da playlist concluído!")
+            scheduler.resumo.imprimir()
+            self.imprimir_estatisticas_pipeline()
+            return scheduler.resumo
+                
+        except Exception as e:
+            print(f"Erro ao baixar playlist: {str(e)}")
+            return None
+
+    def _extrair_playlist(self, ydl, url: str, streaming: bool) -> Optional[Dict]:
+        """Extrai a playlist de ``url`` sem baixar nada.
+
+        Com ``streaming`` usa ``process=False``, que devolve as entradas como
+        gerador, sem resolver a playlist toda. Nesse modo o yt_dlp não segue
+        redirecionamentos: URLs como ``watch?v=...&list=...`` ou as do
+        music.youtube.com voltam como ``_type`` ``url``/``url_transparent``,
+        sem ``entries``, e são seguidas aqui até aparecer a playlist.
+        """
+        ie_key = None
+        for _ in range(5):  # limite contra redirecionamentos em ciclo
+            self.limite_hosts.aguardar(url)
+            info = com_backoff(lambda: ydl.extract_info(url, download=False, process=not streaming,
+                                                        ie_key=ie_key))
+            if not info or 'entries' in info or info.get('_type') not in ('url', 'url_transparent'):
+                return info
+            url, ie_key = info['url'], info.get('ie_key')
+        return None
+
+    def _agendar_entradas(self, scheduler: DownloadScheduler, entradas, execucao: int,
+                          forcar: bool, reverificar: bool, barra):
+        """Envia as entradas da playlist ao scheduler, pulando as que já estão no índice.
+
+        ``entradas`` pode ser um gerador; ``scheduler.agendar`` bloqueia com a
+        fila cheia, então só são lidas as entradas que cabem na fila.
+        """
+        for entry in entradas:
+            video_id = entry.get('id') or extrair_video_id(entry.get('url', ''))
+            if not video_id:
+                continue
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            existente = None if forcar else self.indice.consultar(video_id, reverificar)
+            if existente:
+                scheduler.resumo.registrar_existente(video_url, existente)
+                barra.update(1)
+            else:
+                self.journal.enfileirar(execucao, video_url, video_id)
+                scheduler.agendar(video_url)
+
+    def servir_biblioteca(self, host: str = '0.0.0.0', porta: int = 8000, cache_variantes: int = 2 * 2**30):
+        """Serve a biblioteca por HTTP na rede local até Ctrl+C (veja ``LibraryServer``).
+
+        As variantes de bitrate menor ficam em ``.variantes``, no máximo
+        ``cache_variantes`` bytes; com 0, só os arquivos originais são servidos.
+        """
+        transcodificador = None
+        if cache_variantes:
+            transcodificador = TranscodeCache(os.path.join(self.diretorio_downloads, ".variantes"),
+                                              cache_variantes, metricas=self.metricas)
+        try:
+            LibraryServer(self.biblioteca, self.historico_store, host, porta,
+                          transcodificador=transcodificador).executar()
+        finally:
+            if transcodificador is not None:
+                transcodificador.fechar()
+
+    def reparar_biblioteca(self, workers: Optional[int] = None, online: bool = False,
+                           limite: Optional[int] = None, recomecar: bool = False) -> Dict:
+        """Confere tags, capas e caminhos da biblioteca em lote (veja ``LibraryRepair``).
+
+        Mostra o resumo da passada e retorna o relatório completo.
+        """
+        reparo = LibraryRepair(self.db, self.historico_store, self.indice, self.biblioteca, self._nome_arquivo)
+        if recomecar:
+            reparo.recomecar()
+        relatorio = reparo.executar(workers or self.workers_transcodificacao, online, limite)
+        with self._historico_lock:
+            self.historico = self.carregar_historico()
+
+        alteracoes = ", ".join(f"{nome}: {n}" for nome, n in sorted(relatorio['alteracoes'].items())) or "nenhuma"
+        print(f"\nArquivos conferidos: {relatorio['verificados']} | Alterados: {relatorio['alterados']} ({alteracoes})")
+        print(f"Caminhos corrigidos no histórico: {relatorio['caminhos_corrigidos']}")
+        print(f"Arquivos sem histórico (órfãos): {len(relatorio['orfaos'])}")
+        for arquivo in relatorio['orfaos']:
+            print(f"  {arquivo}")
+        print(f"Itens do histórico sem arquivo: {len(relatorio['ausentes'])}")
+        for titulo in relatorio['ausentes']:
+            print(f"  {titulo}")
+        for arquivo, erro in relatorio['falhas']:
+            print(f"  Falhou: {arquivo} ({erro})")
+        if relatorio['restantes']:
+            print(f"Faltam {relatorio['restantes']} arquivos; rode de novo para continuar.")
+        return relatorio
+
+    def analisar_loudness(self, workers: Optional[int] = None, limite: Optional[int] = None,
+                          refazer: bool = False) -> Dict:
+        """Mede o loudness das músicas da biblioteca e grava as tags ReplayGain.
+
+        Só entram os arquivos sem ganho no índice (ou todos, com ``refazer``),
+        então uma biblioteca grande pode ser tratada em passadas de até
+        ``limite`` arquivos. Cada arquivo é decodificado aos poucos num
+        processo do pool (veja ``medir_loudness``).
+        """
+        self.biblioteca.sincronizar()
+        arquivos = [item['caminho'] for item in self.biblioteca.listar()] if refazer else self.biblioteca.sem_ganho()
+        restantes = 0
+        if limite is not None and len(arquivos) > limite:
+            restantes = len(arquivos) - limite
+            arquivos = arquivos[:limite]
+        relatorio = {'analisados': 0, 'medidos': 0, 'falhas': [], 'restantes': restantes}
+
+        def concluir(r: Dict):
+            relatorio['analisados'] += 1
+            if r['erro']:
+                relatorio['falhas'].append((r['arquivo'], r['erro']))
+                return
+            relatorio['medidos'] += r['medido']
+            self.biblioteca.atualizar_arquivo(r['arquivo'])
+
+        _processar_em_pool(marcar_replaygain, [(arquivo, refazer) for arquivo in arquivos],
+                           workers or self.workers_transcodificacao, concluir, "Loudness")
+        print(f"\nArquivos analisados: {relatorio['analisados']} | Medidos agora: {relatorio['medidos']} "
+              f"| Falhas: {len(relatorio['falhas'])}")
+        for arquivo, erro in relatorio['falhas']:
+            print(f"  Falhou: {arquivo} ({erro})")
+        if restantes:
+            print(f"Faltam {restantes} arquivos; rode de novo para continuar.")
+        return relatorio
+
+    def retomar_ultima_execucao(self, max_workers: Optional[int] = None) -> Optional[DownloadSummary]:
+        """Retoma a última execução que não terminou.
+
+        Para uma playlist, baixa a playlist de novo na mesma execução: o que
+        já foi concluído é pulado pelo índice e os arquivos ``.part`` são
+        continuados. Para downloads avulsos, reenfileira os jobs pendentes.
+        """
+        execucao = self.journal.ultima_incompleta()
+        if not execucao:
+            print("Nenhuma execução para retomar.")
+            return None
+        pendentes = self.journal.pendentes(execucao['id'])
+        print(f"Retomando execução de {_formatar_data(execucao['ts'])}: {len(pendentes)} jobs pendentes")
+
+        if execucao['origem']:
+            return self.baixar_playlist(execucao['origem'], max_workers=max_workers, execucao=execucao['id'],
+                                        streaming=True, confirmar=False)
+
+        scheduler = DownloadScheduler(
+            lambda u: self._baixar_musica_async(u, execucao=execucao['id']),
+            max_workers=max_workers or self.max_workers,
+            estagio=self.estagio_download,
+            fila=self.fila,
+        )
+        with scheduler:
+            for job in pendentes:
+                scheduler.agendar(job['url'])
+        self.journal.concluir_execucao(execucao['id'])
+        scheduler.resumo.imprimir()
+        return scheduler.resumo
+
+VARIANTES = {
+    # nome: (extensão, parâmetros do FFmpeg, Content-Type)
+    'mp3-128': ('mp3', ['-codec:a', 'libmp3lame', '-b:a', '128k'], 'audio/mpeg'),
+    'mp3-96': ('mp3', ['-codec:a', 'libmp3lame', '-b:a', '96k'], 'audio/mpeg'),
+    'opus-64': ('opus', ['-codec:a', 'libopus', '-b:a', '64k'], 'audio/ogg'),
+    'opus-32': ('opus', ['-codec:a', 'libopus', '-b:a', '32k', '-application', 'voip'], 'audio/ogg'),
+}
+
+
+def transcodificar_variante(origem: str, destino: str, variante: str) -> float:
+    """Gera ``destino`` a partir do MP3 ``origem`` na ``variante``; retorna os segundos gastos.
+
+    Grava num temporário e renomeia no final, então quem lê ``destino`` nunca
+    vê um arquivo pela metade. As tags são copiadas; a capa não.
+    """
+    extensao, parametros, _ = VARIANTES[variante]
+    temporario = f"{destino}.{threading.get_ident()}.part"
+    inicio = time.perf_counter()
+    try:
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', origem, '-vn', '-map_metadata', '0',
+             *parametros, '-f', 'ogg' if extensao == 'opus' else extensao, temporario],
+            check=True, stdin=subprocess.DEVNULL,
+        )
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return time.perf_counter() - inicio
+
+
+class TranscodeCache:
+    """Cache em disco das versões de bitrate menor (``VARIANTES``) das músicas.
+
+    Cada variante é gerada pelo FFmpeg na primeira vez que alguém pede e fica
+    em ``diretorio``. Quando o total passa de ``limite_bytes``, as variantes
+    usadas há mais tempo são apagadas (LRU; a ordem sobrevive a reinícios pela
+    data de modificação, que é atualizada a cada acerto). Pedidos simultâneos
+    da mesma variante esperam a mesma codificação em vez de disparar outra.
+    """
+
+    def __init__(self, diretorio: str, limite_bytes: int = 2 * 2**30, workers: int = 2,
+                 metricas: Optional[Metrics] = None):
+        self.diretorio = diretorio
+        self.limite_bytes = limite_bytes
+        self.metricas = metricas or Metrics()
+        os.makedirs(diretorio, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="variantes")
+        self._lock = threading.Lock()
+        self._pendentes: Dict[str, Future] = {}
+        self._entradas: "OrderedDict[str, int]" = OrderedDict()  # nome -> tamanho, do mais antigo ao mais novo
+        self.total_bytes = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.coalescidos = 0
+        self.latencias: List[float] = []
+
+        existentes = []
+        with os.scandir(diretorio) as entradas:
+            for entrada in entradas:
+                if entrada.name.endswith('.part'):
+                    os.remove(entrada.path)
+                elif entrada.is_file():
+                    info = entrada.stat()
+                    existentes.append((info.st_mtime, entrada.name, info.st_size))
+        for _, nome, tamanho in sorted(existentes):
+            self._entradas[nome] = tamanho
+            self.total_bytes += tamanho
+        self._liberar_espaco()
+
+    @staticmethod
+    def _nome(origem: str, variante: str) -> str:
+        """Nome da variante em disco; muda se o MP3 de origem for alterado."""
+        info = os.stat(origem)
+        chave = hashlib.sha1(f"{origem}:{info.st_size}:{info.st_mtime_ns}".encode('utf-8')).hexdigest()[:24]
+        return f"{chave}.{variante}.{VARIANTES[variante][0]}"
+
+    def obter(self, origem: str, variante: str) -> Future:
+        """Future com o caminho da ``variante`` de ``origem``, codificando se preciso.
+
+        Levanta ``KeyError`` para variantes desconhecidas e ``OSError`` se a
+        origem não existir.
+        """
+        if variante not in VARIANTES:
+            raise KeyError(variante)
+        nome = self._nome(origem, variante)
+        caminho = os.path.join(self.diretorio, nome)
+        with self._lock:
+            if nome in self._entradas:
+                self._entradas.move_to_end(nome)
+                self.acertos += 1
+                self.metricas.incrementar('variantes_acertos')
+                try:
+                    os.utime(caminho)
+                except OSError:
+                    pass
+                pronto = Future()
+                pronto.set_result(caminho)
+                return pronto
+            pendente = self._pendentes.get(nome)
+            if pendente is not None:
+                self.coalescidos += 1
+                self.metricas.incrementar('variantes_coalescidas')
+                return pendente
+            self.faltas += 1
+            self.metricas.incrementar('variantes_faltas')
+            pendente = self._executor.submit(self._codificar, origem, nome, variante)
+            self._pendentes[nome] = pendente
+            return pendente
+
+    def _codificar(self, origem: str, nome: str, variante: str) -> str:
+        caminho = os.path.join(self.diretorio, nome)
+        try:
+            duracao = transcodificar_variante(origem, caminho, variante)
+            tamanho = os.path.getsize(caminho)
+        except Exception:
+            self.metricas.incrementar('variantes_falhas')
+            with self._lock:
+                self._pendentes.pop(nome, None)
+            raise
+        self.metricas.registrar_span('transcodificacao_variante', duracao, variante=variante)
+        with self._lock:
+            self._pendentes.pop(nome, None)
+            self.latencias.append(duracao)
+            self._entradas[nome] = tamanho
+            self.total_bytes += tamanho
+            self._liberar_espaco()
+        return caminho
+
+    def _liberar_espaco(self):
+        """Apaga as variantes menos usadas até caber no limite (chamar com o lock)."""
+        while self.total_bytes > self.limite_bytes and len(self._entradas) > 1:
+            nome, tamanho = self._entradas.popitem(last=False)
+            self.total_bytes -= tamanho
+            try:
+                os.remove(os.path.join(self.diretorio, nome))
+            except OSError:
+                pass
+
+    def estatisticas(self) -> Dict:
+        with self._lock:
+            pedidos = self.acertos + self.faltas + self.coalescidos
+            return {
+                'pedidos': pedidos,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'coalescidos': self.coalescidos,
+                'taxa_acerto': (self.acertos + self.coalescidos) / pedidos if pedidos else 0.0,
+                'codificacoes': len(self.latencias),
+                'codificacao_media_s': sum(self.latencias) / len(self.latencias) if self.latencias else 0.0,
+                'codificacao_p95_s': _percentil(self.latencias, 95),
+                'arquivos': len(self._entradas),
+                'bytes': self.total_bytes,
+            }
+
+    def imprimir_estatisticas(self):
+        dados = self.estatisticas()
+        print(f"Variantes: {dados['pedidos']} pedidos, {dados['taxa_acerto']:.0%} atendidos pelo cache "
+              f"({dados['acertos']} acertos, {dados['coalescidos']} aguardaram outra codificação)")
+        print(f"Codificações: {dados['codificacoes']}, média {dados['codificacao_media_s']:.2f}s, "
+              f"p95 {dados['codificacao_p95_s']:.2f}s | Cache: {dados['arquivos']} arquivos, "
+              f"{dados['bytes'] / 2**20:.1f} MB de {self.limite_bytes / 2**20:.0f} MB")
+
+    def fechar(self):
+        self._executor.shutdown(wait=True)
+
+
+class LibraryServer:
+    """Servidor HTTP assíncrono para tocar a biblioteca de outras máquinas da rede.
+
+    * ``GET /api/musicas`` lista as músicas em JSON, a partir do índice da
+      biblioteca e do histórico (URL de origem e data do download). Aceita
+      ``?inicio=`` e ``?limite=`` para paginar.
+    * ``GET /musicas/<arquivo>`` entrega o MP3 com suporte a Range (206),
+      ETag/Last-Modified e requisições condicionais (304). Com
+      ``?variante=mp3-128`` (ou outra de ``VARIANTES``) entrega a versão
+      gerada pelo ``TranscodeCache``, para quem está numa conexão lenta.
+    * ``GET /api/variantes`` lista as variantes e as estatísticas do cache.
+
+    O corpo dos arquivos vai por ``loop.sendfile``, que usa ``os.sendfile``
+    (sem copiar os dados para o Python) quando o transporte permite. As
+    conexões ficam abertas entre requisições (HTTP/1.1 keep-alive). O índice
+    é sincronizado com o diretório no máximo a cada ``INTERVALO_SINCRONIZACAO``
+    segundos, quando alguém pede a lista ou um arquivo desconhecido.
+    """
+
+    INTERVALO_SINCRONIZACAO = 10.0
+    TEMPO_LIMITE = 30.0
+
+    def __init__(self, biblioteca: LibraryIndex, historico: HistoryStore,
+                 host: str = '0.0.0.0', porta: int = 8000, sendfile: bool = True,
+                 transcodificador: Optional[TranscodeCache] = None):
+        self.biblioteca = biblioteca
+        self.historico = historico
+        self.transcodificador = transcodificador
+        self.host = host
+        self.porta = porta
+        self.sendfile = sendfile
+        self.requisicoes = 0
+        self.bytes_enviados = 0
+        self._musicas: List[Dict] = []
+        self._arquivos: Dict[str, str] = {}  # nome do arquivo -> caminho
+        self._catalogo: Optional[bytes] = None
+        self._etag_catalogo = ''
+        self._sincronizado = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._servidor = None
+
+    async def iniciar(self):
+        """Abre o socket e começa a aceitar conexões; retorna o ``asyncio.Server``."""
+        self._lock = asyncio.Lock()
+        await self._atualizar_catalogo()
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+        return self._servidor
+
+    def executar(self):
+        """Serve até o processo ser interrompido (Ctrl+C)."""
+        async def servir():
+            servidor = await self.iniciar()
+            print(f"Servindo {len(self._musicas)} músicas em http://{self.host}:{self.porta}/api/musicas")
+            async with servidor:
+                await servidor.serve_forever()
+        try:
+            asyncio.run(servir())
+        except KeyboardInterrupt:
+            print("\nServidor encerrado.")
+        if self.transcodificador is not None:
+            self.transcodificador.imprimir_estatisticas()
+
+    def _ler_catalogo(self) -> Tuple[List[Dict], Dict[str, str]]:
+        origens = {item['arquivo']: item for item in self.historico.listar() if item['arquivo']}
+        musicas, arquivos = [], {}
+        for item in self.biblioteca.listar():
+            nome = os.path.basename(item['caminho'])
+            arquivos[nome] = item['caminho']
+            origem = origens.get(item['caminho'], {})
+            musicas.append({
+                'arquivo': nome,
+                'url': '/musicas/' + quote(nome),
+                'titulo': item['titulo'],
+                'artista': item['artista'],
+                'duracao': item['duracao'],
+                'tamanho': item['tamanho'],
+                'ganho': item['ganho'],
+                'origem': origem.get('url'),
+                'baixado_em': origem.get('data'),
+            })
+        return musicas, arquivos
+
+    async def _atualizar_catalogo(self, forcar: bool = False):
+        """Sincroniza o índice com o diretório e refaz a lista se algo mudou."""
+        if not forcar and self._catalogo is not None and \
+                time.monotonic() - self._sincronizado < self.INTERVALO_SINCRONIZACAO:
+            return
+        async with self._lock:
+            if time.monotonic() - self._sincronizado < self.INTERVALO_SINCRONIZACAO and self._catalogo is not None:
+                return
+            loop = asyncio.get_running_loop()
+            mudancas = await loop.run_in_executor(None, self.biblioteca.sincronizar)
+            self._sincronizado = time.monotonic()
+            if self._catalogo is not None and not any(mudancas):
+                return
+            self._musicas, self._arquivos = await loop.run_in_executor(None, self._ler_catalogo)
+            self._catalogo = json.dumps(self._musicas, ensure_ascii=False).encode('utf-8')
+            self._etag_catalogo = '"' + hashlib.sha1(self._catalogo).hexdigest()[:16] + '"'
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Atende as requisições de uma conexão até o cliente fechar ou pedir ``Connection: close``."""
+        try:
+            while True:
+                try:
+                    cabecalho = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.TEMPO_LIMITE)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                linhas = cabecalho.decode('latin-1').split('\r\n')
+                partes = linhas[0].split(' ')
+                if len(partes) != 3:
+                    await self._responder(writer, 400, {}, b'', False)
+                    break
+                metodo, alvo, versao = partes
+                cabecalhos = {}
+                for linha in linhas[1:]:
+                    if ':' in linha:
+                        nome, valor = linha.split(':', 1)
+                        cabecalhos[nome.strip().lower()] = valor.strip()
+                if cabecalhos.get('content-length', '0') != '0':
+                    await reader.readexactly(int(cabecalhos['content-length']))
+                conexao = cabecalhos.get('connection', '').lower()
+                manter = conexao == 'keep-alive' or (versao == 'HTTP/1.1' and conexao != 'close')
+                self.requisicoes += 1
+                await self._tratar(metodo, alvo, cabecalhos, writer, manter)
+                if not manter:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _responder(self, writer: asyncio.StreamWriter, status: int, cabecalhos: Dict[str, str],
+                         corpo: bytes, manter: bool, enviar_corpo: bool = True):
+        from http import HTTPStatus
+        if status == 304:
+            # Um 304 não tem corpo, e um Content-Length 0 pareceria o tamanho do recurso
+            cabecalhos.pop('Content-Length', None)
+        else:
+            cabecalhos.setdefault('Content-Length', str(len(corpo)))
+        cabecalhos['Connection'] = 'keep-alive' if manter else 'close'
+        linhas = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        linhas += [f"{nome}: {valor}" for nome, valor in cabecalhos.items()]
+        writer.write(("\r\n".join(linhas) + "\r\n\r\n").encode('latin-1'))
+        if enviar_corpo and corpo:
+            writer.write(corpo)
+            self.bytes_enviados += len(corpo)
+        await writer.drain()
+
+    async def _tratar(self, metodo: str, alvo: str, cabecalhos: Dict[str, str],
+                      writer: asyncio.StreamWriter, manter: bool):
+        if metodo not in ('GET', 'HEAD'):
+            await self._responder(writer, 405, {'Allow': 'GET, HEAD'}, b'', manter)
+            return
+        endereco = urlparse(alvo)
+        corpo = metodo == 'GET'
+        if endereco.path == '/api/musicas':
+            await self._listar(parse_qs(endereco.query), cabecalhos, writer, manter, corpo)
+        elif endereco.path == '/api/variantes':
+            dados = {'variantes': sorted(VARIANTES) if self.transcodificador else [],
+                     'cache': self.transcodificador.estatisticas() if self.transcodificador else None}
+            await self._responder(writer, 200, {'Content-Type': 'application/json; charset=utf-8',
+                                                'Cache-Control': 'no-cache'},
+                                  json.dumps(dados).encode('utf-8'), manter, corpo)
+        elif endereco.path.startswith('/musicas/'):
+            variante = parse_qs(endereco.query).get('variante', [None])[0]
+            await self._enviar_arquivo(unquote(endereco.path[len('/musicas/'):]), cabecalhos, writer, manter,
+                                       corpo, variante)
+        else:
+            await self._responder(writer, 404, {'Content-Type': 'text/plain; charset=utf-8'},
+                                  "Não encontrado".encode('utf-8'), manter, corpo)
+
+    async def _listar(self, parametros: Dict, cabecalhos: Dict[str, str], writer: asyncio.StreamWriter,
+                      manter: bool, corpo: bool):
+        await self._atualizar_catalogo()
+        try:
+            inicio = int(parametros.get('inicio', ['0'])[0])
+            limite = int(parametros['limite'][0]) if 'limite' in parametros else None
+        except ValueError:
+            await self._responder(writer, 400, {}, b'', manter)
+            return
+        if inicio or limite is not None:
+            fim = None if limite is None else inicio + limite
+            dados = json.dumps(self._musicas[inicio:fim], ensure_ascii=False).encode('utf-8')
+            etag = f'{self._etag_catalogo[:-1]}-{inicio}-{limite}"'
+        else:
+            dados, etag = self._catalogo, self._etag_catalogo
+        resposta = {'Content-Type': 'application/json; charset=utf-8', 'ETag': etag, 'Cache-Control': 'no-cache',
+                    'X-Total-Count': str(len(self._musicas))}
+        if 'if-none-match' in cabecalhos and self._etag_confere(etag, cabecalhos['if-none-match']):
+            await self._responder(writer, 304, resposta, b'', manter)
+            return
+        await self._responder(writer, 200, resposta, dados, manter, corpo)
+
+    @staticmethod
+    def _etag_confere(etag: str, if_none_match: str) -> bool:
+        """Se ``etag`` está na lista do If-None-Match, com comparação fraca (RFC 9110, 13.1.2)."""
+        etags = [e.strip().removeprefix('W/') for e in if_none_match.split(',')]
+        return etag.removeprefix('W/') in etags or '*' in etags
+
+    async def _enviar_arquivo(self, nome: str, cabecalhos: Dict[str, str], writer: asyncio.StreamWriter,
+                              manter: bool, corpo: bool, variante: Optional[str] = None):
+        from email.utils import formatdate, parsedate_to_datetime
+        caminho = self._arquivos.get(nome)
+        if caminho is None:
+            await self._atualizar_catalogo()
+            caminho = self._arquivos.get(nome)
+        try:
+            estado = os.stat(caminho) if caminho else None
+        except OSError:
+            estado = None
+        if estado is None:
+            await self._responder(writer, 404, {}, b'', manter)
+            return
+
+        # ETag e Last-Modified vêm sempre do MP3 original: a variante é só outra
+        # codificação dele, e o cache mexe na data do arquivo da variante
+        etag = f'"{estado.st_size:x}-{estado.st_mtime_ns:x}"'
+        resposta = {'Content-Type': 'audio/mpeg', 'Accept-Ranges': 'bytes', 'ETag': etag,
+                    'Last-Modified': formatdate(estado.st_mtime, usegmt=True)}
+        if variante:
+            if self.transcodificador is None or variante not in VARIANTES:
+                await self._responder(writer, 404, {'Content-Type': 'text/plain; charset=utf-8'},
+                                      f"Variante indisponível: {variante}".encode('utf-8'), manter, corpo)
+                return
+            # ETag fraca: recodificar o mesmo original não dá bytes idênticos,
+            # então a variante só é equivalente, não igual byte a byte
+            resposta['ETag'] = etag = f'W/{etag[:-1]}-{variante}"'
+            resposta['Content-Type'] = VARIANTES[variante][2]
+
+        # Requisições condicionais: If-None-Match tem prioridade sobre If-Modified-Since
+        if 'if-none-match' in cabecalhos:
+            if self._etag_confere(etag, cabecalhos['if-none-match']):
+                await self._responder(writer, 304, resposta, b'', manter)
+                return
+        elif 'if-modified-since' in cabecalhos:
+            try:
+                if int(estado.st_mtime) <= parsedate_to_datetime(cabecalhos['if-modified-since']).timestamp():
+                    await self._responder(writer, 304, resposta, b'', manter)
+                    return
+            except (TypeError, ValueError):
+                pass
+
+        try:
+            if variante:
+                caminho = await asyncio.wrap_future(self.transcodificador.obter(caminho, variante))
+            # Abre antes de responder: o cache pode apagar a variante a qualquer momento
+            arquivo = open(caminho, 'rb')
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Erro ao abrir {nome} ({variante or 'original'}): {e}")
+            await self._responder(writer, 500, {}, b'', manter)
+            return
+        with arquivo:
+            tamanho = os.fstat(arquivo.fileno()).st_size
+            inicio, fim, status = 0, tamanho - 1, 200
+            intervalo = cabecalhos.get('range')
+            if_range = cabecalhos.get('if-range')
+            # If-Range exige comparação forte: com ETag fraca (variante) o pedaço
+            # pedido pode vir de outra codificação, então manda o arquivo inteiro
+            if intervalo and (not if_range or (if_range == etag and not etag.startswith('W/'))):
+                faixa = _ler_range(intervalo, tamanho)
+                if faixa is None:
+                    resposta['Content-Range'] = f"bytes */{tamanho}"
+                    await self._responder(writer, 416, resposta, b'', manter)
+                    return
+                inicio, fim = faixa
+                status = 206
+                resposta['Content-Range'] = f"bytes {inicio}-{fim}/{tamanho}"
+            quantidade = fim - inicio + 1 if tamanho else 0
+            resposta['Content-Length'] = str(quantidade)
+            await self._responder(writer, status, resposta, b'', manter)
+            if not corpo or not quantidade:
+                return
+            if self.sendfile:
+                await asyncio.get_running_loop().sendfile(writer.transport, arquivo, inicio, quantidade)
+            else:
+                arquivo.seek(inicio)
+                restante = quantidade
+                while restante:
+                    bloco = arquivo.read(min(restante, 256 * 1024))
+                    if not bloco:
+                        break
+                    writer.write(bloco)
+                    await writer.drain()
+                    restante -= len(bloco)
+        self.bytes_enviados += quantidade
+
+
+def _ler_range(cabecalho: str, tamanho: int) -> Optional[Tuple[int, int]]:
+    """Interpreta ``Range: bytes=...`` (um único intervalo); None se não puder ser atendido."""
+    unidade, _, especificacao = cabecalho.partition('=')
+    if unidade.strip() != 'bytes' or ',' in especificacao or not tamanho:
+        return None
+    inicio, _, fim = especificacao.strip().partition('-')
+    try:
+        if not inicio:
+            sufixo = int(fim)
+            if sufixo <= 0:
+                return None
+            return max(0, tamanho - sufixo), tamanho - 1
+        inicio = int(inicio)
+        fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    except ValueError:
+        return None
+    if inicio >= tamanho or fim < inicio:
+        return None
+    return inicio, fim
+
+
+class ThumbnailCache:
+    """Cache de capas e miniaturas para a interface.
+
+    As imagens são baixadas (por uma ``requests.Session`` com pool de conexões)
+    ou lidas da capa embutida no MP3 fora da thread da interface. Cada imagem
+    é reduzida uma vez para todos os tamanhos usados na tela e gravada em
+    disco; os ``PhotoImage`` já decodificados ficam num LRU em memória.
+    ``PhotoImage`` só pode ser criado na thread do Tk, por isso o resultado
+    volta pela função ``agendar`` (por exemplo ``root.after``).
+    """
+
+    TAMANHOS = ((100, 100), (120, 90))
+
+    def __init__(self, diretorio: str, agendar: Callable[[Callable], None],
+                 max_memoria: int = 64, workers: int = 4):
+        self.diretorio = diretorio
+        self.agendar = agendar
+        self.max_memoria = max_memoria
+        os.makedirs(diretorio, exist_ok=True)
+        import requests
+        self.session = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="miniaturas")
+        self._memoria: "OrderedDict[Tuple[str, Tuple[int, int]], object]" = OrderedDict()
+        self._sem_imagem = set()
+        self._pendentes: Dict[str, Future] = {}
+
+    def _chave(self, origem: str) -> str:
+        """Chave de disco: a URL, ou o caminho e a data de modificação do MP3."""
+        if not origem.startswith(('http://', 'https://')):
+            origem = f"{origem}:{os.path.getmtime(origem)}"
+        return hashlib.sha1(origem.encode('utf-8')).hexdigest()
+
+    def _arquivo(self, chave: str, tamanho: Tuple[int, int]) -> str:
+        return os.path.join(self.diretorio, f"{chave}_{tamanho[0]}x{tamanho[1]}.png")
+
+    def _preparar(self, origem: str, chave: str) -> bool:
+        """Baixa ou extrai a imagem e grava todas as variantes em disco."""
+        if origem.startswith(('http://', 'https://')):
+            dados = baixar_imagem(origem, self.session)
+        else:
+            dados = ler_capa_embutida(origem)
+        if not dados:
+            return False
+        img = Image.open(BytesIO(dados)).convert('RGB')
+        for tamanho in self.TAMANHOS:
+            img.resize(tamanho, Image.LANCZOS).save(self._arquivo(chave, tamanho))
+        return True
+
+    def obter(self, origem: str, tamanho: Tuple[int, int], callback: Callable[[Optional[object]], None]):
+        """Entrega ao ``callback`` (na thread do Tk) o ``PhotoImage`` da imagem ou ``None``.
+
+        Deve ser chamado na thread do Tk. ``origem`` é uma URL ou o caminho de
+        um MP3 com capa embutida.
+        """
+        try:
+            chave = self._chave(origem)
+        except OSError:
+            callback(None)
+            return
+        em_memoria = self._memoria.get((chave, tamanho))
+        if em_memoria is not None:
+            self._memoria.move_to_end((chave, tamanho))
+            callback(em_memoria)
+            return
+        if chave in self._sem_imagem:
+            callback(None)
+            return
+        if os.path.exists(self._arquivo(chave, tamanho)):
+            callback(self._carregar(chave, tamanho))
+            return
+
+        pendente = self._pendentes.get(chave)
+        if pendente is None:
+            pendente = self._executor.submit(self._preparar, origem, chave)
+            self._pendentes[chave] = pendente
+
+        def pronto(f: Future):
+            self.agendar(lambda: self._entregar(chave, tamanho, f, callback))
+        pendente.add_done_callback(pronto)
+
+    def _entregar(self, chave: str, tamanho: Tuple[int, int], f: Future, callback):
+        self._pendentes.pop(chave, None)
+        if f.exception() is not None or not f.result():
+            self._sem_imagem.add(chave)
+            callback(None)
+            return
+        callback(self._carregar(chave, tamanho))
+
+    def _carregar(self, chave: str, tamanho: Tuple[int, int]):
+        photo = ImageTk.PhotoImage(Image.open(self._arquivo(chave, tamanho)))
+        self._memoria[(chave, tamanho)] = photo
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+        return photo
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class UiDispatcher:
+    """Fila única para alterar a interface a partir de outras threads.
+
+    Widgets do Tk só podem ser alterados na thread principal. As outras
+    threads chamam ``chamar`` e a thread principal executa as funções na
+    ordem em que chegaram. A fila é esvaziada por ``root.after``: logo depois
+    de ter trabalho o intervalo é curto, e sem nada para fazer ele cresce
+    até ``intervalo_max_ms``, então o player parado quase não usa CPU.
+    """
+
+    def __init__(self, root, intervalo_min_ms: int = 15, intervalo_max_ms: int = 250):
+        self.root = root
+        self.intervalo_min_ms = intervalo_min_ms
+        self.intervalo_max_ms = intervalo_max_ms
+        self._intervalo = intervalo_max_ms
+        self._fila = queue.Queue()
+
+    def iniciar(self):
+        self.root.after(self._intervalo, self._processar)
+
+    def chamar(self, funcao: Callable, *args):
+        """Agenda ``funcao(*args)`` na thread principal. Pode ser chamado de qualquer thread."""
+        self._fila.put((funcao, args))
+
+    def _processar(self):
+        processou = False
+        while True:
+            try:
+                funcao, args = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            processou = True
+            try:
+                funcao(*args)
+            except Exception as e:
+                print(f"Erro ao atualizar a interface: {str(e)}")
+        if processou:
+            self._intervalo = self.intervalo_min_ms
+        else:
+            self._intervalo = min(self._intervalo * 2, self.intervalo_max_ms)
+        self.root.after(self._intervalo, self._processar)
+
+
+class PathList:
+    """Lista de caminhos de arquivo que guarda cada diretório uma vez só.
+
+    Cada item é o número do diretório (num ``array``) mais o nome do arquivo.
+    ``indice`` acha a posição de um caminho pelo nome, sem um dicionário de
+    caminhos completos; só nomes repetidos em pastas diferentes vão para um
+    dicionário à parte.
+    """
+
+    def __init__(self, caminhos=()):
+        self._diretorios: List[str] = []
+        self._numero_diretorio: Dict[str, int] = {}
+        self._diretorio_de = array('I')
+        self.nomes: List[str] = []
+        self._por_nome: Dict[str, int] = {}
+        self._repetidos: Dict[str, int] = {}  # caminho completo -> posição
+        self._carregar(list(caminhos))
+
+    def _carregar(self, caminhos: List[str]):
+        """Monta a lista vazia com ``caminhos`` de uma vez, sem um ``append`` por item.
+
+        O ``os.path.split`` de cada caminho custava mais que a lista inteira
+        de antes: aqui cada caminho é cortado com ``rpartition`` e só os
+        diretórios distintos passam pelo ``os.path.split`` (que trata raiz,
+        separadores repetidos e unidades do Windows). Os números e o
+        dicionário por nome são montados com ``map`` e ``zip``.
+        """
+        partes = [caminho.rpartition(os.sep) for caminho in caminhos]
+        cortes = [parte[0] for parte in partes]
+        distintos = dict.fromkeys(cortes)
+        # '' não diz se havia separador ('/a.mp3' ou 'a.mp3'), e o separador
+        # alternativo pode aparecer no nome: nesses casos vai item por item
+        if '' in distintos or (os.altsep and any(os.altsep in parte[2] for parte in partes)):
+            for caminho in caminhos:
+                self.append(caminho)
+            return
+        for corte in distintos:
+            diretorio = os.path.split(corte + os.sep + 'x')[0]
+            numero = self._numero_diretorio.get(diretorio)
+            if numero is None:
+                numero = self._numero_diretorio[diretorio] = len(self._diretorios)
+                self._diretorios.append(sys.intern(diretorio))
+            distintos[corte] = numero
+        self._diretorio_de.extend(map(distintos.__getitem__, cortes))
+        self.nomes = [parte[2] for parte in partes]
+        # Com as posições de trás para a frente, cada nome fica com a primeira
+        self._por_nome = dict(zip(reversed(self.nomes), range(len(self.nomes) - 1, -1, -1)))
+        if len(self._por_nome) < len(self.nomes):
+            self._repetidos = {caminhos[posicao]: posicao for posicao, nome in enumerate(self.nomes)
+                               if self._por_nome[nome] != posicao}
+
+    def append(self, caminho: str) -> int:
+        """Acrescenta ``caminho`` no fim e retorna a posição."""
+        diretorio, nome = os.path.split(caminho)
+        numero = self._numero_diretorio.get(diretorio)
+        if numero is None:
+            numero = self._numero_diretorio[diretorio] = len(self._diretorios)
+            self._diretorios.append(sys.intern(diretorio))
+        posicao = len(self.nomes)
+        self._diretorio_de.append(numero)
+        self.nomes.append(nome)
+        if nome in self._por_nome:
+            self._repetidos[caminho] = posicao
+        else:
+            self._por_nome[nome] = posicao
+        return posicao
+
+    def indice(self, caminho: Optional[str]) -> Optional[int]:
+        """Posição de ``caminho`` na lista, ou None."""
+        if not caminho:
+            return None
+        diretorio, nome = os.path.split(caminho)
+        posicao = self._por_nome.get(nome)
+        if posicao is not None and self._diretorios[self._diretorio_de[posicao]] == diretorio:
+            return posicao
+        return self._repetidos.get(caminho)
+
+    def __contains__(self, caminho: str) -> bool:
+        return self.indice(caminho) is not None
+
+    def __getitem__(self, posicao: int) -> str:
+        return os.path.join(self._diretorios[self._diretorio_de[posicao]], self.nomes[posicao])
+
+    def __len__(self) -> int:
+        return len(self.nomes)
+
+    def __iter__(self):
+        for posicao in range(len(self.nomes)):
+            yield self[posicao]
+
+
+class LazyColumn:
+    """Coluna somente leitura de ``quantidade`` textos gerados por ``funcao(i)`` quando lidos."""
+
+    __slots__ = ('quantidade', 'funcao')
+
+    def __init__(self, quantidade: int, funcao: Callable[[int], str]):
+        self.quantidade = quantidade
+        self.funcao = funcao
+
+    def __len__(self) -> int:
+        return self.quantidade
+
+    def __getitem__(self, indice: int) -> str:
+        return self.funcao(indice)
+
+
+class VirtualListView:
+    """Lista com rolagem que só desenha as linhas visíveis.
+
+    Os itens ficam em listas Python e o ``tk.Listbox`` tem só as linhas que
+    cabem na tela, reescritas quando a lista rola ou muda (apenas as que
+    mudaram de texto). Assim uma biblioteca de 50 mil músicas custa algumas
+    dezenas de chamadas ao Tk por atualização, e não uma por item.
+    ``filtrar`` mostra só os itens cujo texto de busca contém o termo; os
+    índices usados por ``selecionar``/``selecionado`` são sempre os dos itens.
+    Com ``definir_fonte`` os textos nem ficam na memória: são pedidos a uma
+    função só para as linhas desenhadas (e para filtrar).
+    """
+
+    def __init__(self, master, ao_ativar: Optional[Callable[[int], None]] = None, linhas: int = 15, **opcoes):
+        self.frame = ttk.Frame(master)
+        self.scroll = ttk.Scrollbar(self.frame, command=self._rolar)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(self.frame, height=linhas, exportselection=False, **opcoes)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+        self.ao_ativar = ao_ativar
+        self.linhas = linhas
+        self.textos: List[str] = []
+        self.buscas: List[str] = []
+        # Índices dos itens que passam no filtro, em ordem: range sem filtro, array com filtro
+        self.visiveis = range(0)
+        self.filtro = ""
+        self.topo = 0
+        self.selecao: Optional[int] = None
+        self._desenhadas: List[str] = []
+
+        import tkinter.font
+        fonte = tkinter.font.Font(font=self.listbox.cget('font'))
+        self._altura_linha = fonte.metrics('linespace') + 1
+        self.listbox.bind("<Configure>", self._redimensionar)
+        self.listbox.bind("<<ListboxSelect>>", self._ao_selecionar)
+        self.listbox.bind("<Double-1>", lambda e: self._ativar())
+        self.listbox.bind("<Return>", lambda e: self._ativar())
+        self.listbox.bind("<Up>", lambda e: self._mover(-1))
+        self.listbox.bind("<Down>", lambda e: self._mover(1))
+        self.listbox.bind("<Prior>", lambda e: self._mover(-self.linhas))
+        self.listbox.bind("<Next>", lambda e: self._mover(self.linhas))
+        self.listbox.bind("<MouseWheel>", lambda e: self._rolar('scroll', -e.delta // 120 * 3, 'units'))
+        self.listbox.bind("<Button-4>", lambda e: self._rolar('scroll', -3, 'units'))
+        self.listbox.bind("<Button-5>", lambda e: self._rolar('scroll', 3, 'units'))
+
+    def pack(self, **opcoes):
+        self.frame.pack(**opcoes)
+
+    def __len__(self) -> int:
+        return len(self.textos)
+
+    def definir(self, itens: List[Tuple[str, str]]):
+        """Troca todos os itens por ``itens`` (pares texto, texto de busca)."""
+        self.textos = [texto for texto, _ in itens]
+        self.buscas = [busca.lower() for _, busca in itens]
+        self.selecao = None
+        self._aplicar_filtro(self.filtro, range(len(self.textos)))
+        self._desenhar()
+
+    def definir_fonte(self, quantidade: int, texto: Callable[[int], str], busca: Callable[[int], str]):
+        """Como ``definir``, mas o texto e o texto de busca do item ``i`` vêm de ``texto(i)`` e ``busca(i)``."""
+        self.textos = LazyColumn(quantidade, texto)
+        self.buscas = LazyColumn(quantidade, lambda i: busca(i).lower())
+        self.selecao = None
+        self._aplicar_filtro(self.filtro, range(quantidade))
+        self._desenhar()
+
+    def crescer(self, quantidade: int):
+        """Avisa que a fonte de ``definir_fonte`` passou a ter ``quantidade`` itens."""
+        anteriores = len(self.textos)
+        self.textos.quantidade = self.buscas.quantidade = quantidade
+        if self.filtro:
+            self.visiveis.extend(i for i in range(anteriores, quantidade) if self.filtro in self.buscas[i])
+        else:
+            self.visiveis = range(quantidade)
+        self._desenhar()
+
+    def adicionar(self, texto: str, busca: str):
+        """Acrescenta um item no fim da lista (só para itens de ``definir``)."""
+        if isinstance(self.textos, LazyColumn):
+            raise TypeError("a lista usa definir_fonte: acrescente o item na fonte e chame crescer()")
+        self.textos.append(texto)
+        self.buscas.append(busca.lower())
+        if not self.filtro:
+            self.visiveis = range(len(self.textos))
+            self._desenhar()
+        elif self.filtro in self.buscas[-1]:
+            self.visiveis.append(len(self.textos) - 1)
+            self._desenhar()
+
+    def filtrar(self, termo: str):
+        """Mostra só os itens cujo texto de busca contém ``termo``.
+
+        Quando o termo só cresceu (o usuário continuou digitando), a busca
+        percorre apenas os itens que já passavam no filtro anterior.
+        """
+        termo = termo.strip().lower()
+        if termo == self.filtro:
+            return
+        base = self.visiveis if termo.startswith(self.filtro) else range(len(self.textos))
+        self._aplicar_filtro(termo, base)
+        self.topo = 0
+        if self.selecao is not None:
+            self.ver(self.selecao)
+        self._desenhar()
+
+    def _aplicar_filtro(self, termo: str, base):
+        self.filtro = termo
+        if termo:
+            self.visiveis = array('I', (i for i in base if termo in self.buscas[i]))
+        else:
+            self.visiveis = range(len(self.textos))
+
+    def selecionar(self, indice: int):
+        """Seleciona o item ``indice`` e rola a lista até ele."""
+        self.selecao = indice
+        self.ver(indice)
+        self._desenhar()
+
+    def selecionado(self) -> Optional[int]:
+        return self.selecao
+
+    def ver(self, indice: int):
+        """Rola a lista para que o item ``indice`` fique visível, se passar no filtro."""
+        posicao = bisect.bisect_left(self.visiveis, indice)
+        if posicao == len(self.visiveis) or self.visiveis[posicao] != indice:
+            return
+        if posicao < self.topo:
+            self.topo = posicao
+        elif posicao >= self.topo + self.linhas:
+            self.topo = posicao - self.linhas + 1
+
+    def _desenhar(self):
+        """Reescreve as linhas visíveis que mudaram e ajusta a barra de rolagem."""
+        total = len(self.visiveis)
+        self.topo = max(0, min(self.topo, total - self.linhas))
+        fatia = self.visiveis[self.topo:self.topo + self.linhas]
+        textos = [self.textos[i] for i in fatia]
+        for linha, texto in enumerate(textos):
+            if linha >= len(self._desenhadas):
+                self.listbox.insert(tk.END, texto)
+            elif self._desenhadas[linha] != texto:
+                self.listbox.delete(linha)
+                self.listbox.insert(linha, texto)
+        if len(self._desenhadas) > len(textos):
+            self.listbox.delete(len(textos), tk.END)
+        self._desenhadas = textos
+
+        self.listbox.selection_clear(0, tk.END)
+        if self.selecao is not None and self.selecao in fatia:
+            self.listbox.selection_set(fatia.index(self.selecao))
+        if total > self.linhas:
+            self.scroll.set(self.topo / total, (self.topo + len(fatia)) / total)
+        else:
+            self.scroll.set(0.0, 1.0)
+
+    def _rolar(self, acao, quantidade, unidade=None):
+        if acao == 'moveto':
+            self.topo = int(float(quantidade) * len(self.visiveis))
+        else:
+            passo = self.linhas if unidade == 'pages' else 1
+            self.topo += int(quantidade) * passo
+        self._desenhar()
+        return "break"
+
+    def _redimensionar(self, evento):
+        linhas = max(1, evento.height // self._altura_linha)
+        if linhas != self.linhas:
+            self.linhas = linhas
+            self._desenhar()
+
+    def _ao_selecionar(self, evento=None):
+        selecao = self.listbox.curselection()
+        if selecao and self.topo + selecao[0] < len(self.visiveis):
+            self.selecao = self.visiveis[self.topo + selecao[0]]
+
+    def _mover(self, passo: int):
+        if not self.visiveis:
+            return "break"
+        posicao = bisect.bisect_left(self.visiveis, self.selecao) if self.selecao is not None else -1
+        if posicao == len(self.visiveis) or self.visiveis[posicao] != self.selecao:
+            posicao = self.topo - 1 if passo > 0 else self.topo + 1
+        posicao = max(0, min(posicao + passo, len(self.visiveis) - 1))
+        self.selecionar(self.visiveis[posicao])
+        return "break"
+
+    def _ativar(self):
+        self._ao_selecionar()
+        if self.selecao is not None and self.ao_ativar:
+            self.ao_ativar(self.selecao)
+        return "break"
+
 
 class MusicPlayer:
-    def __init__(self, root, music_downloader):
+    PROGRESS_INTERVAL_MS = 250
+    FADE_INTERVAL_MS = 50
+    QUEUE_STATE_LABELS = {
+        ESTADO_NA_FILA: "Na fila",
+        ESTADO_PAUSADO: "Pausado",
+        ESTADO_BAIXANDO: "Baixando",
+        ESTADO_CONVERTENDO: "Convertendo",
+        ESTADO_CONCLUIDO: "Concluído",
+        ESTADO_FALHOU: "Falhou",
+        ESTADO_CANCELADO: "Cancelado",
+    }
+
+    def __init__(self, root, music_downloader, gapless=True, crossfade=0.0, replaygain=True):
+        _carregar_gui()
         self.root = root
         self.downloader = music_downloader
         self.current_song_index = 0
         self.is_playing = False
         self.is_muted = False
         self.previous_volume = 0.8
-        self.playlist = []
+        self.playlist = PathList()
+        self.history_source = None  # HistoryPages mostrado na aba de histórico
+        # get_pos() conta a partir do último play(); a posição real soma este deslocamento
+        self.position_offset = 0.0
+        self.current_duration = 0.0
+        self._updating_progress = False
+        
+        self.progress_job = None
+        
+        # Modo gapless: a próxima faixa é preparada em segundo plano e entra na
+        # fila do pygame (mixer.music.queue), que emenda as duas sem pausa.
+        # ``crossfade`` (segundos) baixa o volume no fim da faixa e sobe no começo da próxima.
+        self.gapless = gapless
+        self.crossfade = crossfade
+        self.queued = None  # (índice, caminho, metadados, duração) da faixa na fila
+        self.play_token = 0  # muda a cada play, invalida preparações antigas
+        self.fading_in = False
+        
+        # Ganho ReplayGain da faixa atual, aplicado sobre o volume do slider.
+        # O pygame não amplifica acima de 1.0, então ganhos positivos viram 0 dB.
+        self.replaygain = replaygain
+        self.track_gain = 1.0
         
         # Inicializar pygame para reprodução de áudio
         pygame.mixer.init()
         
+        # Fim de faixa chega como evento do pygame; a fila de eventos exige o
+        # subsistema de vídeo, sem ele o fim é detectado por get_busy()
+        self.music_end_event = pygame.USEREVENT + 1
+        try:
+            pygame.display.init()
+            pygame.mixer.music.set_endevent(self.music_end_event)
+            self.end_events = True
+        except pygame.error:
+            self.end_events = False
+            # Sem o evento de fim não dá para saber quando a faixa da fila começou
+            self.gapless = False
+        
+        # Toda alteração da interface vinda de outras threads passa por aqui
+        self.ui = UiDispatcher(self.root)
+        self.ui.iniciar()
+        
+        self.miniaturas = ThumbnailCache(
+            os.path.join(self.downloader.diretorio_downloads, ".miniaturas"),
+            agendar=self.ui.chamar,
+        )
+        self.capa_atual = None
+        
         self.setup_ui()
         self.load_available_songs()
-        
-        # Iniciar thread para atualizar a barra de progresso
-        self.update_thread = threading.Thread(target=self.update_progress_thread, daemon=True)
-        self.update_thread.start()
     
     def setup_ui(self):
         """Configura a interface do player de música."""
@@ -276,18 +4205,20 @@ class MusicPlayer:
         playlist_frame = ttk.Frame(self.notebook, padding=10)
         self.notebook.add(playlist_frame, text="Playlist")
         
-        # Lista de reprodução
-        playlist_scroll = ttk.Scrollbar(playlist_frame)
-        playlist_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        # Filtro por título e artista
+        playlist_filter_frame = ttk.Frame(playlist_frame)
+        playlist_filter_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(playlist_filter_frame, text="Filtrar:").pack(side=tk.LEFT, padx=5)
+        self.playlist_filter = ttk.Entry(playlist_filter_frame)
+        self.playlist_filter.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.playlist_filter.bind("<KeyRelease>", lambda e: self.playlist_view.filtrar(self.playlist_filter.get()))
         
-        self.playlist_listbox = tk.Listbox(playlist_frame, font=("Arial", 10), 
-                                          selectbackground="#4682B4",
-                                          activestyle="none",
-                                          height=15)
-        self.playlist_listbox.pack(fill=tk.BOTH, expand=True)
-        self.playlist_listbox.config(yscrollcommand=playlist_scroll.set)
-        playlist_scroll.config(command=self.playlist_listbox.yview)
-        self.playlist_listbox.bind("<Double-1>", self.play_selected)
+        # Lista de reprodução (só as linhas visíveis são desenhadas)
+        self.playlist_view = VirtualListView(playlist_frame, ao_ativar=self.play_selected,
+                                             font=("Arial", 10),
+                                             selectbackground="#4682B4",
+                                             activestyle="none")
+        self.playlist_view.pack(fill=tk.BOTH, expand=True)
         
         # Aba de Busca/Download
         download_frame = ttk.Frame(self.notebook, padding=10)
@@ -314,22 +4245,50 @@ class MusicPlayer:
         self.download_button = ttk.Button(self.search_result_frame, text="Baixar", command=self.download_current_search, state=tk.DISABLED)
         self.download_button.pack(pady=5)
         
+        # Fila de downloads (a mesma usada pelas playlists)
+        queue_frame = ttk.LabelFrame(download_frame, text="Fila de downloads", padding=10)
+        queue_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        
+        self.queue_tree = ttk.Treeview(queue_frame, columns=("origem", "estado"), height=6, selectmode="browse")
+        self.queue_tree.heading("#0", text="Música")
+        self.queue_tree.heading("origem", text="Origem")
+        self.queue_tree.heading("estado", text="Estado")
+        self.queue_tree.column("origem", width=90, stretch=False)
+        self.queue_tree.column("estado", width=100, stretch=False)
+        self.queue_tree.pack(fill=tk.BOTH, expand=True)
+        
+        queue_buttons = ttk.Frame(queue_frame)
+        queue_buttons.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(queue_buttons, text="Pausar",
+                   command=lambda: self.queue_action(self.downloader.fila.pausar)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(queue_buttons, text="Retomar",
+                   command=lambda: self.queue_action(self.downloader.fila.retomar)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(queue_buttons, text="Cancelar",
+                   command=lambda: self.queue_action(self.downloader.fila.cancelar)).pack(side=tk.LEFT, padx=5)
+        self.pause_queue_button = ttk.Button(queue_buttons, text="Pausar fila", command=self.toggle_queue_pause)
+        self.pause_queue_button.pack(side=tk.RIGHT, padx=5)
+        
+        self.queue_refresh_pending = False
+        self.downloader.fila.ouvintes.append(self.request_queue_refresh)
+        
         # Aba de histórico
         history_frame = ttk.Frame(self.notebook, padding=10)
         self.notebook.add(history_frame, text="Histórico")
         
+        # Filtro por título
+        history_filter_frame = ttk.Frame(history_frame)
+        history_filter_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(history_filter_frame, text="Filtrar:").pack(side=tk.LEFT, padx=5)
+        self.history_filter = ttk.Entry(history_filter_frame)
+        self.history_filter.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.history_filter.bind("<KeyRelease>", lambda e: self.history_view.filtrar(self.history_filter.get()))
+        
         # Lista de histórico
-        history_scroll = ttk.Scrollbar(history_frame)
-        history_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.history_listbox = tk.Listbox(history_frame, font=("Arial", 10), 
-                                        selectbackground="#4682B4",
-                                        activestyle="none",
-                                        height=15)
-        self.history_listbox.pack(fill=tk.BOTH, expand=True)
-        self.history_listbox.config(yscrollcommand=history_scroll.set)
-        history_scroll.config(command=self.history_listbox.yview)
-        self.history_listbox.bind("<Double-1>", self.play_from_history)
+        self.history_view = VirtualListView(history_frame, ao_ativar=self.play_from_history,
+                                            font=("Arial", 10),
+                                            selectbackground="#4682B4",
+                                            activestyle="none")
+        self.history_view.pack(fill=tk.BOTH, expand=True)
         
         self.refresh_history_button = ttk.Button(history_frame, text="Atualizar Histórico", command=self.load_history)
         self.refresh_history_button.pack(pady=10)
@@ -345,67 +4304,104 @@ class MusicPlayer:
         self.album_cover_label.config(image=photo)
         self.album_cover_label.image = photo  # Guardar referência
     
-    def set_album_cover(self, thumbnail_url):
-        """Define a capa do álbum a partir de uma URL."""
-        try:
-            response = requests.get(thumbnail_url)
-            img = Image.open(BytesIO(response.content))
-            img = img.resize((100, 100), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(img)
+    def set_album_cover(self, origem):
+        """Define a capa do álbum a partir de uma URL ou da capa embutida no MP3."""
+        self.capa_atual = origem
+        
+        def mostrar(photo):
+            if self.capa_atual != origem:
+                return  # A música mudou enquanto a capa carregava
+            if photo is None:
+                self.set_default_album_cover()
+                return
             self.album_cover_label.config(image=photo)
             self.album_cover_label.image = photo  # Guardar referência
-        except Exception:
-            self.set_default_album_cover()
+        
+        self.miniaturas.obter(origem, (100, 100), mostrar)
 
     def load_available_songs(self):
-        """Carrega as músicas disponíveis no diretório de downloads."""
-        self.playlist = []
-        self.playlist_listbox.delete(0, tk.END)
+        """Carrega as músicas do índice da biblioteca e sincroniza em segundo plano."""
+        self.show_library()
         
-        if not os.path.exists(self.downloader.diretorio_downloads):
-            return
+        def do_sync():
+            novos, alterados, removidos = self.downloader.biblioteca.sincronizar()
+            if novos or alterados or removidos:
+                self.ui.chamar(self.show_library)
         
-        for file in os.listdir(self.downloader.diretorio_downloads):
-            if file.endswith(".mp3"):
-                filepath = os.path.join(self.downloader.diretorio_downloads, file)
-                self.playlist.append(filepath)
-                self.playlist_listbox.insert(tk.END, os.path.basename(file))
+        threading.Thread(target=do_sync, daemon=True).start()
+    
+    def show_library(self):
+        """Mostra na playlist as músicas do índice da biblioteca."""
+        atual = self.playlist[self.current_song_index] if self.current_song_index < len(self.playlist) else None
+        itens = self.downloader.biblioteca.listar()
+        self.playlist = PathList(item['caminho'] for item in itens)
+        # Os nomes mostrados são as mesmas strings guardadas na PathList
+        self.playlist_view.definir([(nome, self.search_text(item)) for nome, item in zip(self.playlist.nomes, itens)])
+        index = self.playlist.indice(atual)
+        if index is not None:
+            self.current_song_index = index
+            self.playlist_view.selecionar(self.current_song_index)
+    
+    def search_text(self, info):
+        """Texto usado pelo filtro da playlist: título, artista e nome do arquivo."""
+        return f"{info['titulo'] or ''} {info['artista'] or ''} {os.path.basename(info['caminho'])}"
+    
+    def append_to_playlist(self, filepath):
+        """Acrescenta um arquivo no fim da playlist e retorna sua posição."""
+        info = self.downloader.biblioteca.obter(filepath) or self.downloader.biblioteca.atualizar_arquivo(filepath)
+        index = self.playlist.append(filepath)
+        busca = self.search_text(info) if info else os.path.basename(filepath)
+        self.playlist_view.adicionar(self.playlist.nomes[index], busca)
+        return index
+    
+    def add_song(self, filepath):
+        """Adiciona à playlist uma música recém-baixada, sem reler o diretório."""
+        if filepath in self.playlist:
+            return
+        self.downloader.biblioteca.atualizar_arquivo(filepath)
+        self.append_to_playlist(filepath)
     
     def load_history(self):
-        """Carrega o histórico de downloads."""
-        self.downloader.historico = self.downloader.carregar_historico()
-        self.history_listbox.delete(0, tk.END)
+        """Carrega os itens novos do histórico de downloads."""
+        self.downloader.atualizar_historico()
+        historico = self.downloader.historico
         
-        for item in self.downloader.historico:
-            self.history_listbox.insert(tk.END, f"{item['title']} - {item['data']}")
+        # Os textos são lidos do histórico paginado só para as linhas visíveis
+        if self.history_source is not historico:
+            self.history_source = historico
+            self.history_view.definir_fonte(len(historico),
+                                            lambda i: f"{historico[i].title} - {historico[i].data}",
+                                            lambda i: historico[i].title)
+        else:
+            self.history_view.crescer(len(historico))
     
-    def play_selected(self, event=None):
+    def play_selected(self, index=None):
         """Reproduz a música selecionada na playlist."""
-        selection = self.playlist_listbox.curselection()
-        if not selection:
+        if index is None:
+            index = self.playlist_view.selecionado()
+        if index is None:
             return
         
-        self.current_song_index = selection[0]
+        self.current_song_index = index
         self.play_current_song()
     
-    def play_from_history(self, event=None):
+    def play_from_history(self, index=None):
         """Reproduz uma música do histórico."""
-        selection = self.history_listbox.curselection()
-        if not selection:
+        if index is None:
+            index = self.history_view.selecionado()
+        if index is None:
             return
         
-        index = selection[0]
         if index < len(self.downloader.historico):
             filepath = self.downloader.historico[index]['arquivo']
             if os.path.exists(filepath):
                 # Verificar se a música já está na playlist
-                if filepath in self.playlist:
-                    self.current_song_index = self.playlist.index(filepath)
+                index = self.playlist.indice(filepath)
+                if index is not None:
+                    self.current_song_index = index
                 else:
                     # Adicionar à playlist e reproduzir
-                    self.playlist.append(filepath)
-                    self.playlist_listbox.insert(tk.END, os.path.basename(filepath))
-                    self.current_song_index = len(self.playlist) - 1
+                    self.current_song_index = self.append_to_playlist(filepath)
                 
                 self.play_current_song()
             else:
@@ -422,40 +4418,137 @@ class MusicPlayer:
             tk.messagebox.showinfo("Arquivo não encontrado", "O arquivo da música não existe.")
             return
         
-        # Destacar a música atual na playlist
-        self.playlist_listbox.select_clear(0, tk.END)
-        self.playlist_listbox.selection_set(self.current_song_index)
-        self.playlist_listbox.see(self.current_song_index)
-        
-        # Parar qualquer reprodução atual
+        # Parar qualquer reprodução atual (stop() também esvazia a fila do pygame)
         pygame.mixer.music.stop()
+        self.queued = None
+        self.fading_in = False
+        self.play_token += 1
+        
+        # Metadados vêm do índice da biblioteca (o arquivo só é lido se for novo)
+        info = self.downloader.biblioteca.obter(filepath) or self.downloader.biblioteca.atualizar_arquivo(filepath)
+        self.track_gain = self.gain_factor(info)
         
         # Reproduzir a nova música
         pygame.mixer.music.load(filepath)
-        pygame.mixer.music.set_volume(self.volume_slider.get() / 100)
+        pygame.mixer.music.set_volume(self.output_volume())
         pygame.mixer.music.play()
+        self.position_offset = 0.0
+        self.discard_end_events()
+        self.schedule_progress()
         
         # Atualizar interface
         self.is_playing = True
         self.play_button.config(text="⏸")
-        self.song_title_label.config(text=os.path.basename(filepath))
         
-        # Tentar obter metadados
-        try:
-            audiofile = eyed3.load(filepath)
-            if audiofile and audiofile.tag:
-                title = audiofile.tag.title or os.path.basename(filepath)
-                artist = audiofile.tag.artist or "Artista desconhecido"
-                self.song_title_label.config(text=f"{title} - {artist}")
-        except Exception:
-            pass
+        duration = (info and info['duracao']) or duracoes.duracao(filepath)
+        self.show_current_song(filepath, info, duration)
+        self.prepare_next()
+    
+    def gain_factor(self, info):
+        """Fator de volume do ganho ReplayGain da faixa (1.0 sem ganho ou com ReplayGain desligado)."""
+        if not self.replaygain or not info or info.get('ganho') is None:
+            return 1.0
+        return min(1.0, 10 ** (info['ganho'] / 20))
+    
+    def output_volume(self):
+        """Volume enviado ao pygame: slider vezes o ganho da faixa."""
+        return self.volume_slider.get() / 100 * self.track_gain
+    
+    def show_current_song(self, filepath, info, duration):
+        """Mostra título, capa e duração da faixa que está tocando."""
+        # Destacar a música atual na playlist
+        self.playlist_view.selecionar(self.current_song_index)
+        
+        title = (info and info['titulo']) or os.path.basename(filepath)
+        artist = (info and info['artista']) or "Artista desconhecido"
+        self.song_title_label.config(text=f"{title} - {artist}")
+        
+        self.set_album_cover(filepath)
         
         # Atualizar tempo total
-        sound = pygame.mixer.Sound(filepath)
-        duration = sound.get_length()
+        self.current_duration = duration
         self.progress_bar.config(to=duration)
         self.total_time_label.config(text=self.format_time(duration))
     
+    def prepare_next(self):
+        """Prepara a próxima faixa em segundo plano e a coloca na fila do pygame.
+
+        Metadados e duração são lidos e o arquivo é lido uma vez para ficar no
+        cache do sistema; na troca só resta atualizar a interface.
+        """
+        if not self.gapless or not self.playlist:
+            return
+        
+        index = (self.current_song_index + 1) % len(self.playlist)
+        filepath = self.playlist[index]
+        token = self.play_token
+        
+        def do_prepare():
+            try:
+                info = self.downloader.biblioteca.obter(filepath) or self.downloader.biblioteca.atualizar_arquivo(filepath)
+                duration = (info and info['duracao']) or duracoes.duracao(filepath)
+                with open(filepath, 'rb') as f:
+                    while f.read(1 << 20):
+                        pass
+            except Exception as e:
+                print(f"Erro ao preparar a próxima música: {str(e)}")
+                return
+            self.ui.chamar(self.queue_next, token, index, filepath, info, duration)
+        
+        threading.Thread(target=do_prepare, daemon=True).start()
+    
+    def queue_next(self, token, index, filepath, info, duration):
+        """Põe na fila do pygame a faixa preparada, se ela ainda for a próxima."""
+        if token != self.play_token or self.queued is not None:
+            return
+        try:
+            pygame.mixer.music.queue(filepath)
+        except pygame.error as e:
+            print(f"Erro ao enfileirar a próxima música: {str(e)}")
+            return
+        self.queued = (index, filepath, info, duration)
+    
+    def advance_to_queued(self):
+        """Atualiza o player depois que o pygame passou para a faixa da fila."""
+        index, filepath, info, duration = self.queued
+        self.queued = None
+        self.play_token += 1
+        posicao = self.playlist.indice(filepath)
+        self.current_song_index = index if posicao is None else posicao
+        
+        # get_pos() pode ou não recomeçar do zero na troca, conforme a versão do pygame
+        elapsed = max(0, pygame.mixer.music.get_pos()) / 1000
+        if self.position_offset + elapsed >= self.current_duration:
+            self.position_offset -= self.current_duration
+        else:
+            self.position_offset = 0.0
+        self.fading_in = self.crossfade > 0
+        self.track_gain = self.gain_factor(info)
+        if not self.crossfade:
+            pygame.mixer.music.set_volume(self.output_volume())
+        
+        self.show_current_song(filepath, info, duration)
+        self.prepare_next()
+    
+    def apply_fade(self, position):
+        """Ajusta o volume no fim e no começo das faixas quando há crossfade.
+
+        Retorna True enquanto está dentro de uma transição.
+        """
+        if not self.crossfade:
+            return False
+        factor = 1.0
+        if self.fading_in:
+            if position < self.crossfade:
+                factor = position / self.crossfade
+            else:
+                self.fading_in = False
+        remaining = self.current_duration - position
+        if self.queued is not None and remaining < self.crossfade:
+            factor = min(factor, remaining / self.crossfade)
+        pygame.mixer.music.set_volume(self.output_volume() * max(0.0, factor))
+        return factor < 1.0 or (self.queued is not None and remaining < self.crossfade + self.PROGRESS_INTERVAL_MS / 1000)
+    
     def toggle_play(self):
         """Alterna entre reproduzir e pausar."""
         if not self.playlist:
@@ -465,6 +4558,7 @@ class MusicPlayer:
             pygame.mixer.music.pause()
             self.play_button.config(text="▶")
             self.is_playing = False
+            self.cancel_progress()
         else:
             if pygame.mixer.music.get_pos() == -1:  # Nenhuma música carregada
                 self.play_current_song()
@@ -472,6 +4566,7 @@ class MusicPlayer:
                 pygame.mixer.music.unpause()
                 self.play_button.config(text="⏸")
                 self.is_playing = True
+                self.schedule_progress()
     
     def next_song(self):
         """Reproduz a próxima música na playlist."""
@@ -489,41 +4584,45 @@ class MusicPlayer:
         self.current_song_index = (self.current_song_index - 1) % len(self.playlist)
         self.play_current_song()
     
+    def current_position(self):
+        """Posição atual da música em segundos, considerando os saltos feitos."""
+        elapsed = pygame.mixer.music.get_pos()
+        if elapsed < 0:
+            return self.position_offset
+        return self.position_offset + elapsed / 1000
+    
+    def seek_to(self, seconds):
+        """Pula para ``seconds`` recomeçando a reprodução a partir dali."""
+        seconds = max(0.0, min(seconds, self.current_duration))
+        pygame.mixer.music.play(start=seconds)
+        self.position_offset = seconds
+        self.discard_end_events()
+    
     def rewind(self):
         """Retrocede 10 segundos."""
         if not self.is_playing:
             return
         
-        current_pos = pygame.mixer.music.get_pos() / 1000  # em segundos
-        new_pos = max(0, current_pos - 10)
-        pygame.mixer.music.rewind()
-        pygame.mixer.music.set_pos(new_pos)
+        self.seek_to(self.current_position() - 10)
     
     def forward(self):
         """Avança 10 segundos."""
         if not self.is_playing:
             return
         
-        current_pos = pygame.mixer.music.get_pos() / 1000  # em segundos
-        sound = pygame.mixer.Sound(self.playlist[self.current_song_index])
-        duration = sound.get_length()
-        new_pos = min(duration, current_pos + 10)
-        pygame.mixer.music.rewind()
-        pygame.mixer.music.set_pos(new_pos)
+        self.seek_to(self.current_position() + 10)
     
     def seek_position(self, value):
         """Define a posição da música na barra de progresso."""
-        if not self.is_playing:
+        if not self.is_playing or self._updating_progress:
             return
         
-        value = float(value)
-        pygame.mixer.music.rewind()
-        pygame.mixer.music.set_pos(value)
+        self.seek_to(float(value))
     
     def set_volume(self, value):
         """Define o volume da reprodução."""
         volume = float(value) / 100
-        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.set_volume(volume * self.track_gain)
         
         # Atualizar ícone de volume
         if volume == 0:
@@ -539,12 +4638,12 @@ class MusicPlayer:
         if self.is_muted:
             # Restaurar volume anterior
             self.volume_slider.set(self.previous_volume * 100)
-            pygame.mixer.music.set_volume(self.previous_volume)
+            pygame.mixer.music.set_volume(self.previous_volume * self.track_gain)
             self.mute_button.config(text="🔊")
             self.is_muted = False
         else:
             # Salvar volume atual e mutar
-            self.previous_volume = pygame.mixer.music.get_volume()
+            self.previous_volume = self.volume_slider.get() / 100
             pygame.mixer.music.set_volume(0)
             self.volume_slider.set(0)
             self.mute_button.config(text="🔇")
@@ -556,25 +4655,53 @@ class MusicPlayer:
         secs = int(seconds % 60)
         return f"{mins}:{secs:02d}"
     
-    def update_progress_thread(self):
-        """Thread para atualizar a barra de progresso."""
-        while True:
-            if self.is_playing and pygame.mixer.music.get_busy():
-                # Posição atual em milissegundos
-                current_pos = pygame.mixer.music.get_pos() / 1000
-                
-                if current_pos >= 0:
-                    # Atualizar barra de progresso
-                    self.progress_bar.set(current_pos)
-                    
-                    # Atualizar label de tempo atual
-                    self.current_time_label.config(text=self.format_time(current_pos))
-            
-            # Verificar se a música terminou
-            if self.is_playing and not pygame.mixer.music.get_busy():
+    def schedule_progress(self, interval=None):
+        """Agenda a próxima atualização da barra de progresso (só enquanto toca)."""
+        if self.progress_job is None:
+            self.progress_job = self.root.after(interval or self.PROGRESS_INTERVAL_MS, self.update_progress)
+    
+    def cancel_progress(self):
+        """Para as atualizações da barra de progresso."""
+        if self.progress_job is not None:
+            self.root.after_cancel(self.progress_job)
+            self.progress_job = None
+    
+    def discard_end_events(self):
+        """Descarta eventos de fim gerados por stop()/play() da faixa anterior."""
+        if self.end_events:
+            pygame.event.clear(self.music_end_event)
+    
+    def track_finished(self):
+        """Indica se a faixa atual terminou."""
+        if self.end_events:
+            return bool(pygame.event.get(self.music_end_event))
+        return not pygame.mixer.music.get_busy()
+    
+    def update_progress(self):
+        """Atualiza a barra de progresso e avança quando a faixa termina."""
+        self.progress_job = None
+        if not self.is_playing:
+            return
+        
+        # Verificar se a música terminou (com fila, o pygame já passou para a próxima)
+        if self.track_finished():
+            if self.queued is None:
                 self.next_song()
-                
-            time.sleep(0.1)
+                return
+            self.advance_to_queued()
+        
+        current_pos = self.current_position()
+        fading = self.apply_fade(current_pos)
+        
+        # Atualizar barra de progresso (sem disparar seek_position)
+        self._updating_progress = True
+        self.progress_bar.set(current_pos)
+        self._updating_progress = False
+        
+        # Atualizar label de tempo atual
+        self.current_time_label.config(text=self.format_time(current_pos))
+        
+        self.schedule_progress(self.FADE_INTERVAL_MS if fading else None)
     
     def search_music(self):
         """Busca uma música no YouTube."""
@@ -596,7 +4723,7 @@ class MusicPlayer:
             result = self.downloader.buscar_musica(query)
             
             # Atualizar UI no thread principal
-            self.root.after(0, lambda: self.update_search_result(result))
+            self.ui.chamar(self.update_search_result, result)
         
         threading.Thread(target=do_search, daemon=True).start()
     
@@ -616,16 +4743,14 @@ class MusicPlayer:
         
         # Mostrar thumbnail se disponível
         if result.get('thumbnail'):
-            try:
-                response = requests.get(result['thumbnail'])
-                img = Image.open(BytesIO(response.content))
-                img = img.resize((120, 90), Image.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
+            def mostrar(photo):
+                if photo is None or self.current_search_result is not result:
+                    return
                 thumbnail_label = ttk.Label(self.search_result_frame, image=photo)
                 thumbnail_label.image = photo  # Guardar referência
                 thumbnail_label.pack(before=self.download_button)
-            except Exception:
-                pass
+            
+            self.miniaturas.obter(result['thumbnail'], (120, 90), mostrar)
     
     def download_current_search(self):
         """Baixa a música atualmente em exibição nos resultados."""
@@ -633,16 +4758,24 @@ class MusicPlayer:
             return
         
         self.download_button.config(state=tk.DISABLED)
-        self.result_label.config(text="Baixando... Por favor, aguarde.")
+        self.result_label.config(text="Na fila de downloads... acompanhe o andamento abaixo.")
+        
+        # Entra na fila compartilhada na frente das playlists
+        job = self.downloader.enfileirar_download(self.current_search_result['url'],
+                                                  descricao=self.current_search_result['title'])
         
-        # Baixar em segundo plano
-        def do_download():
-            filepath = self.downloader.baixar_musica(self.current_search_result['url'])
+        def done(f):
+            filepath = None
+            if not f.cancelled():
+                if f.exception() is not None:
+                    print(f"Erro ao baixar música: {str(f.exception())}")
+                else:
+                    filepath = f.result()
             
             # Atualizar UI no thread principal
-            self.root.after(0, lambda: self.download_completed(filepath))
+            self.ui.chamar(self.download_completed, filepath)
         
-        threading.Thread(target=do_download, daemon=True).start()
+        job.future.add_done_callback(done)
     
     def download_completed(self, filepath):
         """Atualiza a interface após o download ser concluído."""
@@ -650,7 +4783,7 @@ class MusicPlayer:
             self.result_label.config(text="Download concluído com sucesso!")
             
             # Atualizar playlist
-            self.load_available_songs()
+            self.add_song(filepath)
             
             # Atualizar histórico
             self.load_history()
@@ -658,20 +4791,994 @@ class MusicPlayer:
             self.result_label.config(text="Erro ao realizar o download.")
         
         self.download_button.config(state=tk.NORMAL)
+    
+    def request_queue_refresh(self):
+        """Pede para redesenhar a fila de downloads; pode ser chamado de qualquer thread."""
+        if not self.queue_refresh_pending:
+            self.queue_refresh_pending = True
+            self.ui.chamar(self.refresh_download_queue)
+    
+    def refresh_download_queue(self):
+        """Mostra os jobs da fila de downloads, mantendo a seleção."""
+        self.queue_refresh_pending = False
+        selected = self.queue_tree.selection()
+        self.queue_tree.delete(*self.queue_tree.get_children())
+        for job in self.downloader.fila.estado():
+            origem = "Busca" if job['prioridade'] <= PRIORIDADE_INTERATIVA else "Playlist"
+            self.queue_tree.insert("", tk.END, iid=str(job['id']), text=job['descricao'],
+                                   values=(origem, self.QUEUE_STATE_LABELS.get(job['estado'], job['estado'])))
+        if selected and self.queue_tree.exists(selected[0]):
+            self.queue_tree.selection_set(selected[0])
+        self.pause_queue_button.config(text="Retomar fila" if self.downloader.fila.pausada else "Pausar fila")
+    
+    def queue_action(self, action):
+        """Aplica ``action`` (pausar, retomar ou cancelar da fila) ao job selecionado."""
+        selected = self.queue_tree.selection()
+        if selected and not action(int(selected[0])):
+            self.result_label.config(text="Só é possível alterar downloads que ainda não começaram.")
+    
+    def toggle_queue_pause(self):
+        """Segura ou solta a fila inteira; os downloads em andamento continuam."""
+        if self.downloader.fila.pausada:
+            self.downloader.fila.retomar()
+        else:
+            self.downloader.fila.pausar()
 
 
-def main():
+def main(gapless=True, crossfade=0.0, replaygain=True):
     """Função principal do programa."""
+    _carregar_gui()
     root = tk.Tk()
     downloader = MusicDownloader()
     
     # Inicializar o player
-    player = MusicPlayer(root, downloader)
+    player = MusicPlayer(root, downloader, gapless=gapless, crossfade=crossfade, replaygain=replaygain)
     
     # Iniciar loop principal da interface
     root.mainloop()
+    player.miniaturas.encerrar()
+    downloader.encerrar()
+
+
+def _rss_atual() -> int:
+    """Memória residente do processo em bytes (Linux), ou 0 se não disponível."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def benchmark_duracao(arquivos: List[str], repeticoes: int = 3) -> Dict:
+    """Compara ``pygame.mixer.Sound(...).get_length()`` com ``duracao_mp3``.
+
+    Mede a latência média por arquivo e o aumento de memória residente
+    enquanto o ``Sound`` (áudio todo decodificado) existe.
+    """
+    import pygame
+    pygame.mixer.init()
+    resultado = {'arquivos': len(arquivos), 'sound': {}, 'cabecalho': {}}
+
+    tempos, memoria = [], []
+    for arquivo in arquivos:
+        for _ in range(repeticoes):
+            antes = _rss_atual()
+            inicio = time.perf_counter()
+            sound = pygame.mixer.Sound(arquivo)
+            sound.get_length()
+            tempos.append(time.perf_counter() - inicio)
+            memoria.append(_rss_atual() - antes)
+            del sound
+    resultado['sound'] = {'latencia_media_ms': sum(tempos) / len(tempos) * 1000,
+                          'memoria_max_mb': max(memoria) / 2**20}
+
+    tempos, memoria = [], []
+    for arquivo in arquivos:
+        for _ in range(repeticoes):
+            antes = _rss_atual()
+            inicio = time.perf_counter()
+            duracao_mp3(arquivo)
+            tempos.append(time.perf_counter() - inicio)
+            memoria.append(_rss_atual() - antes)
+    resultado['cabecalho'] = {'latencia_media_ms': sum(tempos) / len(tempos) * 1000,
+                              'memoria_max_mb': max(memoria) / 2**20}
+
+    for nome, dados in (('pygame Sound', resultado['sound']), ('cabeçalho MP3', resultado['cabecalho'])):
+        print(f"{nome:>14}: {dados['latencia_media_ms']:9.2f} ms/arquivo, "
+              f"+{dados['memoria_max_mb']:.1f} MB de memória")
+    return resultado
+
+
+def gerar_mp3_silencio(caminho: str, segundos: float):
+    """Grava um MP3 CBR de 128 kbps só com frames vazios (silêncio), sem FFmpeg."""
+    frame = b'\xff\xfb\x90\x00' + b'\x00' * 413
+    with open(caminho, 'wb') as f:
+        f.write(frame * int(segundos * 44100 / 1152))
+
+
+@contextmanager
+def servidor_arquivos_local(diretorio: str, queda: float = 0.0, semente: int = 0):
+    """Servidor HTTP/1.1 (com keep-alive) servindo ``diretorio`` em 127.0.0.1.
+
+    Usado pelos benchmarks como substituto local do YouTube. Fornece a URL base.
+    Atende ``Range`` (um intervalo, como o servidor de vídeo do YouTube) e,
+    com ``queda`` > 0, corta essa fração das respostas pela metade, para
+    exercitar as novas tentativas e a retomada do yt_dlp.
+    """
+    import functools
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    sorteio = random.Random(semente)
+    sorteio_lock = threading.Lock()
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            caminho = self.translate_path(self.path)
+            if not os.path.isfile(caminho):
+                return super().do_GET()
+            tamanho = os.path.getsize(caminho)
+            inicio, fim, status = 0, tamanho - 1, 200
+            if self.headers.get('Range'):
+                faixa = _ler_range(self.headers['Range'], tamanho)
+                if faixa is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{tamanho}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                (inicio, fim), status = faixa, 206
+            self.send_response(status)
+            self.send_header('Content-Type', self.guess_type(caminho))
+            self.send_header('Content-Length', str(fim - inicio + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', f"bytes {inicio}-{fim}/{tamanho}")
+            self.end_headers()
+            quantidade = fim - inicio + 1
+            with sorteio_lock:
+                cortar = sorteio.random() < queda
+            if cortar:
+                quantidade //= 2
+                self.close_connection = True
+            with open(caminho, 'rb') as f:
+                f.seek(inicio)
+                while quantidade > 0:
+                    bloco = f.read(min(quantidade, 64 * 1024))
+                    if not bloco:
+                        break
+                    self.wfile.write(bloco)
+                    quantidade -= len(bloco)
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=diretorio))
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def benchmark_pool_ydl(faixas: int = 30, segundos: float = 5.0) -> Dict:
+    """Mede o custo por faixa de criar um ``YoutubeDL`` por download contra usar o pool.
+
+    Serve ``faixas`` MP3 gerados localmente e baixa todos duas vezes: uma
+    criando uma instância nova por faixa (como era antes) e outra com uma
+    instância do ``YoutubeDLPool``.
+    """
+    import tempfile
+    import yt_dlp
+
+    with tempfile.TemporaryDirectory() as temporario:
+        origem = os.path.join(temporario, 'origem')
+        os.makedirs(origem)
+        for i in range(faixas):
+            gerar_mp3_silencio(os.path.join(origem, f"faixa{i:04d}.mp3"), segundos)
+
+        with servidor_arquivos_local(origem) as base:
+            urls = [f"{base}/faixa{i:04d}.mp3" for i in range(faixas)]
+
+            def opcoes(destino):
+                return {'outtmpl': os.path.join(temporario, destino, '%(id)s.%(ext)s'),
+                        'quiet': True, 'no_warnings': True}
+
+            antes = []
+            for url in urls:
+                inicio = time.perf_counter()
+                with yt_dlp.YoutubeDL(opcoes('antes')) as ydl:
+                    ydl.extract_info(url, download=True)
+                antes.append(time.perf_counter() - inicio)
+
+            pool = YoutubeDLPool(opcoes('depois'), tamanho=1)
+            depois = []
+            for url in urls:
+                inicio = time.perf_counter()
+                with pool.obter() as ydl:
+                    ydl.extract_info(url, download=True)
+                depois.append(time.perf_counter() - inicio)
+            pool.fechar()
+
+    resultado = {}
+    for nome, tempos in (('instancia_por_faixa', antes), ('pool', depois)):
+        resultado[nome] = {'media_ms': sum(tempos) / len(tempos) * 1000,
+                           'p50_ms': _percentil(tempos, 50) * 1000,
+                           'p95_ms': _percentil(tempos, 95) * 1000}
+        print(f"{nome:>20}: média {resultado[nome]['media_ms']:.1f} ms, "
+              f"p50 {resultado[nome]['p50_ms']:.1f} ms, p95 {resultado[nome]['p95_ms']:.1f} ms por faixa")
+    return resultado
+
+
+def benchmark_transicao(faixas: int = 5, segundos: float = 2.0) -> Dict:
+    """Mede quanto cada troca de faixa acrescenta ao tempo de reprodução.
+
+    Toca ``faixas`` MP3 de silêncio de ``segundos`` cada, uma vez como o player
+    fazia antes (fim detectado por ``get_busy()`` no intervalo do player,
+    seguido de stop/load/play) e outra com a próxima faixa na fila do pygame.
+    O atraso por troca é o tempo total menos a soma das durações, dividido
+    pelo número de trocas. Sem placa de som, use ``SDL_AUDIODRIVER=dummy``.
+    """
+    import tempfile
+    # O evento de fim de faixa precisa da fila de eventos, que depende do vídeo
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+
+    pygame.mixer.init()
+    pygame.display.init()
+    evento_fim = pygame.USEREVENT + 1
+    intervalo = MusicPlayer.PROGRESS_INTERVAL_MS / 1000
+    resultado = {}
+    with tempfile.TemporaryDirectory() as temporario:
+        arquivos = []
+        for i in range(faixas):
+            caminho = os.path.join(temporario, f"faixa{i:04d}.mp3")
+            gerar_mp3_silencio(caminho, segundos)
+            arquivos.append(caminho)
+        soma = sum(duracao_mp3(caminho) for caminho in arquivos)
+
+        def classico():
+            for caminho in arquivos:
+                pygame.mixer.music.stop()
+                pygame.mixer.music.load(caminho)
+                pygame.mixer.music.play()
+                while pygame.mixer.music.get_busy():
+                    time.sleep(intervalo)
+
+        def gapless():
+            pygame.mixer.music.set_endevent(evento_fim)
+            pygame.event.clear(evento_fim)
+            pygame.mixer.music.load(arquivos[0])
+            pygame.mixer.music.play()
+            proxima = 1
+            if proxima < len(arquivos):
+                pygame.mixer.music.queue(arquivos[proxima])
+                proxima += 1
+            while pygame.mixer.music.get_busy():
+                time.sleep(intervalo)
+                for _ in pygame.event.get(evento_fim):
+                    if proxima < len(arquivos):
+                        pygame.mixer.music.queue(arquivos[proxima])
+                        proxima += 1
+            pygame.mixer.music.set_endevent()
+
+        trocas = max(1, faixas - 1)
+        for nome, modo in (('classico', classico), ('gapless', gapless)):
+            inicio = time.perf_counter()
+            modo()
+            extra = time.perf_counter() - inicio - soma
+            resultado[nome] = {'total_s': extra + soma, 'atraso_por_troca_ms': extra / trocas * 1000}
+            print(f"{nome:>10}: {extra + soma:.2f}s para {soma:.2f}s de áudio, "
+                  f"{resultado[nome]['atraso_por_troca_ms']:.1f} ms por troca")
+    pygame.mixer.quit()
+    return resultado
+
+
+def benchmark_servidor(clientes: int = 32, requisicoes: int = 50, faixas: int = 20,
+                       segundos: float = 60.0) -> Dict:
+    """Mede a vazão do ``LibraryServer`` com vários clientes simultâneos.
+
+    Cria uma biblioteca temporária com ``faixas`` MP3 de silêncio e dispara
+    ``clientes`` conexões keep-alive, cada uma com ``requisicoes`` pedidos
+    (arquivos inteiros, trechos com Range e a lista JSON). Roda duas vezes:
+    com ``sendfile`` e copiando os dados pelo Python, para comparar.
+    """
+    import tempfile
+
+    async def cliente(porta: int, nomes: List[str], semente: int, latencias: List[float]) -> int:
+        sorteio = random.Random(semente)
+        reader, writer = await asyncio.open_connection('127.0.0.1', porta)
+        recebidos = 0
+        try:
+            for _ in range(requisicoes):
+                escolha = sorteio.random()
+                if escolha < 0.1:
+                    pedido = "GET /api/musicas HTTP/1.1\r\nHost: x\r\n\r\n"
+                else:
+                    pedido = f"GET /musicas/{quote(sorteio.choice(nomes))} HTTP/1.1\r\nHost: x\r\n"
+                    if escolha < 0.55:
+                        inicio = sorteio.randrange(0, 200_000)
+                        pedido += f"Range: bytes={inicio}-{inicio + 65535}\r\n"
+                    pedido += "\r\n"
+                antes = time.perf_counter()
+                writer.write(pedido.encode('latin-1'))
+                cabecalho = await reader.readuntil(b'\r\n\r\n')
+                tamanho = int(re.search(rb'Content-Length: (\d+)', cabecalho).group(1))
+                await reader.readexactly(tamanho)
+                latencias.append(time.perf_counter() - antes)
+                recebidos += tamanho
+        finally:
+            writer.close()
+        return recebidos
+
+    async def rodar(servidor: LibraryServer, nomes: List[str]) -> Dict:
+        await servidor.iniciar()
+        latencias: List[float] = []
+        inicio = time.perf_counter()
+        recebidos = await asyncio.gather(*(cliente(servidor.porta, nomes, i, latencias)
+                                           for i in range(clientes)))
+        duracao = time.perf_counter() - inicio
+        servidor._servidor.close()
+        await servidor._servidor.wait_closed()
+        return {'requisicoes_por_s': len(latencias) / duracao,
+                'mb_por_s': sum(recebidos) / duracao / 1e6,
+                'p50_ms': _percentil(latencias, 50) * 1000,
+                'p95_ms': _percentil(latencias, 95) * 1000}
+
+    resultado = {}
+    with tempfile.TemporaryDirectory() as temporario:
+        nomes = []
+        for i in range(faixas):
+            nome = f"faixa {i:04d}.mp3"
+            gerar_mp3_silencio(os.path.join(temporario, nome), segundos)
+            nomes.append(nome)
+        db = Database(os.path.join(temporario, 'bench.db'))
+        biblioteca = LibraryIndex(db, temporario)
+        historico = HistoryStore(db)
+        for nome, sendfile in (('sendfile', True), ('leitura_escrita', False)):
+            servidor = LibraryServer(biblioteca, historico, host='127.0.0.1', porta=0, sendfile=sendfile)
+            resultado[nome] = asyncio.run(rodar(servidor, nomes))
+            dados = resultado[nome]
+            print(f"{nome:>16}: {dados['requisicoes_por_s']:8.0f} req/s, {dados['mb_por_s']:7.1f} MB/s, "
+                  f"p50 {dados['p50_ms']:.2f} ms, p95 {dados['p95_ms']:.2f} ms")
+        db.fechar()
+    return resultado
+
+
+def benchmark_memoria(itens: int = 100_000, diretorio: Optional[str] = None) -> Dict:
+    """Compara a memória do histórico e da playlist antes e depois da representação compacta.
+
+    Monta um histórico de ``itens`` downloads num banco temporário e mede com
+    ``tracemalloc``: a lista de dicionários (com a data já formatada) e os
+    textos da aba de histórico, como era antes, contra o ``HistoryPages`` com
+    as colunas preguiçosas; e a lista de caminhos com o dicionário caminho ->
+    posição contra a ``PathList``.
+    """
+    import gc
+    import tempfile
+    import tracemalloc
+
+    def medir(montar: Callable[[], object]) -> Tuple[float, float]:
+        # O tempo é medido sem o tracemalloc, que deixa tudo bem mais lento
+        gc.collect()
+        inicio = time.perf_counter()
+        objeto = montar()
+        duracao = time.perf_counter() - inicio
+        del objeto
+        gc.collect()
+        tracemalloc.start()
+        objeto = montar()
+        gc.collect()
+        memoria = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objeto
+        return memoria / 2**20, duracao * 1000
+
+    with tempfile.TemporaryDirectory(dir=diretorio) as temporario:
+        pasta = os.path.join(temporario, "Downloads", "Musicas")
+        db = Database(os.path.join(temporario, 'memoria.db'))
+        store = HistoryStore(db)
+        agora = int(time.time())
+        db.executar_varios(
+            "INSERT INTO historico (title, url, video_id, ts, arquivo) VALUES (?, ?, ?, ?, ?)",
+            [(f"Artista {i % 500} - Música número {i}", f"https://www.youtube.com/watch?v={i:011d}", f"{i:011d}",
+              agora - i, os.path.join(pasta, f"Artista {i % 500} - Música número {i}.mp3")) for i in range(itens)],
+        )
+
+        def caminhos():
+            # Strings novas a cada leitura, como as que vêm de biblioteca.listar()
+            return (linha[0] for linha in db.consultar("SELECT arquivo FROM historico ORDER BY id"))
+
+        def historico_antes():
+            lista = [{'id': linha['id'], 'title': linha['title'], 'url': linha['url'],
+                      'data': _formatar_data(linha['ts']), 'arquivo': linha['arquivo']}
+                     for linha in db.consultar("SELECT * FROM historico ORDER BY id")]
+            textos = [f"{item['title']} - {item['data']}" for item in lista]
+            buscas = [item['title'].lower() for item in lista]
+            return lista, textos, buscas
+
+        def historico_depois():
+            paginas = HistoryPages(store)
+            textos = LazyColumn(len(paginas), lambda i: f"{paginas[i].title} - {paginas[i].data}")
+            # Como a aba de histórico: a primeira tela e a última página
+            for i in list(range(15)) + list(range(len(paginas) - 15, len(paginas))):
+                textos[i]
+            return paginas, textos
+
+        def playlist_antes():
+            # Como o show_library fazia: caminhos, dicionário e o nome de cada um para a lista
+            playlist = list(caminhos())
+            return playlist, {caminho: i for i, caminho in enumerate(playlist)}, \
+                [os.path.basename(caminho) for caminho in playlist]
+
+        def playlist_depois():
+            # Os nomes mostrados já são os da PathList
+            return PathList(caminhos())
+
+        resultado = {'itens': itens}
+        for nome, antes, depois in (('historico', historico_antes, historico_depois),
+                                    ('playlist', playlist_antes, playlist_depois)):
+            memoria_antes, tempo_antes = medir(antes)
+            memoria_depois, tempo_depois = medir(depois)
+            resultado[nome] = {'antes_mb': memoria_antes, 'depois_mb': memoria_depois,
+                               'antes_ms': tempo_antes, 'depois_ms': tempo_depois}
+            print(f"{nome:>10}: {memoria_antes:7.1f} MB -> {memoria_depois:6.1f} MB, "
+                  f"carga {tempo_antes:6.0f} ms -> {tempo_depois:5.0f} ms ({itens} itens)")
+        db.fechar()
+    return resultado
+
+
+def backend_busca_local(base: str, faixas: int, latencia: float = 0.05) -> Callable[[str, int], List[Dict]]:
+    """Backend de busca falso para os benchmarks: cada busca leva ``latencia``
+    segundos e aponta para uma das ``faixas`` servidas em ``base``
+    (``faixa0000.mp3``...), sempre a mesma para a mesma busca."""
+    def buscar(query: str, limite: int) -> List[Dict]:
+        time.sleep(latencia)
+        numero = int(hashlib.sha1(normalizar_busca(query).encode('utf-8')).hexdigest(), 16)
+        return [{
+            'title': f"{query} ({i + 1})",
+            'url': f"{base}/faixa{(numero + i) % faixas:04d}.mp3",
+            'duration': "0:01",
+            'thumbnail': None,
+        } for i in range(limite)]
+    return buscar
+
+
+def _rss_pico_mb() -> Optional[float]:
+    """Pico de memória residente deste processo, em MB (None onde não há ``resource``)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+
+
+def _latencias(tempos: List[float]) -> Dict:
+    return {'p50_ms': _percentil(tempos, 50) * 1000,
+            'p95_ms': _percentil(tempos, 95) * 1000,
+            'max_ms': max(tempos, default=0.0) * 1000}
+
+
+def _gerar_faixas(diretorio: str, quantidade: int, segundos: float):
+    os.makedirs(diretorio, exist_ok=True)
+    for i in range(quantidade):
+        gerar_mp3_silencio(os.path.join(diretorio, f"faixa{i:04d}.mp3"), segundos)
+
+
+def _cenario_download(temporario: str, escala: float) -> Dict:
+    """Downloads avulsos (``baixar_musica``) de faixas diferentes, um de cada vez."""
+    faixas = max(1, int(20 * escala))
+    _gerar_faixas(os.path.join(temporario, 'origem'), faixas, 5.0)
+    downloader = MusicDownloader()
+    tempos = []
+    try:
+        with servidor_arquivos_local(os.path.join(temporario, 'origem'), queda=0.1) as base:
+            for i in range(faixas):
+                inicio = time.perf_counter()
+                if downloader.baixar_musica(f"{base}/faixa{i:04d}.mp3", forcar=True) is None:
+                    raise RuntimeError(f"faixa{i:04d} não foi baixada")
+                tempos.append(time.perf_counter() - inicio)
+    finally:
+        downloader.encerrar()
+    return {'faixas': faixas, 'faixas_por_s': faixas / sum(tempos), **_latencias(tempos)}
+
+
+def _cenario_playlist(temporario: str, escala: float) -> Dict:
+    """Uma lista de músicas por nome (busca falsa + downloads em lote), como ``lista``."""
+    entradas = max(1, int(1000 * escala))
+    _gerar_faixas(os.path.join(temporario, 'origem'), entradas, 1.0)
+    downloader = MusicDownloader()
+    try:
+        with servidor_arquivos_local(os.path.join(temporario, 'origem'), queda=0.02) as base:
+            downloader.backend_busca = backend_busca_local(base, entradas)
+            # Nomes escolhidos para que cada um caia numa faixa diferente
+            nomes, usadas = [], set()
+            candidato = 0
+            while len(nomes) < entradas:
+                nome = f"musica {candidato}"
+                candidato += 1
+                numero = int(hashlib.sha1(normalizar_busca(nome).encode('utf-8')).hexdigest(), 16) % entradas
+                if numero not in usadas:
+                    usadas.add(numero)
+                    nomes.append(nome)
+            inicio = time.perf_counter()
+            resumo = baixar_lista(downloader, nomes)
+            duracao = time.perf_counter() - inicio
+        histogramas = downloader.metricas.resumo()['histogramas']
+    finally:
+        downloader.encerrar()
+    download = histogramas.get('download', {})
+    return {
+        'entradas': entradas,
+        'falhas': len(resumo.falhas),
+        'total_s': duracao,
+        'faixas_por_s': len(resumo.sucessos) / duracao,
+        'primeiro_agendamento_s': (resumo.primeiro_agendamento or resumo.inicio) - resumo.inicio,
+        'download_p50_ms': download.get('p50', 0.0) * 1000,
+        'download_p95_ms': download.get('p95', 0.0) * 1000,
+    }
+
+
+def _cenario_historico(temporario: str, escala: float) -> Dict:
+    """Registro de downloads no histórico com ele crescendo, e a carga dele na abertura."""
+    itens = max(10, int(20000 * escala))
+    downloader = MusicDownloader()
+    try:
+        tempos = []
+        for i in range(itens):
+            inicio = time.perf_counter()
+            downloader.historico_store.adicionar(f"Música {i}", f"https://www.youtube.com/watch?v={i:011d}",
+                                                 os.path.join(temporario, f"musica{i}.mp3"))
+            downloader.atualizar_historico()
+            tempos.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        downloader.carregar_historico()
+        carga = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        downloader.historico_store.por_titulo("Música 1")
+        busca = time.perf_counter() - inicio
+    finally:
+        downloader.encerrar()
+    decimo = max(1, itens // 10)
+    return {
+        'itens': itens,
+        'registros_por_s': itens / sum(tempos),
+        'registro_inicio_p50_ms': _percentil(tempos[:decimo], 50) * 1000,
+        'registro_fim_p50_ms': _percentil(tempos[-decimo:], 50) * 1000,
+        'registro_p95_ms': _percentil(tempos, 95) * 1000,
+        'carga_ms': carga * 1000,
+        'busca_titulo_ms': busca * 1000,
+    }
+
+
+def _cenario_biblioteca(temporario: str, escala: float) -> Dict:
+    """Varredura da pasta de músicas pelo ``LibraryIndex``: a primeira e uma sem mudanças."""
+    arquivos = max(1, int(2000 * escala))
+    diretorio = os.path.join(temporario, 'biblioteca')
+    _gerar_faixas(diretorio, arquivos, 1.0)
+    db = Database(os.path.join(temporario, 'biblioteca.db'))
+    try:
+        biblioteca = LibraryIndex(db, diretorio)
+        inicio = time.perf_counter()
+        biblioteca.sincronizar()
+        fria = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        biblioteca.sincronizar()
+        quente = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        biblioteca.listar()
+        listagem = time.perf_counter() - inicio
+    finally:
+        db.fechar()
+    return {'arquivos': arquivos, 'arquivos_por_s': arquivos / fria, 'varredura_fria_ms': fria * 1000,
+            'varredura_quente_ms': quente * 1000, 'listagem_ms': listagem * 1000}
+
+
+def _cenario_memoria(temporario: str, escala: float) -> Dict:
+    """Memória do histórico e da playlist com 100 mil itens (veja ``benchmark_memoria``)."""
+    resultado = benchmark_memoria(max(100, int(100_000 * escala)), temporario)
+    return {f"{nome}_{chave}": valor for nome in ('historico', 'playlist')
+            for chave, valor in resultado[nome].items()}
+
+
+def _cenario_troca(temporario: str, escala: float) -> Dict:
+    """Atraso de cada troca de faixa no player (veja ``benchmark_transicao``)."""
+    resultado = benchmark_transicao(max(2, int(5 * escala)), 2.0)
+    return {'classico_troca_ms': resultado['classico']['atraso_por_troca_ms'],
+            'gapless_troca_ms': resultado['gapless']['atraso_por_troca_ms']}
+
+
+CENARIOS_BENCHMARK = {
+    'download': _cenario_download,
+    'playlist': _cenario_playlist,
+    'historico': _cenario_historico,
+    'biblioteca': _cenario_biblioteca,
+    'memoria': _cenario_memoria,
+    'troca': _cenario_troca,
+}
+
+
+def executar_cenario(nome: str, escala: float = 1.0) -> Dict:
+    """Roda um cenário neste processo e acrescenta o pico de memória.
+
+    Chamado pelo ``executar_benchmarks`` num subprocesso com ``HOME``
+    apontando para uma pasta temporária, então o downloader não toca na
+    biblioteca de verdade e o pico de memória é só do cenário.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as temporario:
+        resultado = CENARIOS_BENCHMARK[nome](temporario, escala)
+    resultado['rss_pico_mb'] = _rss_pico_mb()
+    return resultado
+
+
+def _regressoes(atual: Dict, base: Dict, tolerancia: float) -> List[str]:
+    """Métricas piores que a base além da ``tolerancia`` (0.1 = 10%).
+
+    ``*_por_s`` é melhor quanto maior; tempos (``*_ms``, ``*_s``) e memória
+    (``*_mb``), quanto menor. Contagens e o que não existe nas duas ficam de fora.
+    """
+    piores = []
+    for cenario, metricas in atual.get('cenarios', {}).items():
+        anteriores = base.get('cenarios', {}).get(cenario, {})
+        for nome, valor in metricas.items():
+            anterior = anteriores.get(nome)
+            if not isinstance(valor, (int, float)) or not isinstance(anterior, (int, float)) or not anterior:
+                continue
+            if nome.endswith('_por_s'):
+                variacao = (anterior - valor) / anterior
+            elif nome.endswith(('_ms', '_s', '_mb')):
+                variacao = (valor - anterior) / anterior
+            else:
+                continue
+            if variacao > tolerancia:
+                piores.append(f"{cenario}.{nome}: {anterior:.2f} -> {valor:.2f} ({variacao:+.0%})")
+    return piores
+
+
+def executar_benchmarks(cenarios: Optional[List[str]] = None, escala: float = 1.0,
+                        saida: Optional[str] = None, base: Optional[str] = None,
+                        tolerancia: float = 0.1) -> Dict:
+    """Roda os cenários de benchmark, cada um num subprocesso isolado, contra o YouTube falso.
+
+    O YouTube é substituído por ``servidor_arquivos_local`` (MP3 gerados,
+    com Range e conexões cortadas) e ``backend_busca_local``. ``escala``
+    multiplica o tamanho de cada cenário (0.1 para uma rodada rápida). O
+    resultado vai em JSON para ``saida``; com ``base`` (um JSON anterior),
+    as métricas que pioraram mais que ``tolerancia`` aparecem em ``regressoes``.
+    """
+    import platform
+    import tempfile
+    resultado = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'escala': escala,
+        'cenarios': {},
+    }
+    for nome in cenarios or list(CENARIOS_BENCHMARK):
+        print(f"Cenário {nome}...", flush=True)
+        with tempfile.TemporaryDirectory() as home:
+            ambiente = dict(os.environ, HOME=home, USERPROFILE=home)
+            ambiente.setdefault('SDL_AUDIODRIVER', 'dummy')
+            processo = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), 'benchmark', '--cenario-interno', nome,
+                 '--escala', str(escala)],
+                capture_output=True, text=True, env=ambiente,
+            )
+        linhas = processo.stdout.strip().splitlines()
+        if processo.returncode != 0 or not linhas:
+            erro = (processo.stderr.strip().splitlines() or ["sem saída"])[-1]
+            print(f"Erro ao rodar o cenário {nome}: {erro}")
+            resultado['cenarios'][nome] = {'erro': erro}
+            continue
+        dados = resultado['cenarios'][nome] = json.loads(linhas[-1])
+        print("  " + ", ".join(f"{chave}={valor:.2f}" if isinstance(valor, float) else f"{chave}={valor}"
+                               for chave, valor in dados.items()))
+
+    if base:
+        with open(base, 'r', encoding='utf-8') as f:
+            resultado['regressoes'] = _regressoes(resultado, json.load(f), tolerancia)
+        print(f"\nComparado com {base}: {len(resultado['regressoes'])} regressões")
+        for linha in resultado['regressoes']:
+            print(f"  {linha}")
+    if saida:
+        with open(saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"Resultados gravados em {saida}")
+    return resultado
+
+
+MODULOS_GUI = ('tkinter', 'pygame', 'PIL')
+
+
+def medir_inicializacao(repeticoes: int = 5) -> Dict:
+    """Mede o tempo de inicialização do modo linha de comando e da interface.
+
+    Roda o script em subprocessos com ``-X importtime``: o modo linha de
+    comando (``--help``) e o carregamento dos módulos da interface
+    (``_carregar_gui``, sem abrir janela). Informa a mediana em ms e quais
+    módulos da interface cada caminho importou.
+    """
+    def medir(argumentos: List[str]) -> Tuple[float, List[str]]:
+        tempos, importados = [], set()
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            processo = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__)] + argumentos,
+                                      capture_output=True, text=True)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            if processo.returncode != 0:
+                print(f"Aviso: {' '.join(argumentos)} terminou com erro: {processo.stderr.strip().splitlines()[-1]}")
+            for linha in processo.stderr.splitlines():
+                if linha.startswith('import time:'):
+                    modulo = linha.rsplit('|', 1)[-1].strip()
+                    if modulo.split('.')[0] in MODULOS_GUI:
+                        importados.add(modulo.split('.')[0])
+        tempos.sort()
+        return tempos[len(tempos) // 2], sorted(importados)
+
+    resultado = {}
+    for nome, argumentos in (('linha de comando', ['--help']), ('interface', ['tempo-inicio', '--so-gui'])):
+        mediana, importados = medir(argumentos)
+        resultado[nome] = {'mediana_ms': mediana, 'modulos_gui': importados}
+        print(f"{nome:>16}: {mediana:8.1f} ms  módulos da interface: {', '.join(importados) or 'nenhum'}")
+    return resultado
+
+
+def _ler_lista(arquivo: str) -> List[str]:
+    """Linhas não vazias de um arquivo de lista, ignorando comentários (#)."""
+    with open(arquivo, 'r', encoding='utf-8') as f:
+        return [linha.strip() for linha in f if linha.strip() and not linha.lstrip().startswith('#')]
+
+
+def baixar_lista(downloader: "MusicDownloader", itens: List[str], max_workers: Optional[int] = None,
+                 forcar: bool = False) -> DownloadSummary:
+    """Baixa uma lista de URLs e/ou nomes de músicas.
+
+    Os nomes são resolvidos de uma vez com ``buscar_musicas`` (primeiro
+    resultado de cada um) e tudo passa pelo mesmo ``DownloadScheduler``.
+    """
+    urls = [item for item in itens if '://' in item or extrair_video_id(item)]
+    nomes = [item for item in itens if item not in urls]
+    if nomes:
+        print(f"Buscando {len(nomes)} músicas...")
+        for nome, resultados in downloader.buscar_musicas(nomes, limite=1).items():
+            if resultados:
+                urls.append(resultados[0].url)
+            else:
+                print(f"Nenhum resultado para: {nome}")
+
+    scheduler = DownloadScheduler(
+        lambda u: downloader._baixar_musica_async(u, forcar),
+        max_workers=max_workers or downloader.max_workers,
+        estagio=downloader.estagio_download,
+        fila=downloader.fila,
+    )
+    with scheduler:
+        for url in urls:
+            scheduler.agendar(url)
+    scheduler.resumo.imprimir()
+    downloader.imprimir_estatisticas_pipeline()
+    return scheduler.resumo
+
+
+def _ler_taxa(texto: str) -> float:
+    """Converte taxas como ``500K``, ``2M`` ou ``1.5M`` (bytes por segundo)."""
+    multiplicadores = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    texto = texto.strip().upper().rstrip('/S').rstrip('B')
+    if texto and texto[-1] in multiplicadores:
+        return float(texto[:-1]) * multiplicadores[texto[-1]]
+    return float(texto)
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Baixador de músicas do YouTube. Sem comando, abre o player com interface gráfica.")
+    parser.add_argument('--limite-banda', type=_ler_taxa, metavar='TAXA',
+                        help="banda máxima somando todos os downloads, por exemplo 2M (bytes/s)")
+    parser.add_argument('--requisicoes-por-host', type=float, default=2.0, metavar='N',
+                        help="requisições de extração de metadados e de playlists por segundo a cada "
+                             "host (padrão: 2); o download da mídia é limitado só por --limite-banda")
+    parser.add_argument('--replaygain', action='store_true',
+                        help="mede o loudness (EBU R128) dos downloads e grava tags ReplayGain")
+    parser.add_argument('--duplicatas', choices=('avisar', 'pular', 'substituir', 'perguntar'),
+                        help="compara a impressão digital de cada download com a biblioteca "
+                             "('perguntar' pergunta no fim do lote e só num terminal)")
+    parser.add_argument('--metricas', metavar='ARQUIVO',
+                        help="grava spans e o resumo das métricas em JSON lines nesse arquivo")
+    comandos = parser.add_subparsers(dest='comando')
+
+    gui = comandos.add_parser('gui', help="abre o player com interface gráfica")
+    gui.add_argument('--sem-gapless', action='store_true', help="carrega cada faixa só quando a anterior termina")
+    gui.add_argument('--crossfade', type=float, default=0.0, metavar='SEG',
+                     help="segundos de fade entre faixas (padrão: 0)")
+    gui.add_argument('--sem-replaygain', action='store_true', help="ignora o ganho ReplayGain das faixas")
+
+    buscar = comandos.add_parser('buscar', help="busca músicas e mostra os resultados")
+    buscar.add_argument('queries', nargs='+', help="termos de busca")
+    buscar.add_argument('-n', '--limite', type=int, default=5, help="resultados por busca")
+
+    baixar = comandos.add_parser('baixar', help="baixa uma ou mais músicas pela URL")
+    baixar.add_argument('urls', nargs='+')
+    baixar.add_argument('--forcar', action='store_true', help="baixa mesmo se já estiver no índice")
+    baixar.add_argument('--reverificar', action='store_true', help="confere o checksum do arquivo existente")
+
+    playlist = comandos.add_parser('playlist', help="baixa todas as músicas de uma playlist")
+    playlist.add_argument('url')
+    playlist.add_argument('-w', '--workers', type=int, help="downloads simultâneos")
+    playlist.add_argument('--forcar', action='store_true')
+    playlist.add_argument('--streaming', action='store_true',
+                          help="começa a baixar enquanto a playlist ainda está sendo lida")
+    playlist.add_argument('-s', '--sim', action='store_true', help="não pede confirmação")
+
+    lista = comandos.add_parser('lista', help="baixa as URLs ou nomes de música de um arquivo (um por linha)")
+    lista.add_argument('arquivo')
+    lista.add_argument('-w', '--workers', type=int, help="downloads simultâneos")
+    lista.add_argument('--forcar', action='store_true')
+
+    retomar = comandos.add_parser('retomar', help="retoma a última execução interrompida")
+    retomar.add_argument('-w', '--workers', type=int, help="downloads simultâneos")
+
+    loudness = comandos.add_parser('loudness', help="grava tags ReplayGain nas músicas da biblioteca")
+    loudness.add_argument('-w', '--workers', type=int, help="processos simultâneos")
+    loudness.add_argument('--limite', type=int, help="máximo de arquivos nesta passada")
+    loudness.add_argument('--refazer', action='store_true', help="mede de novo arquivos que já têm ganho")
+
+    impressoes = comandos.add_parser('impressoes', help="indexa as impressões digitais e lista áudios repetidos")
+    impressoes.add_argument('-w', '--workers', type=int, help="processos simultâneos")
+    impressoes.add_argument('--limite', type=int, help="máximo de arquivos nesta passada")
+
+    reparar = comandos.add_parser('reparar', help="corrige tags, capas e caminhos da biblioteca em lote")
+    reparar.add_argument('-w', '--workers', type=int, help="processos simultâneos")
+    reparar.add_argument('--online', action='store_true', help="busca título, canal e miniatura com o yt_dlp")
+    reparar.add_argument('--limite', type=int, help="máximo de arquivos nesta passada")
+    reparar.add_argument('--recomecar', action='store_true', help="confere de novo os arquivos já reparados")
+    reparar.add_argument('--relatorio', metavar='ARQUIVO', help="grava o relatório completo em JSON")
+
+    servir = comandos.add_parser('servir', help="serve a biblioteca por HTTP para outros aparelhos da rede")
+    servir.add_argument('--host', default='0.0.0.0', help="endereço de escuta (padrão: todas as interfaces)")
+    servir.add_argument('-p', '--porta', type=int, default=8000)
+    servir.add_argument('--cache-variantes', type=_ler_taxa, default=2 * 2**30, metavar='TAMANHO',
+                        help="espaço para as variantes de bitrate menor, por exemplo 500M (padrão: 2G; 0 desliga)")
+
+    duracao = comandos.add_parser('benchmark-duracao', help="compara formas de obter a duração de MP3")
+    duracao.add_argument('arquivos', nargs='+')
+
+    pool = comandos.add_parser('benchmark-pool', help="compara YoutubeDL por faixa com o pool de instâncias")
+    pool.add_argument('-n', '--faixas', type=int, default=30)
+
+    transicao = comandos.add_parser('benchmark-transicao',
+                                    help="mede o atraso de cada troca de faixa, com e sem a fila do pygame")
+    transicao.add_argument('-n', '--faixas', type=int, default=5)
+    transicao.add_argument('-s', '--segundos', type=float, default=2.0, help="duração de cada faixa")
+
+    servidor = comandos.add_parser('benchmark-servidor', help="mede a vazão do servidor HTTP da biblioteca")
+    servidor.add_argument('-c', '--clientes', type=int, default=32, help="conexões simultâneas")
+    servidor.add_argument('-n', '--requisicoes', type=int, default=50, help="requisições por conexão")
+    servidor.add_argument('--faixas', type=int, default=20)
+
+    benchmark = comandos.add_parser('benchmark', help="roda a bateria de benchmarks contra um YouTube falso local")
+    benchmark.add_argument('cenarios', nargs='*', metavar='CENARIO',
+                           help=f"cenários a rodar: {', '.join(CENARIOS_BENCHMARK)} (padrão: todos)")
+    benchmark.add_argument('--escala', type=float, default=1.0, help="multiplica o tamanho dos cenários")
+    benchmark.add_argument('-o', '--saida', metavar='ARQUIVO', help="grava os resultados em JSON")
+    benchmark.add_argument('--base', metavar='ARQUIVO', help="JSON de uma rodada anterior para comparar")
+    benchmark.add_argument('--tolerancia', type=float, default=0.1,
+                           help="piora aceita antes de apontar regressão (padrão: 0.1 = 10%%)")
+    benchmark.add_argument('--cenario-interno', help=argparse.SUPPRESS)
+
+    memoria = comandos.add_parser('benchmark-memoria',
+                                  help="compara a memória do histórico e da playlist, antes e depois")
+    memoria.add_argument('-n', '--itens', type=int, default=100_000)
+
+    inicio = comandos.add_parser('tempo-inicio', help="mede o tempo de inicialização")
+    inicio.add_argument('-r', '--repeticoes', type=int, default=5)
+    inicio.add_argument('--so-gui', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+def cli(argv: Optional[List[str]] = None) -> int:
+    """Ponto de entrada da linha de comando."""
+    args = criar_parser().parse_args(argv)
+
+    if args.comando in (None, 'gui'):
+        main(gapless=not getattr(args, 'sem_gapless', False), crossfade=getattr(args, 'crossfade', 0.0),
+             replaygain=not getattr(args, 'sem_replaygain', False))
+        return 0
+    if args.comando == 'benchmark-duracao':
+        benchmark_duracao(args.arquivos)
+        return 0
+    if args.comando == 'benchmark-transicao':
+        benchmark_transicao(args.faixas, args.segundos)
+        return 0
+    if args.comando == 'benchmark-pool':
+        benchmark_pool_ydl(args.faixas)
+        return 0
+    if args.comando == 'benchmark-servidor':
+        benchmark_servidor(args.clientes, args.requisicoes, args.faixas)
+        return 0
+    if args.comando == 'benchmark':
+        if args.cenario_interno:
+            print(json.dumps(executar_cenario(args.cenario_interno, args.escala)))
+            return 0
+        desconhecidos = [nome for nome in args.cenarios if nome not in CENARIOS_BENCHMARK]
+        if desconhecidos:
+            print(f"Cenários desconhecidos: {', '.join(desconhecidos)}")
+            return 2
+        resultado = executar_benchmarks(args.cenarios, args.escala, args.saida, args.base, args.tolerancia)
+        falhou = any('erro' in dados for dados in resultado['cenarios'].values())
+        return 1 if falhou or resultado.get('regressoes') else 0
+    if args.comando == 'benchmark-memoria':
+        benchmark_memoria(args.itens)
+        return 0
+    if args.comando == 'tempo-inicio':
+        if args.so_gui:
+            _carregar_gui()
+        else:
+            medir_inicializacao(args.repeticoes)
+        return 0
+
+    exportadores = [JsonLinesExporter(args.metricas)] if args.metricas else []
+    downloader = MusicDownloader(limite_banda=args.limite_banda,
+                                 requisicoes_por_host=args.requisicoes_por_host,
+                                 metricas=MetricsCollector(exportadores),
+                                 replaygain=args.replaygain,
+                                 duplicatas=args.duplicatas)
+    try:
+        if args.comando == 'buscar':
+            for query, resultados in downloader.buscar_musicas(args.queries, limite=args.limite).items():
+                print(f"\n{query}:")
+                for musica in resultados:
+                    print(f"  {musica.title} [{musica.duration}] {musica.url}")
+        elif args.comando == 'baixar':
+            falhas = sum(downloader.baixar_musica(url, args.forcar, args.reverificar) is None for url in args.urls)
+            downloader.resolver_duplicatas()
+            downloader.imprimir_estatisticas_pipeline()
+            return 1 if falhas else 0
+        elif args.comando == 'playlist':
+            resumo = downloader.baixar_playlist(args.url, max_workers=args.workers, forcar=args.forcar,
+                                                streaming=args.streaming, confirmar=not args.sim)
+            downloader.resolver_duplicatas()
+            return 1 if resumo is None or resumo.falhas else 0
+        elif args.comando == 'lista':
+            resumo = baixar_lista(downloader, _ler_lista(args.arquivo), args.workers, args.forcar)
+            downloader.resolver_duplicatas()
+            return 1 if resumo.falhas else 0
+        elif args.comando == 'retomar':
+            resumo = downloader.retomar_ultima_execucao(args.workers)
+            downloader.resolver_duplicatas()
+            return 1 if resumo is not None and resumo.falhas else 0
+        elif args.comando == 'loudness':
+            relatorio = downloader.analisar_loudness(args.workers, args.limite, args.refazer)
+            return 1 if relatorio['falhas'] else 0
+        elif args.comando == 'impressoes':
+            relatorio = downloader.indexar_impressoes(args.workers, args.limite)
+            return 1 if relatorio['falhas'] else 0
+        elif args.comando == 'servir':
+            downloader.servir_biblioteca(args.host, args.porta, int(args.cache_variantes))
+        elif args.comando == 'reparar':
+            relatorio = downloader.reparar_biblioteca(args.workers, args.online, args.limite, args.recomecar)
+            if args.relatorio:
+                with open(args.relatorio, 'w', encoding='utf-8') as f:
+                    json.dump(relatorio, f, ensure_ascii=False, indent=2)
+            return 1 if relatorio['falhas'] else 0
+    finally:
+        downloader.encerrar()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
     
@@ -0,0 +1,185 @@
+import asyncio
+import http.client
+import importlib.util
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def baixador():
+    """O módulo ``baixador3.0.py`` (o ponto no nome impede um ``import`` normal)."""
+    spec = importlib.util.spec_from_file_location('baixador3', os.path.join(RAIZ, 'baixador3.0.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules['baixador3'] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture
+def db(baixador, tmp_path):
+    return baixador.Database(str(tmp_path / 'baixador.db'))
+
+
+class FakeYouTube:
+    """Estado do ``yt_dlp.YoutubeDL`` falso: playlists, vídeos que falham e concorrência."""
+
+    def __init__(self, baixador):
+        self.baixador = baixador
+        self.playlists = {}    # URL -> info da playlist (com 'entries')
+        self.falhas = set()    # IDs cujo download falha
+        self.atraso = 0.0      # segundos de cada download
+        self.ao_baixar = None  # chamado no início de cada download, com o ID
+        self.baixados = []
+        self.ativos = 0
+        self.maximo_ativos = 0
+        self._lock = threading.Lock()
+
+    def modulo(self):
+        estado = self
+
+        class YoutubeDL:
+            def __init__(self, opcoes):
+                self.opcoes = opcoes
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *_erro):
+                self.close()
+
+            def close(self):
+                pass
+
+            def extract_info(self, url, download=True, process=True, ie_key=None):
+                if url in estado.playlists:
+                    return estado.playlists[url](process) if callable(estado.playlists[url]) \
+                        else estado.playlists[url]
+                video_id = estado.baixador.extrair_video_id(url)
+                return {'id': video_id, 'title': f'Faixa {video_id}', 'uploader': 'Canal', 'ext': 'webm',
+                        'webpage_url': url}
+
+            def prepare_filename(self, info):
+                return self.opcoes['outtmpl'].replace('%(id)s', info['id']).replace('%(ext)s', info['ext'])
+
+            def process_ie_result(self, info, download=True):
+                with estado._lock:
+                    estado.ativos += 1
+                    estado.maximo_ativos = max(estado.maximo_ativos, estado.ativos)
+                try:
+                    if estado.ao_baixar:
+                        estado.ao_baixar(info['id'])
+                    time.sleep(estado.atraso)
+                    if info['id'] in estado.falhas:
+                        raise Exception(f"ERROR: [youtube] {info['id']}: Video unavailable")
+                    caminho = self.prepare_filename(info)
+                    estado.baixador.gerar_mp3_silencio(caminho, 1)
+                    with estado._lock:
+                        estado.baixados.append(info['id'])
+                    return dict(info, requested_downloads=[{'filepath': caminho}])
+                finally:
+                    with estado._lock:
+                        estado.ativos -= 1
+
+        def sanitize_filename(nome):
+            return re.sub(r'[\\/:*?"<>|]', '_', nome)
+
+        return types.SimpleNamespace(YoutubeDL=YoutubeDL, utils=types.SimpleNamespace(
+            sanitize_filename=sanitize_filename))
+
+
+def video(numero: int) -> str:
+    return f'vid{numero:08d}'
+
+
+@pytest.fixture
+def youtube(baixador, monkeypatch):
+    estado = FakeYouTube(baixador)
+    monkeypatch.setitem(sys.modules, 'yt_dlp', estado.modulo())
+    return estado
+
+
+@pytest.fixture
+def downloader(baixador, youtube, tmp_path, monkeypatch):
+    """``MusicDownloader`` com a pasta em ``tmp_path``, o yt_dlp falso e um FFmpeg que só copia."""
+    pytest.importorskip('eyed3')
+    pytest.importorskip('tqdm')
+
+    def ffmpeg(cmd, **_kwargs):
+        with open(cmd[cmd.index('-i') + 1], 'rb') as origem, open(cmd[-1], 'wb') as destino:
+            destino.write(origem.read())
+    monkeypatch.setattr(baixador.subprocess, 'run', ffmpeg)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    instancia = baixador.MusicDownloader(max_workers=2, workers_transcodificacao=1, requisicoes_por_host=0)
+    yield instancia
+    instancia.encerrar()
+
+
+@pytest.fixture
+def biblioteca(baixador, db, tmp_path):
+    diretorio = tmp_path / 'musicas'
+    diretorio.mkdir()
+    for i in range(2):
+        baixador.gerar_mp3_silencio(str(diretorio / f'faixa {i}.mp3'), 5)
+    return baixador.LibraryIndex(db, str(diretorio))
+
+
+@pytest.fixture
+def servidor(baixador, db, biblioteca, tmp_path, monkeypatch):
+    def codificar(cmd, **_kwargs):
+        # Codificador falso: a variante é o original cortado pela metade
+        origem = cmd[cmd.index('-i') + 1]
+        with open(origem, 'rb') as f:
+            dados = f.read()
+        with open(cmd[-1], 'wb') as f:
+            f.write(dados[:len(dados) // 2])
+    monkeypatch.setattr(baixador.subprocess, 'run', codificar)
+
+    cache = baixador.TranscodeCache(str(tmp_path / 'variantes'))
+    servidor = baixador.LibraryServer(biblioteca, baixador.HistoryStore(db), host='127.0.0.1', porta=0,
+                                      transcodificador=cache)
+    loop = asyncio.new_event_loop()
+    pronto = threading.Event()
+
+    def executar():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(servidor.iniciar())
+        pronto.set()
+        loop.run_forever()
+    thread = threading.Thread(target=executar, daemon=True)
+    thread.start()
+    assert pronto.wait(5)
+    yield servidor
+
+    async def parar():
+        servidor._servidor.close()
+        conexoes = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for tarefa in conexoes:
+            tarefa.cancel()
+        await asyncio.gather(*conexoes, return_exceptions=True)
+    asyncio.run_coroutine_threadsafe(parar(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+    cache.fechar()
+
+
+def pedir(servidor, caminho, cabecalhos=None, metodo='GET'):
+    conexao = http.client.HTTPConnection('127.0.0.1', servidor.porta, timeout=5)
+    conexao.request(metodo, caminho, headers=cabecalhos or {})
+    resposta = conexao.getresponse()
+    corpo = resposta.read()
+    conexao.close()
+    return resposta, corpo
+
+
+def original(biblioteca, nome='faixa 0.mp3'):
+    with open(f'{biblioteca.diretorio}/{nome}', 'rb') as f:
+        return f.read()
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def lidos(baixador, monkeypatch):
+    """Arquivos que o índice abriu para ler os metadados."""
+    arquivos = []
+
+    def ler(caminho):
+        arquivos.append(os.path.basename(caminho))
+        return {'titulo': os.path.basename(caminho), 'artista': 'Artista', 'duracao': 5.0, 'ganho': None}
+    monkeypatch.setattr(baixador, 'ler_metadados_mp3', ler)
+    return arquivos
+
+
+def nomes(caminhos):
+    return sorted(os.path.basename(c) for c in caminhos)
+
+
+def test_sincronizar_primeira_vez_e_sem_mudancas(biblioteca, lidos):
+    open(os.path.join(biblioteca.diretorio, 'capa.jpg'), 'wb').close()
+    novos, alterados, removidos = biblioteca.sincronizar()
+    assert nomes(novos) == ['faixa 0.mp3', 'faixa 1.mp3']
+    assert alterados == [] and removidos == []
+    assert len(biblioteca) == 2
+    assert biblioteca.obter(novos[0])['artista'] == 'Artista'
+
+    lidos.clear()
+    assert biblioteca.sincronizar() == ([], [], [])
+    assert lidos == []
+
+
+def test_sincronizar_novo_alterado_e_removido(baixador, biblioteca, lidos):
+    biblioteca.sincronizar()
+    lidos.clear()
+    diretorio = biblioteca.diretorio
+    baixador.gerar_mp3_silencio(os.path.join(diretorio, 'faixa 2.mp3'), 1)
+    alterado = os.path.join(diretorio, 'faixa 0.mp3')
+    info = os.stat(alterado)
+    os.utime(alterado, (info.st_atime, info.st_mtime + 10))
+    os.remove(os.path.join(diretorio, 'faixa 1.mp3'))
+
+    novos, alterados, removidos = biblioteca.sincronizar()
+
+    assert nomes(novos) == ['faixa 2.mp3']
+    assert nomes(alterados) == ['faixa 0.mp3']
+    assert nomes(removidos) == ['faixa 1.mp3']
+    # Só os arquivos novos ou alterados são abertos
+    assert sorted(lidos) == ['faixa 0.mp3', 'faixa 2.mp3']
+    assert [nomes([item['caminho']])[0] for item in biblioteca.listar()] == ['faixa 0.mp3', 'faixa 2.mp3']
+    assert biblioteca.obter(alterado)['mtime'] == info.st_mtime + 10
+
+
+def test_atualizar_arquivo_que_sumiu(biblioteca, lidos):
+    biblioteca.sincronizar()
+    caminho = os.path.join(biblioteca.diretorio, 'faixa 0.mp3')
+    os.remove(caminho)
+    assert biblioteca.atualizar_arquivo(caminho) is None
+    assert biblioteca.obter(caminho) is None
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+
+def test_cache_acerto_falha_e_ttl(baixador, db, monkeypatch):
+    agora = 1_000_000
+    monkeypatch.setattr(baixador.time, 'time', lambda: agora)
+    cache = baixador.SearchCache(db, ttl=60)
+    resultados = [{'title': f'r{i}', 'url': f'u{i}'} for i in range(5)]
+
+    assert cache.obter('Queen Bohemian', 5) is None
+    cache.guardar('Queen Bohemian', 5, resultados)
+    # A chave é normalizada, e uma entrada com 5 resultados atende pedidos menores
+    assert cache.obter('  queen   BOHEMIAN ', 3) == resultados[:3]
+    assert cache.obter('queen bohemian', 10) is None
+    assert (cache.acertos, cache.falhas) == (1, 2)
+
+    agora += 61
+    assert cache.obter('queen bohemian', 5) is None
+    cache.limpar_expirados()
+    assert len(cache) == 0
+
+
+def test_cache_descarta_o_menos_usado(baixador, db, monkeypatch):
+    agora = 1_000_000
+    monkeypatch.setattr(baixador.time, 'time', lambda: agora)
+    cache = baixador.SearchCache(db, max_itens=2)
+    cache.guardar('a', 1, [])
+    agora += 1
+    cache.guardar('b', 1, [])
+    agora += 1
+    cache.obter('a', 1)
+    agora += 1
+    cache.guardar('c', 1, [])
+    assert cache.obter('b', 1) is None
+    assert cache.obter('a', 1) == [] and cache.obter('c', 1) == []
+
+
+@pytest.fixture
+def busca(baixador, downloader):
+    """Troca o backend do ``downloader`` pelo dos benchmarks, contando as buscas em paralelo."""
+    local = baixador.backend_busca_local('http://127.0.0.1:1', faixas=10, latencia=0.05)
+    estado = {'chamadas': [], 'ativas': 0, 'maximo': 0}
+    lock = threading.Lock()
+
+    def backend(query, limite):
+        with lock:
+            estado['chamadas'].append(query)
+            estado['ativas'] += 1
+            estado['maximo'] = max(estado['maximo'], estado['ativas'])
+        try:
+            if query == 'falha':
+                raise RuntimeError('sem rede')
+            return local(query, limite)
+        finally:
+            with lock:
+                estado['ativas'] -= 1
+    downloader.backend_busca = backend
+    return estado
+
+
+def test_buscas_em_lote_concorrentes(downloader, busca):
+    queries = [f'musica {i}' for i in range(8)] + ['MUSICA  0', 'falha']
+
+    respostas = downloader.buscar_musicas(queries, limite=2, max_concorrencia=4)
+
+    # 'MUSICA  0' é a mesma busca que 'musica 0' e não vai à rede de novo
+    assert sorted(busca['chamadas']) == sorted(queries[:8] + ['falha'])
+    assert busca['maximo'] == 4
+    assert [m.title for m in respostas['musica 3']] == ['musica 3 (1)', 'musica 3 (2)']
+    assert [m.url for m in respostas['MUSICA  0']] == [m.url for m in respostas['musica 0']]
+    assert respostas['falha'] == []
+
+
+def test_busca_repetida_vem_do_cache(downloader, busca):
+    queries = [f'musica {i}' for i in range(4)]
+    primeira = downloader.buscar_musicas(queries, limite=3)
+    busca['chamadas'].clear()
+
+    segunda = downloader.buscar_musicas(queries, limite=2)
+
+    assert busca['chamadas'] == []
+    assert {q: [m.url for m in r] for q, r in segunda.items()} == \
+        {q: [m.url for m in r[:2]] for q, r in primeira.items()}
+    assert downloader.cache_busca.acertos >= 4
@@ -0,0 +1,103 @@
+import os
+import threading
+
+import pytest
+
+from conftest import video
+
+np = pytest.importorskip('numpy')
+
+
+def palavras(quantidade, semente=0):
+    return np.random.default_rng(semente).integers(0, 2**32, quantidade, dtype='<u4')
+
+
+def impressao(dados, esboco=b'\x01' * 16):
+    return {'dados': dados.tobytes(), 'esboco': esboco, 'duracao': 60.0}
+
+
+def test_comparar_impressoes_acha_o_deslocamento(baixador):
+    x = palavras(400)
+    assert baixador.comparar_impressoes(x.tobytes(), x.tobytes()) == (1.0, 0)
+    semelhanca, deslocamento = baixador.comparar_impressoes(x[25:].tobytes(), x.tobytes())
+    assert semelhanca == 1.0 and deslocamento == -25
+
+    semelhanca, _ = baixador.comparar_impressoes(x.tobytes(), palavras(400, semente=1).tobytes(),
+                                                 max_deslocamento=10)
+    assert 0.45 < semelhanca < 0.56
+    # Menos quadros em comum que ``minimo`` não contam
+    assert baixador.comparar_impressoes(x[:50].tobytes(), x[:50].tobytes()) == (0.0, 0)
+
+
+def test_procurar_so_nos_baldes_do_esboco(baixador, db):
+    indice = baixador.FingerprintIndex(db)
+    x = palavras(400)
+    indice.registrar('/m/a.mp3', 'a', impressao(x))
+    indice.registrar('/m/b.mp3', 'b', impressao(palavras(400, semente=1)))
+    # Mesmo áudio, mas o esboço não divide nenhuma faixa: nem é comparado
+    indice.registrar('/m/c.mp3', 'c', impressao(x, esboco=b'\x02' * 16))
+    assert len(indice) == 3
+
+    assert indice.procurar(impressao(x[10:])) == [('/m/a.mp3', 1.0)]
+    assert indice.procurar(impressao(x), ignorar='/m/a.mp3') == []
+
+    indice.registrar('/m/a.mp3', 'a', impressao(x, esboco=b'\x02' * 16))
+    assert sorted(c for c, _ in indice.procurar(impressao(x, esboco=b'\x02' * 16))) == ['/m/a.mp3', '/m/c.mp3']
+    indice.remover('/m/c.mp3')
+    assert '/m/c.mp3' not in indice
+
+
+@pytest.fixture
+def duplicata(baixador, downloader, monkeypatch):
+    """Faz todo download novo parecer ter o mesmo áudio de ``antigo.mp3``."""
+    antigo = os.path.join(downloader.diretorio_downloads, 'antigo.mp3')
+    baixador.gerar_mp3_silencio(antigo, 1)
+    downloader.biblioteca.atualizar_arquivo(antigo)
+    threads = []
+
+    def procurar(_video_id, _r):
+        threads.append(threading.current_thread().name)
+        return antigo
+    monkeypatch.setattr(downloader, '_procurar_duplicata', procurar)
+    return antigo, threads
+
+
+URL = f'https://www.youtube.com/watch?v={video(1)}'
+
+
+def test_politica_avisar_mantem_os_dois(downloader, duplicata, capsys):
+    antigo, threads = duplicata
+    downloader.duplicatas = 'avisar'
+    arquivo = downloader.baixar_musica(URL)
+    assert os.path.exists(arquivo) and os.path.exists(antigo)
+    assert 'parece ter o mesmo áudio' in capsys.readouterr().out
+    # A finalização não roda na thread de resultados do pool de processos
+    assert threads[0].startswith('finalizacao')
+
+
+def test_politica_pular_apaga_o_novo(downloader, duplicata):
+    antigo, _ = duplicata
+    downloader.duplicatas = 'pular'
+    assert downloader.baixar_musica(URL) == antigo
+    assert os.listdir(downloader.diretorio_downloads).count('Faixa vid00000001.mp3') == 0
+    assert downloader.indice.consultar(video(1)) == antigo
+    assert len(downloader.historico) == 0
+
+
+def test_politica_substituir_apaga_o_antigo(downloader, duplicata):
+    antigo, _ = duplicata
+    downloader.duplicatas = 'substituir'
+    arquivo = downloader.baixar_musica(URL)
+    assert os.path.exists(arquivo) and not os.path.exists(antigo)
+
+
+def test_politica_perguntar_deixa_para_o_fim(downloader, duplicata, monkeypatch):
+    antigo, _ = duplicata
+    downloader.duplicatas = 'perguntar'
+    arquivo = downloader.baixar_musica(URL)
+    assert os.path.exists(arquivo) and os.path.exists(antigo)
+
+    monkeypatch.setattr('builtins.input', lambda _pergunta: 'p')
+    downloader.resolver_duplicatas()
+    assert not os.path.exists(arquivo) and os.path.exists(antigo)
+    assert downloader.indice.consultar(video(1)) == antigo
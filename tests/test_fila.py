@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import video
+
+
+def test_prioridade_interativa_passa_na_frente(baixador):
+    fila = baixador.DownloadQueue(max_workers=1)
+    ordem = []
+    fila.pausar()
+    jobs = [fila.enviar(ordem.append, 'lote-1'),
+            fila.enviar(ordem.append, 'lote-2'),
+            fila.enviar(ordem.append, 'interativo', baixador.PRIORIDADE_INTERATIVA)]
+    fila.retomar()
+    for job in jobs:
+        job.future.result(timeout=5)
+    fila.encerrar()
+    assert ordem == ['interativo', 'lote-1', 'lote-2']
+
+
+def test_cancelar_e_pausar_job_na_fila(baixador):
+    fila = baixador.DownloadQueue(max_workers=1)
+    ordem = []
+    fila.pausar()
+    primeiro = fila.enviar(ordem.append, 'a')
+    cancelado = fila.enviar(ordem.append, 'b')
+    pausado = fila.enviar(ordem.append, 'c')
+    assert fila.cancelar(cancelado.id)
+    assert fila.pausar(pausado.id)
+    fila.retomar()
+    primeiro.future.result(timeout=5)
+    assert cancelado.future.cancelled()
+    assert not fila.cancelar(primeiro.id)  # já terminou
+    assert ordem == ['a']
+    assert pausado.estado == baixador.ESTADO_PAUSADO
+
+    assert fila.retomar(pausado.id)
+    pausado.future.result(timeout=5)
+    fila.encerrar()
+    assert ordem == ['a', 'c']
+    estados = {job['url']: job['estado'] for job in fila.estado()}
+    assert estados == {'a': baixador.ESTADO_CONCLUIDO, 'b': baixador.ESTADO_CANCELADO,
+                       'c': baixador.ESTADO_CONCLUIDO}
+
+
+def test_falha_da_tarefa_vai_para_o_future(baixador):
+    def falhar(url):
+        raise RuntimeError(url)
+    fila = baixador.DownloadQueue(max_workers=1)
+    job = fila.enviar(falhar, 'x')
+    with pytest.raises(RuntimeError):
+        job.future.result(timeout=5)
+    fila.encerrar()
+    assert job.estado == baixador.ESTADO_FALHOU
+
+
+def test_download_da_interface_passa_na_frente_da_playlist(baixador, downloader, youtube):
+    inicios = []
+    youtube.ao_baixar = inicios.append
+    youtube.atraso = 0.05
+    downloader.fila.pausar()
+    lote = [downloader.fila.enviar(downloader._baixar_musica_async, f'https://youtu.be/{video(i)}')
+            for i in range(3)]
+    interativo = downloader.enfileirar_download(f'https://youtu.be/{video(9)}', descricao='Pedido na tela')
+    esperando = [job['descricao'] for job in downloader.fila.estado()]
+    assert esperando[0] == 'Pedido na tela'
+
+    downloader.fila.retomar()
+    assert interativo.future.result(timeout=10).endswith('.mp3')
+    for job in lote:
+        job.future.result(timeout=10)
+    # Dois workers: o pedido da interface está entre os dois primeiros a começar
+    assert video(9) in inicios[:2]
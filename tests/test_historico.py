@@ -0,0 +1,108 @@
+import json
+from datetime import datetime
+
+import pytest
+
+ID = 'dQw4w9WgXcQ'
+
+
+def test_store_adiciona_e_lista_so_os_novos(baixador, db):
+    store = baixador.HistoryStore(db)
+    primeiro = store.adicionar('Faixa A', f'https://youtu.be/{ID}', '/m/a.mp3', ts=100)
+    store.adicionar('Outra', 'https://example.com/b', '/m/b.mp3', ts=200)
+
+    assert len(store) == 2
+    assert [item.title for item in store.listar()] == ['Faixa A', 'Outra']
+    assert [item.title for item in store.listar(desde_id=primeiro.id)] == ['Outra']
+    assert list(store.ids(desde_id=primeiro.id)) == [primeiro.id + 1]
+    assert store.listar()[0]['arquivo'] == '/m/a.mp3'
+
+
+def test_store_consultas(baixador, db):
+    store = baixador.HistoryStore(db)
+    store.adicionar('Faixa A', f'https://youtu.be/{ID}', '/m/a.mp3', ts=100)
+    store.adicionar('faixa B', 'https://example.com/b', '/m/b.mp3', ts=200)
+    store.adicionar('Outra', 'https://example.com/c', '/m/c.mp3', ts=300)
+
+    # Por URL compara o ID do vídeo, em qualquer forma da URL
+    assert [i.title for i in store.por_url(f'https://www.youtube.com/watch?v={ID}&list=PL1')] == ['Faixa A']
+    assert [i.title for i in store.por_url('https://example.com/b')] == ['faixa B']
+    assert [i.title for i in store.por_titulo('FAIXA')] == ['Faixa A', 'faixa B']
+    assert [i.title for i in store.entre_datas(datetime.fromtimestamp(150), datetime.fromtimestamp(300))] == \
+        ['faixa B', 'Outra']
+
+    assert store.trocar_arquivo('/m/a.mp3', '/m/b.mp3') == 1
+    assert [i.arquivo for i in store.listar()] == ['/m/b.mp3', '/m/b.mp3', '/m/c.mp3']
+
+
+def test_store_migra_o_json_uma_vez(baixador, db, tmp_path):
+    arquivo = tmp_path / 'historico_downloads.json'
+    arquivo.write_text(json.dumps([
+        {'title': 'Antiga', 'url': f'https://youtu.be/{ID}', 'data': '01/02/2023 10:00:00', 'arquivo': '/m/a.mp3'},
+    ]), encoding='utf-8')
+
+    store = baixador.HistoryStore(db, str(arquivo))
+    assert [(i.title, i.data) for i in store.listar()] == [('Antiga', '01/02/2023 10:00:00')]
+    assert not arquivo.exists() and (tmp_path / 'historico_downloads.json.migrado').exists()
+
+    baixador.HistoryStore(db, str(arquivo))
+    assert len(store) == 1
+
+
+@pytest.fixture
+def paginas(baixador, db, monkeypatch):
+    """``HistoryPages`` com páginas de 4 itens, no máximo 2 em cache, contando as leituras do banco."""
+    monkeypatch.setattr(baixador.HistoryPages, 'TAMANHO_PAGINA', 4)
+    monkeypatch.setattr(baixador.HistoryPages, 'MAX_PAGINAS', 2)
+    store = baixador.HistoryStore(db)
+    for i in range(6):
+        store.adicionar(f'Faixa {i}', f'https://example.com/{i}', f'/m/{i}.mp3')
+    leituras = []
+    intervalo = store.intervalo
+    monkeypatch.setattr(store, 'intervalo', lambda a, b: (leituras.append((a, b)), intervalo(a, b))[1])
+    return baixador.HistoryPages(store), leituras
+
+
+def test_paginas_atualizar_completa_a_ultima_pagina(paginas):
+    historico, leituras = paginas
+    assert historico[5].title == 'Faixa 5'
+    assert len(leituras) == 1
+    for i in range(6, 9):
+        historico.store.adicionar(f'Faixa {i}', f'https://example.com/{i}', f'/m/{i}.mp3')
+
+    assert [item.title for item in historico.atualizar()] == ['Faixa 6', 'Faixa 7', 'Faixa 8']
+    assert len(historico) == 9
+    # A página 1 em cache ganhou os itens 6 e 7 sem voltar ao banco; o 8 abre a página 2
+    assert [item.title for item in historico[4:8]] == [f'Faixa {i}' for i in range(4, 8)]
+    assert len(leituras) == 1
+    assert historico[-1].title == 'Faixa 8'
+    assert len(leituras) == 2
+
+
+def test_paginas_descarta_a_menos_usada(paginas):
+    historico, leituras = paginas
+    historico.store.adicionar('Faixa 6', 'https://example.com/6', '/m/6.mp3')
+    historico.store.adicionar('Faixa 7', 'https://example.com/7', '/m/7.mp3')
+    historico.store.adicionar('Faixa 8', 'https://example.com/8', '/m/8.mp3')
+    historico.atualizar()
+
+    for indice in (0, 4, 0, 8):
+        historico[indice]
+    assert len(leituras) == 3
+    historico[0]
+    assert len(leituras) == 3
+    historico[4]
+    assert len(leituras) == 4
+    assert [item.title for item in historico] == [f'Faixa {i}' for i in range(9)]
+
+
+def test_paginas_trocar_arquivo_invalida_o_cache(paginas):
+    historico, leituras = paginas
+    assert historico[0].arquivo == '/m/0.mp3'
+    assert historico.trocar_arquivo('/m/0.mp3', '/m/5.mp3') == 1
+    assert historico[0].arquivo == '/m/5.mp3'
+    assert len(leituras) == 2
+    # Nada mudou: o cache continua valendo
+    assert historico.trocar_arquivo('/m/nenhum.mp3', '/m/5.mp3') == 0
+    historico[1]
+    assert len(leituras) == 2
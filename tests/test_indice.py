@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from conftest import video
+
+ID = 'dQw4w9WgXcQ'
+
+
+@pytest.mark.parametrize('url', [
+    ID,
+    f'https://www.youtube.com/watch?v={ID}',
+    f'https://m.youtube.com/watch?v={ID}&t=42s',
+    f'youtube.com/watch?v={ID}',
+    f'https://youtu.be/{ID}?si=abc',
+    f'https://www.youtube.com/shorts/{ID}',
+    f'https://www.youtube.com/embed/{ID}',
+    f'https://www.youtube.com/watch?v={ID}&list=PLteste&index=3',
+    f'https://music.youtube.com/watch?v={ID}&list=RDAMVM{ID}',
+    f'https://www.youtube-nocookie.com/embed/{ID}',
+])
+def test_extrair_video_id(baixador, url):
+    assert baixador.extrair_video_id(url) == ID
+    assert baixador.normalizar_url(url) == f'https://www.youtube.com/watch?v={ID}'
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/playlist?list=PLteste',
+    'https://www.youtube.com/watch?v=curto',
+    f'https://example.com/watch?v={ID}',
+    f'https://youtu.be/{ID}x',
+    'musica qualquer',
+])
+def test_extrair_video_id_recusa(baixador, url):
+    assert baixador.extrair_video_id(url) is None
+    assert baixador.normalizar_url(url) == url
+
+
+def test_consultar_confere_o_arquivo(baixador, db, tmp_path):
+    indice = baixador.DownloadIndex(db)
+    arquivo = tmp_path / 'a.mp3'
+    arquivo.write_bytes(b'abc')
+    indice.registrar(ID, 'url', str(arquivo), 3, baixador.calcular_checksum(str(arquivo)))
+    assert indice.consultar(ID) == str(arquivo)
+
+    # Mesmo tamanho, conteúdo diferente: só a reverificação percebe
+    arquivo.write_bytes(b'xyz')
+    assert indice.consultar(ID) == str(arquivo)
+    assert indice.consultar(ID, reverificar=True) is None
+
+    arquivo.write_bytes(b'abcd')
+    assert indice.consultar(ID) is None
+    arquivo.unlink()
+    assert indice.consultar(ID) is None
+    assert ID in indice
+
+
+def test_download_pula_o_que_esta_no_indice(downloader, youtube):
+    arquivo = downloader.baixar_musica(f'https://youtu.be/{video(1)}')
+    assert downloader.baixar_musica(f'https://www.youtube.com/watch?v={video(1)}&list=PLteste') == arquivo
+    assert youtube.baixados == [video(1)]
+
+    # Entrada velha: o arquivo sumiu, então baixa de novo
+    os.remove(arquivo)
+    assert downloader.baixar_musica(f'https://www.youtube.com/shorts/{video(1)}') == arquivo
+    assert os.path.exists(arquivo)
+    assert youtube.baixados == [video(1), video(1)]
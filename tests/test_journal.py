@@ -0,0 +1,86 @@
+import hashlib
+import os
+import random
+
+import pytest
+
+
+def test_retoma_so_os_jobs_pendentes(baixador, db):
+    journal = baixador.JobJournal(db)
+    execucao = journal.nova_execucao()
+    concluido = journal.enfileirar(execucao, 'https://youtu.be/a')
+    baixando = journal.enfileirar(execucao, 'https://youtu.be/b')
+    falhou = journal.enfileirar(execucao, 'https://youtu.be/c')
+    journal.atualizar(concluido, baixador.ESTADO_CONCLUIDO, '/m/a.mp3')
+    journal.atualizar(baixando, baixador.ESTADO_BAIXANDO)
+    journal.atualizar(falhou, baixador.ESTADO_FALHOU, erro='indisponível')
+
+    assert journal.ultima_incompleta()['id'] == execucao
+    assert [job['url'] for job in journal.pendentes(execucao)] == ['https://youtu.be/b']
+
+
+def test_execucao_so_com_falhas_nao_fica_pendente(baixador, db):
+    journal = baixador.JobJournal(db)
+    execucao = journal.nova_execucao()
+    job = journal.enfileirar(execucao, 'https://youtu.be/a')
+    journal.atualizar(job, baixador.ESTADO_FALHOU, erro='indisponível')
+
+    assert journal.ultima_incompleta() is None
+    assert db.consultar("SELECT concluida FROM execucoes WHERE id = ?", (execucao,))[0][0] == 1
+
+
+def test_playlist_interrompida_continua_incompleta(baixador, db):
+    journal = baixador.JobJournal(db)
+    execucao = journal.nova_execucao('https://www.youtube.com/playlist?list=PL1')
+    assert journal.ultima_incompleta()['origem'] == 'https://www.youtube.com/playlist?list=PL1'
+    journal.concluir_execucao(execucao)
+    assert journal.ultima_incompleta() is None
+
+
+def test_reenfileirar_reaproveita_o_job(baixador, db):
+    journal = baixador.JobJournal(db)
+    execucao = journal.nova_execucao()
+    job = journal.enfileirar(execucao, 'https://youtu.be/a')
+    journal.atualizar(job, baixador.ESTADO_CONVERTENDO)
+    assert journal.enfileirar(execucao, 'https://youtu.be/a') == job
+    assert journal.pendentes(execucao)[0]['estado'] == baixador.ESTADO_NA_FILA
+
+
+def test_download_retoma_do_parcial_apos_queda(baixador, tmp_path, monkeypatch):
+    pytest.importorskip('yt_dlp')
+    pytest.importorskip('eyed3')
+    pytest.importorskip('tqdm')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    origem = tmp_path / 'origem'
+    origem.mkdir()
+    dados = os.urandom(3 * 2**20)
+    (origem / 'faixa.mp3').write_bytes(dados)
+
+    # Corta a primeira resposta com Range; as outras vão inteiras
+    intervalos = []
+    ler_range = baixador._ler_range
+    monkeypatch.setattr(baixador, '_ler_range', lambda cabecalho, tamanho: (
+        intervalos.append(cabecalho), ler_range(cabecalho, tamanho))[1])
+
+    class Roteiro(random.Random):
+        def random(self):
+            return 0.0 if len(intervalos) == 1 else 1.0
+    monkeypatch.setattr(baixador.random, 'Random', Roteiro)
+
+    downloader = baixador.MusicDownloader(max_workers=1, requisicoes_por_host=0)
+    progresso = []
+    monkeypatch.setattr(downloader, '_mostrar_progresso', lambda d: progresso.append(d.get('downloaded_bytes')))
+    parcial = 2**20
+    with open(os.path.join(downloader.diretorio_brutos, 'faixa.mp3.part'), 'wb') as f:
+        f.write(dados[:parcial])
+    try:
+        with baixador.servidor_arquivos_local(str(origem), queda=0.5) as base:
+            _info, bruto = downloader._buscar_audio(f'{base}/faixa.mp3')
+    finally:
+        downloader.encerrar()
+
+    assert intervalos[0].startswith(f'bytes={parcial}-')
+    assert len(intervalos) >= 2 and intervalos[1].startswith(f'bytes={parcial + 2**20}-')
+    assert all(n >= parcial for n in progresso if n is not None)
+    with open(bruto, 'rb') as f:
+        assert hashlib.sha256(f.read()).digest() == hashlib.sha256(dados).digest()
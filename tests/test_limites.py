@@ -0,0 +1,103 @@
+import urllib.error
+
+import pytest
+
+
+class ErroDownload(Exception):
+    """Como o ``DownloadError`` do yt_dlp: guarda o erro original em ``exc_info``."""
+
+    def __init__(self, mensagem, original=None):
+        super().__init__(mensagem)
+        self.exc_info = (type(original), original, None) if original else None
+
+
+def http_error(codigo):
+    return urllib.error.HTTPError('https://youtu.be/x', codigo, 'erro', {}, None)
+
+
+@pytest.mark.parametrize('erro', [
+    http_error(429),
+    ErroDownload('ERROR: unable to download video data: HTTP Error 429: Too Many Requests'),
+    ErroDownload('falhou', http_error(429)),
+])
+def test_reconhece_limitacao(baixador, erro):
+    assert baixador._eh_limitacao(erro)
+
+
+@pytest.mark.parametrize('erro', [
+    http_error(404),
+    ErroDownload('falhou', http_error(403)),
+    Exception('Video abc429def is unavailable'),
+    Exception('Baixados 4290 bytes de 8000'),
+])
+def test_nao_confunde_outros_erros(baixador, erro):
+    assert not baixador._eh_limitacao(erro)
+
+
+@pytest.fixture
+def sem_espera(baixador, monkeypatch):
+    esperas = []
+    monkeypatch.setattr(baixador.time, 'sleep', esperas.append)
+    monkeypatch.setattr(baixador.random, 'uniform', lambda a, b: b)
+    return esperas
+
+
+def test_backoff_repete_quando_limitado(baixador, sem_espera):
+    tentativas = []
+
+    def funcao(valor):
+        tentativas.append(valor)
+        if len(tentativas) < 4:
+            raise http_error(429)
+        return valor * 2
+
+    assert baixador.com_backoff(funcao, 21, base=1.0, maximo=3.0) == 42
+    assert len(tentativas) == 4
+    # Teto do jitter: base * 2**tentativa, limitado a ``maximo``
+    assert sem_espera == [1.0, 2.0, 3.0]
+
+
+def test_backoff_desiste_depois_das_tentativas(baixador, sem_espera):
+    def funcao():
+        raise http_error(429)
+
+    with pytest.raises(urllib.error.HTTPError):
+        baixador.com_backoff(funcao, tentativas=3)
+    assert len(sem_espera) == 2
+
+
+def test_backoff_propaga_outros_erros_na_hora(baixador, sem_espera):
+    def funcao():
+        raise ValueError('Video 429 indisponível')
+
+    with pytest.raises(ValueError):
+        baixador.com_backoff(funcao)
+    assert sem_espera == []
+
+
+def test_limite_por_host_espaca_as_requisicoes(baixador, sem_espera, monkeypatch):
+    relogio = iter([0.0, 0.0, 0.0, 0.0])
+    monkeypatch.setattr(baixador.time, 'monotonic', lambda: next(relogio))
+    limite = baixador.HostRateLimiter(requisicoes_por_segundo=4)
+    limite.aguardar('https://www.youtube.com/watch?v=a')
+    limite.aguardar('https://www.youtube.com/watch?v=b')
+    limite.aguardar('https://i.ytimg.com/vi/a/hq.jpg')  # outro host: não espera
+    limite.aguardar('www.youtube.com/watch?v=c')
+    assert sem_espera == [0.25, 0.5]
+
+
+def test_token_bucket_limita_a_banda(baixador):
+    balde = baixador.TokenBucket(taxa=200_000, capacidade=20_000)
+    inicio = baixador.time.monotonic()
+    for _ in range(10):
+        balde.consumir(20_000)
+    # 200 kB com 20 kB de crédito inicial a 200 kB/s: pelo menos 0,9 s
+    assert baixador.time.monotonic() - inicio >= 0.85
+    assert balde.total_bytes == 200_000
+
+
+def test_token_bucket_sem_limite_so_conta(baixador, sem_espera):
+    balde = baixador.TokenBucket()
+    balde.consumir(10 * 2**20)
+    assert balde.total_bytes == 10 * 2**20
+    assert sem_espera == []
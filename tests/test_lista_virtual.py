@@ -0,0 +1,142 @@
+import types
+
+import pytest
+
+
+class ListboxFalsa:
+    """O pouco do ``tk.Listbox`` que a ``VirtualListView`` usa, guardando as linhas numa lista."""
+
+    def __init__(self):
+        self.linhas = []
+        self.selecao = ()
+        self.chamadas = 0
+
+    def insert(self, indice, texto):
+        self.chamadas += 1
+        self.linhas.insert(len(self.linhas) if indice == 'end' else indice, texto)
+
+    def delete(self, inicio, fim=None):
+        self.chamadas += 1
+        del self.linhas[inicio:len(self.linhas) if fim == 'end' else inicio + 1]
+
+    def selection_clear(self, *_args):
+        self.selecao = ()
+
+    def selection_set(self, linha):
+        self.selecao = (linha,)
+
+    def curselection(self):
+        return self.selecao
+
+
+@pytest.fixture
+def lista(baixador, monkeypatch):
+    """``VirtualListView`` de 5 linhas sem Tk: só o modelo de dados e uma listbox falsa."""
+    monkeypatch.setattr(baixador, 'tk', types.SimpleNamespace(END='end'))
+    vista = object.__new__(baixador.VirtualListView)
+    vista.listbox = ListboxFalsa()
+    vista.scroll = types.SimpleNamespace(set=lambda *posicao: setattr(vista, 'barra', posicao))
+    vista.ao_ativar = None
+    vista.linhas = 5
+    vista.textos, vista.buscas = [], []
+    vista.visiveis = range(0)
+    vista.filtro = ""
+    vista.topo = 0
+    vista.selecao = None
+    vista._desenhadas = []
+    vista.definir([(f'Faixa {i}', f'{"rock" if i % 3 == 0 else "pop"} faixa {i}') for i in range(30)])
+    return vista
+
+
+def test_so_desenha_as_linhas_visiveis(lista):
+    assert len(lista) == 30
+    assert lista.listbox.linhas == [f'Faixa {i}' for i in range(5)]
+    assert lista.barra == (0.0, 5 / 30)
+
+    lista.selecionar(17)
+    # Rolou só o suficiente para o item aparecer, na última linha
+    assert lista.topo == 13
+    assert lista.listbox.linhas == [f'Faixa {i}' for i in range(13, 18)]
+    assert lista.listbox.selecao == (4,)
+
+    lista.ver(15)
+    assert lista.topo == 13
+    lista.ver(2)
+    assert lista.topo == 2
+
+
+def test_filtro_mantem_os_indices_dos_itens(lista):
+    lista.selecionar(12)
+    lista.filtrar('  ROCK ')
+    assert list(lista.visiveis) == [0, 3, 6, 9, 12, 15, 18, 21, 24, 27]
+    # O item selecionado continua à vista e selecionado pelo índice original
+    assert lista.selecionado() == 12
+    assert 'Faixa 12' in lista.listbox.linhas
+    assert lista.listbox.linhas[lista.listbox.selecao[0]] == 'Faixa 12'
+
+    # Digitar mais só procura entre os que já passavam
+    buscas = lista.buscas
+    lidos = []
+    lista.buscas = type('Contador', (), {'__getitem__': lambda _s, i: lidos.append(i) or buscas[i]})()
+    lista.filtrar('rock faixa 1')
+    assert lidos == [0, 3, 6, 9, 12, 15, 18, 21, 24, 27]
+    lista.buscas = buscas
+    assert list(lista.visiveis) == [12, 15, 18]
+
+    lista.filtrar('')
+    assert lista.visiveis == range(30)
+
+
+def test_ver_ignora_item_fora_do_filtro(lista):
+    lista.filtrar('rock')
+    lista.topo = 1
+    lista.ver(4)  # não passa no filtro
+    assert lista.topo == 1
+    lista.ver(27)  # 10º visível: rola até a última tela
+    assert lista.topo == 5
+    lista.ver(0)
+    assert lista.topo == 0
+
+
+def test_adicionar_e_mover(lista):
+    lista.filtrar('rock')
+    lista.adicionar('Faixa 30', 'faixa 30 rock')
+    lista.adicionar('Faixa 31', 'faixa 31 pop')
+    assert list(lista.visiveis)[-1] == 30 and len(lista) == 32
+
+    lista.selecionar(27)
+    lista._mover(1)
+    assert lista.selecionado() == 30
+    lista._mover(-3)
+    assert lista.selecionado() == 21
+    lista._mover(100)
+    assert lista.selecionado() == 30
+
+
+def test_atualizar_so_reescreve_o_que_mudou(lista):
+    lista.listbox.chamadas = 0
+    lista._rolar('scroll', 1, 'units')
+    # Rolar uma linha muda o texto das 5 linhas, mas nada fora da tela é tocado
+    assert lista.listbox.linhas == [f'Faixa {i}' for i in range(1, 6)]
+    assert lista.listbox.chamadas == 10
+    lista.listbox.chamadas = 0
+    lista._desenhar()
+    assert lista.listbox.chamadas == 0
+
+
+def test_definir_fonte_preguicosa(lista):
+    pedidos = []
+
+    def texto(i):
+        pedidos.append(i)
+        return f'Item {i}'
+    lista.definir_fonte(100_000, texto, lambda i: f'item {i}')
+    assert lista.listbox.linhas == [f'Item {i}' for i in range(5)]
+    assert pedidos == [0, 1, 2, 3, 4]
+
+    lista.crescer(100_001)
+    assert len(lista) == 100_001
+    with pytest.raises(TypeError):
+        lista.adicionar('Outro', 'outro')
+    lista._rolar('moveto', 1.0)
+    assert lista.listbox.linhas[-1] == 'Item 100000'
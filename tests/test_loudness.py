@@ -0,0 +1,87 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+TAXA = 48000
+
+
+@pytest.fixture
+def sinal(baixador, monkeypatch):
+    """Faz ``medir_loudness`` ler o sinal mono dado, em vez de decodificar um arquivo."""
+    atual = {}
+
+    def ler_pcm(_arquivo, _taxa, canais, quadros_por_leitura, _segundos=None):
+        x = atual['x'].astype('<f4')
+        for inicio in range(0, len(x), quadros_por_leitura * canais):
+            yield x[inicio:inicio + quadros_por_leitura * canais]
+    monkeypatch.setattr(baixador, '_canais_audio', lambda _arquivo: 1)
+    monkeypatch.setattr(baixador, '_ler_pcm', ler_pcm)
+
+    def medir(x):
+        atual['x'] = x
+        return baixador.medir_loudness('sinal.mp3')
+    return medir
+
+
+def ganho_k(baixador, frequencia):
+    """|H|² da ponderação K numa frequência, direto dos coeficientes."""
+    z = np.exp(-2j * np.pi * frequencia / TAXA)
+    ganho = 1.0
+    for b, a in baixador._FILTRO_K:
+        ganho *= abs((b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)) ** 2
+    return ganho
+
+
+def loudness_iir(baixador, x):
+    """Referência da BS.1770 com o filtro IIR contínuo e blocos de 400 ms com passo de 100 ms."""
+    y = x.astype(float)
+    for b, a in baixador._FILTRO_K:
+        saida = np.zeros_like(y)
+        x1 = x2 = y1 = y2 = 0.0
+        for i, amostra in enumerate(y.tolist()):
+            atual = b[0] * amostra + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            x2, x1, y2, y1 = x1, amostra, y1, atual
+            saida[i] = atual
+        y = saida
+    passo = TAXA // 10
+    quadrado = np.cumsum(np.concatenate([[0.0], y ** 2]))
+    inicios = np.arange(0, len(y) - 4 * passo + 1, passo)
+    blocos = (quadrado[inicios + 4 * passo] - quadrado[inicios]) / (4 * passo)
+    nivel = -0.691 + 10 * np.log10(np.maximum(blocos, 1e-20))
+    acima = nivel > -70.0
+    relativo = -0.691 + 10 * np.log10(blocos[acima].mean()) - 10.0
+    return -0.691 + 10 * np.log10(blocos[acima & (nivel > relativo)].mean())
+
+
+def seno(baixador, lufs, segundos):
+    # Amplitude que dá ``lufs`` num canal: -0,691 + 10 log10(A² / 2 * |H(1 kHz)|²)
+    amplitude = np.sqrt(2 * 10 ** ((lufs + 0.691) / 10) / ganho_k(baixador, 1000))
+    return amplitude * np.sin(2 * np.pi * 1000 * np.arange(segundos * TAXA) / TAXA)
+
+
+def test_seno_de_1khz_a_menos_23_lufs(baixador, sinal):
+    x = seno(baixador, -23.0, 5)
+    medida = sinal(x)
+    assert medida['loudness'] == pytest.approx(-23.0, abs=0.001)
+    assert medida['ganho'] == pytest.approx(baixador.LOUDNESS_REFERENCIA + 23.0, abs=0.001)
+    assert medida['pico'] == pytest.approx(np.abs(x.astype('<f4')).max())
+
+
+def test_gate_ignora_o_silencio(baixador, sinal):
+    silencio = np.zeros(3 * TAXA)
+    x = np.concatenate([silencio, seno(baixador, -23.0, 5), silencio])
+    medida = sinal(x)
+    # Sem o gate, os 6 s de silêncio puxariam a média para -23 + 10 log10(5/11) ≈ -26,4 LUFS;
+    # só os blocos que pegam parte do seno nas bordas baixam um pouco o resultado
+    assert -23.3 < medida['loudness'] < -23.0
+    assert abs(medida['loudness'] - loudness_iir(baixador, x.astype('<f4'))) < 0.001
+    # Só silêncio: nada a corrigir
+    assert sinal(silencio) == {'loudness': None, 'ganho': 0.0, 'pico': 0.0}
+
+
+def test_ruido_com_trecho_baixo_igual_ao_filtro_iir(baixador, sinal):
+    ruido = np.random.default_rng(7).standard_normal(6 * TAXA) * 0.1
+    # Um trecho 30 dB abaixo cai no gate relativo
+    ruido[2 * TAXA:3 * TAXA] *= 10 ** (-30 / 20)
+    medida = sinal(ruido)
+    assert abs(medida['loudness'] - loudness_iir(baixador, ruido.astype('<f4'))) < 0.001
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+
+def test_histograma_percentis_dentro_do_erro_dos_baldes(baixador):
+    histograma = baixador.Histogram()
+    valores = [i / 1000 for i in range(1, 1001)]  # 1 ms a 1 s
+    for valor in valores:
+        histograma.observar(valor)
+
+    erro = 2 ** (1 / baixador.Histogram.DIVISOES_POR_OITAVA)  # ~19%
+    for p in (50, 95, 99):
+        exato = valores[int(p / 100 * len(valores)) - 1]
+        # O percentil é o limite superior do balde: nunca abaixo do exato, no máximo um balde acima
+        assert exato <= histograma.percentil(p) <= exato * erro
+    resumo = histograma.snapshot()
+    assert resumo['contagem'] == 1000
+    assert resumo['media'] == pytest.approx(0.5005)
+    assert (resumo['min'], resumo['max']) == (0.001, 1.0)
+    assert histograma.percentil(100) == 1.0
+
+
+def test_histograma_vazio_e_zeros(baixador):
+    histograma = baixador.Histogram()
+    assert histograma.snapshot()['p50'] == 0.0
+    histograma.observar(0.0)
+    histograma.observar(0.0)
+    histograma.observar(8.0)
+    assert histograma.percentil(50) == 0.0
+    assert histograma.percentil(99) == 8.0
+
+
+def test_coletor_agrega_spans_e_contadores(baixador):
+    metricas = baixador.MetricsCollector()
+    with metricas.span('busca', query='x') as atributos:
+        atributos['cache'] = True
+    with pytest.raises(ValueError):
+        with metricas.span('busca'):
+            raise ValueError('falhou')
+    metricas.incrementar('bytes_baixados', 100)
+    metricas.incrementar('bytes_baixados', 50)
+    metricas.observar('vazao', 2.0)
+
+    resumo = metricas.resumo()
+    assert resumo['histogramas']['busca']['contagem'] == 2
+    assert resumo['falhas'] == {'busca': 1}
+    assert resumo['contadores'] == {'bytes_baixados': 150}
+    assert resumo['histogramas']['vazao']['max'] == 2.0
+
+
+def test_exportador_jsonl(baixador, tmp_path):
+    caminho = tmp_path / 'metricas.jsonl'
+    metricas = baixador.MetricsCollector([baixador.JsonLinesExporter(str(caminho))])
+    metricas.registrar_span('transcodificacao', 1.25, video_id='abc')
+    metricas.registrar_span('tags', 0.1, False, video_id='ação')
+    metricas.incrementar('bytes_mp3', 10)
+    metricas.fechar()
+
+    linhas = caminho.read_text(encoding='utf-8').splitlines()
+    eventos = [json.loads(linha) for linha in linhas]
+    assert [e['tipo'] for e in eventos] == ['span', 'span', 'resumo']
+    primeiro = eventos[0]
+    assert set(primeiro) == {'tipo', 'nome', 'duracao', 'sucesso', 'ts', 'video_id'}
+    assert (primeiro['nome'], primeiro['duracao'], primeiro['sucesso']) == ('transcodificacao', 1.25, True)
+    # Sem escapes: os textos ficam legíveis no arquivo
+    assert '"video_id": "ação"' in linhas[1]
+    assert eventos[1]['sucesso'] is False
+    assert eventos[2]['contadores'] == {'bytes_mp3': 10}
+    assert eventos[2]['histogramas']['tags']['contagem'] == 1
+    assert eventos[2]['falhas'] == {'tags': 1}
+    # Depois de fechar, nada mais é exportado
+    metricas.registrar_span('busca', 0.1)
+    assert len(caminho.read_text(encoding='utf-8').splitlines()) == 3
@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+# Frame MPEG-1 Layer III, 128 kbps, 44,1 kHz, estéreo: 417 bytes e 1152 amostras
+FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+def tag_id3(tamanho):
+    sincsafe = bytes((tamanho >> s) & 0x7F for s in (21, 14, 7, 0))
+    return b'ID3\x04\x00\x00' + sincsafe + b'\x00' * tamanho
+
+
+def test_duracao_pelos_frames(baixador, tmp_path):
+    caminho = str(tmp_path / 'silencio.mp3')
+    baixador.gerar_mp3_silencio(caminho, 10)
+    frames = int(10 * 44100 / 1152)
+    assert baixador.duracao_mp3(caminho) == pytest.approx(frames * 1152 / 44100)
+
+
+def test_pula_tag_id3_e_lixo(baixador, tmp_path):
+    caminho = tmp_path / 'com_tag.mp3'
+    # A tag tem um 0xFF perdido, que não pode ser confundido com um frame
+    caminho.write_bytes(tag_id3(64)[:-4] + b'\xff\xfb\x00\x00' + FRAME * 100 + b'TAG' + b'\x00' * 125)
+    assert baixador.duracao_mp3(str(caminho)) == pytest.approx(100 * 1152 / 44100)
+
+
+def test_usa_cabecalho_xing(baixador, tmp_path):
+    # Primeiro frame com o cabeçalho Xing (depois de 32 bytes de side info) e 5000 frames declarados
+    xing = FRAME[:4] + b'\x00' * 32 + b'Xing' + struct.pack('>II', 1, 5000)
+    primeiro = xing + b'\x00' * (len(FRAME) - len(xing))
+    caminho = tmp_path / 'vbr.mp3'
+    caminho.write_bytes(primeiro + FRAME * 10)
+    assert baixador.duracao_mp3(str(caminho)) == pytest.approx(5000 * 1152 / 44100)
+
+
+def test_arquivo_vazio_ou_sem_frames(baixador, tmp_path):
+    vazio = tmp_path / 'vazio.mp3'
+    vazio.write_bytes(b'')
+    lixo = tmp_path / 'lixo.mp3'
+    lixo.write_bytes(b'nao e um mp3' * 100)
+    assert baixador.duracao_mp3(str(vazio)) == 0.0
+    assert baixador.duracao_mp3(str(lixo)) == 0.0
+
+
+def test_cache_de_duracao_confere_tamanho(baixador, tmp_path, monkeypatch):
+    caminho = str(tmp_path / 'faixa.mp3')
+    baixador.gerar_mp3_silencio(caminho, 2)
+    servico = baixador.DurationService(max_itens=1)
+    lidos = []
+    original = baixador.duracao_mp3
+    monkeypatch.setattr(baixador, 'duracao_mp3', lambda arquivo: lidos.append(arquivo) or original(arquivo))
+
+    primeira = servico.duracao(caminho)
+    assert servico.duracao(caminho) == primeira
+    assert len(lidos) == 1
+
+    # Arquivo maior: a entrada antiga não vale mais
+    with open(caminho, 'ab') as f:
+        f.write(FRAME * 50)
+    assert servico.duracao(caminho) == pytest.approx(primeira + 50 * 1152 / 44100)
+    assert len(lidos) == 2
+
+    outro = str(tmp_path / 'outro.mp3')
+    baixador.gerar_mp3_silencio(outro, 1)
+    servico.duracao(outro)
+    assert list(servico._cache) == [outro]
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('caminhos', [
+    ['/m/a/x.mp3', '/m/b/x.mp3', '/m/a/y.mp3', '/m/a/x.mp3'],
+    ['/raiz.mp3', '/m/a.mp3'],
+    ['relativo.mp3', 'm/a.mp3'],
+    ['/m//dupla/a.mp3', '/m/dupla/b.mp3'],
+])
+def test_carga_em_lote_igual_a_append(baixador, caminhos):
+    lote = baixador.PathList(caminhos)
+    um_a_um = baixador.PathList()
+    for caminho in caminhos:
+        um_a_um.append(caminho)
+
+    assert list(lote) == list(um_a_um)
+    assert lote.nomes == [os.path.basename(c) for c in caminhos]
+    for caminho in caminhos:
+        assert lote.indice(caminho) == um_a_um.indice(caminho)
+        assert caminho in lote
+
+
+def test_nomes_repetidos_em_pastas_diferentes(baixador):
+    lista = baixador.PathList(['/m/a/x.mp3', '/m/b/x.mp3'])
+    assert lista.indice('/m/a/x.mp3') == 0
+    assert lista.indice('/m/b/x.mp3') == 1
+    assert lista.indice('/m/c/x.mp3') is None
+    assert lista.append('/m/c/x.mp3') == 2
+    assert lista[2] == '/m/c/x.mp3' and len(lista) == 3
@@ -0,0 +1,41 @@
+import sys
+import threading
+import types
+
+
+class YoutubeDL:
+    def __init__(self, opcoes):
+        self.opcoes = opcoes
+        self.fechado = False
+
+    def close(self):
+        self.fechado = True
+
+    def __exit__(self, *_erro):
+        raise AssertionError("o pool deve chamar close()")
+
+
+def test_pool_reaproveita_e_fecha_as_instancias(baixador, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'yt_dlp', types.SimpleNamespace(YoutubeDL=YoutubeDL))
+    pool = baixador.YoutubeDLPool({'quiet': True}, tamanho=2)
+
+    with pool.obter() as primeira:
+        with pool.obter() as segunda:
+            assert primeira is not segunda
+    with pool.obter() as de_novo:
+        assert de_novo in (primeira, segunda)
+    assert (pool.criadas, pool.usos) == (2, 3)
+
+    # Com todas em uso, quem pede espera uma voltar em vez de criar outra
+    obtida = []
+    with pool.obter(), pool.obter():
+        espera = threading.Thread(target=lambda: obtida.append(pool._pegar()))
+        espera.start()
+        espera.join(0.1)
+        assert espera.is_alive()
+    espera.join(5)
+    assert obtida[0] in (primeira, segunda) and pool.criadas == 2
+
+    pool.fechar()
+    assert primeira.fechado and segunda.fechado
+    assert pool.criadas == 0
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def reparo(baixador, db, tmp_path, monkeypatch):
+    """``LibraryRepair`` sobre 6 MP3 no histórico, com o pool trocado por um laço que pode ser interrompido."""
+    diretorio = tmp_path / 'musicas'
+    diretorio.mkdir()
+    historico = baixador.HistoryStore(db)
+    for i in range(6):
+        caminho = str(diretorio / f'faixa {i}.mp3')
+        baixador.gerar_mp3_silencio(caminho, 1)
+        historico.adicionar(f'faixa {i}', f'https://example.com/{i}', caminho)
+    estado = {'processados': [], 'interromper_apos': None, 'falhar': set()}
+
+    def reparar(arquivo, _info, _online):
+        info = os.stat(arquivo)
+        erro = 'tag ilegível' if os.path.basename(arquivo) in estado['falhar'] else None
+        return {'arquivo': arquivo, 'alteracoes': [], 'erro': erro,
+                'mtime': info.st_mtime, 'tamanho': info.st_size}
+
+    def processar_em_pool(funcao, tarefas, _workers, ao_concluir, _descricao):
+        for tarefa in tarefas:
+            if len(estado['processados']) == estado['interromper_apos']:
+                raise KeyboardInterrupt
+            estado['processados'].append(os.path.basename(tarefa[0]))
+            ao_concluir(funcao(*tarefa))
+    monkeypatch.setattr(baixador, 'reparar_arquivo', reparar)
+    monkeypatch.setattr(baixador, '_processar_em_pool', processar_em_pool)
+    biblioteca = baixador.LibraryIndex(db, str(diretorio))
+    instancia = baixador.LibraryRepair(db, historico, baixador.DownloadIndex(db), biblioteca, lambda t: t)
+    return instancia, estado
+
+
+def test_retoma_depois_de_interrompido(reparo):
+    instancia, estado = reparo
+    estado['interromper_apos'] = 3
+    with pytest.raises(KeyboardInterrupt):
+        instancia.executar(lote=2)
+    feitos = sorted(estado['processados'])
+    # O que terminou antes da interrupção ficou gravado, mesmo fora de um lote completo
+    assert len(instancia.db.consultar("SELECT * FROM reparos")) == 3
+
+    estado['processados'].clear()
+    estado['interromper_apos'] = None
+    relatorio = instancia.executar(lote=2)
+    assert relatorio['verificados'] == 3
+    assert sorted(feitos + estado['processados']) == [f'faixa {i}.mp3' for i in range(6)]
+
+    estado['processados'].clear()
+    assert instancia.executar()['verificados'] == 0
+
+
+def test_reconfere_alterados_e_falhas(reparo):
+    instancia, estado = reparo
+    estado['falhar'] = {'faixa 1.mp3'}
+    relatorio = instancia.executar()
+    assert relatorio['verificados'] == 6
+    assert [os.path.basename(a) for a, _erro in relatorio['falhas']] == ['faixa 1.mp3']
+
+    estado['processados'].clear()
+    estado['falhar'] = set()
+    alterado = os.path.join(instancia.biblioteca.diretorio, 'faixa 4.mp3')
+    info = os.stat(alterado)
+    os.utime(alterado, (info.st_atime, info.st_mtime + 10))
+    instancia.executar()
+    assert sorted(estado['processados']) == ['faixa 1.mp3', 'faixa 4.mp3']
+
+
+def test_limite_deixa_o_resto_para_a_proxima(reparo):
+    instancia, estado = reparo
+    relatorio = instancia.executar(limite=4)
+    assert (relatorio['verificados'], relatorio['restantes']) == (4, 2)
+    relatorio = instancia.executar(limite=4)
+    assert (relatorio['verificados'], relatorio['restantes']) == (2, 0)
+
+    instancia.recomecar()
+    assert instancia.executar()['verificados'] == 6
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+
+def esperar(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao():
+        assert time.monotonic() < fim, "tempo esgotado"
+        time.sleep(0.01)
+
+
+def test_scheduler_limita_a_concorrencia(baixador):
+    ativos, maximo = 0, 0
+    lock = threading.Lock()
+
+    def tarefa(url):
+        nonlocal ativos, maximo
+        with lock:
+            ativos += 1
+            maximo = max(maximo, ativos)
+        time.sleep(0.02)
+        with lock:
+            ativos -= 1
+        return url
+
+    with baixador.DownloadScheduler(tarefa, max_workers=3) as scheduler:
+        for i in range(20):
+            scheduler.agendar(f'url-{i}')
+    assert maximo == 3
+    assert len(scheduler.resumo.sucessos) == 20
+    assert not scheduler.resumo.falhas
+
+
+def test_scheduler_segura_o_produtor(baixador):
+    liberar = threading.Event()
+    scheduler = baixador.DownloadScheduler(lambda url: liberar.wait(5), max_workers=1, tamanho_fila=2)
+    scheduler.iniciar()
+    agendados = []
+
+    def produzir():
+        for i in range(6):
+            scheduler.agendar(f'url-{i}')
+            agendados.append(i)
+    produtor = threading.Thread(target=produzir)
+    produtor.start()
+    # Um job rodando e dois esperando: o quarto agendar fica bloqueado
+    esperar(lambda: len(agendados) == 3)
+    time.sleep(0.1)
+    assert len(agendados) == 3
+    liberar.set()
+    produtor.join(5)
+    scheduler.encerrar()
+    assert len(scheduler.resumo.sucessos) == 6
+
+
+def test_scheduler_espera_o_estagio_seguinte(baixador):
+    from concurrent.futures import Future
+    conversoes = []
+
+    def tarefa(url):
+        conversao = Future()
+        conversoes.append(conversao)
+        return conversao
+
+    scheduler = baixador.DownloadScheduler(tarefa, max_workers=1)
+    scheduler.iniciar()
+    futures = [scheduler.agendar(f'url-{i}') for i in range(2)]
+    # O worker não espera a conversão: os dois jobs começam
+    esperar(lambda: len(conversoes) == 2)
+    assert not any(f.done() for f in futures)
+    for i, conversao in enumerate(conversoes):
+        conversao.set_result(f'musica-{i}.mp3')
+    scheduler.encerrar()
+    assert [f.result() for f in futures] == ['musica-0.mp3', 'musica-1.mp3']
+
+
+PLAYLIST = 'https://www.youtube.com/playlist?list=PLteste'
+
+
+def playlist_falsa(youtube, quantidade):
+    from conftest import video
+    youtube.playlists[PLAYLIST] = {
+        '_type': 'playlist', 'title': 'Lista de teste',
+        'entries': [{'_type': 'url', 'id': video(i), 'url': f'https://www.youtube.com/watch?v={video(i)}'}
+                    for i in range(quantidade)],
+    }
+
+
+def test_playlist_com_youtube_falso(baixador, downloader, youtube):
+    from conftest import video
+    playlist_falsa(youtube, 12)
+    youtube.falhas = {video(3), video(7)}
+    youtube.atraso = 0.05
+    esperando = []
+    youtube.ao_baixar = lambda _id: esperando.append(
+        sum(job['estado'] == baixador.ESTADO_NA_FILA for job in downloader.fila.estado()))
+
+    resumo = downloader.baixar_playlist(PLAYLIST, max_workers=2, tamanho_fila=3, confirmar=False)
+
+    assert youtube.maximo_ativos == 2
+    # A playlist não foi despejada na fila: nunca houve mais de ``tamanho_fila`` esperando
+    assert max(esperando) <= 3
+    assert len(resumo.sucessos) == 10
+    assert sorted(url.rsplit('=', 1)[1] for url, _erro in resumo.falhas) == [video(3), video(7)]
+    assert all('Video unavailable' in erro for _url, erro in resumo.falhas)
+    for _url, arquivo in resumo.sucessos:
+        assert arquivo.startswith(downloader.diretorio_downloads) and arquivo.endswith('.mp3')
+    assert len(downloader.historico) == 10
+
+
+def test_playlist_repetida_pula_o_que_ja_baixou(downloader, youtube):
+    playlist_falsa(youtube, 4)
+    downloader.baixar_playlist(PLAYLIST, confirmar=False)
+    youtube.baixados.clear()
+
+    resumo = downloader.baixar_playlist(PLAYLIST, confirmar=False)
+
+    assert youtube.baixados == []
+    assert len(resumo.ja_baixados) == 4
+    assert not resumo.sucessos and not resumo.falhas
+
+
+def test_playlist_em_streaming_segue_o_redirecionamento(downloader, youtube):
+    from conftest import video
+    lidas = []
+
+    def entradas():
+        for i in range(12):
+            lidas.append(i)
+            yield {'id': video(i), 'url': video(i)}
+
+    def playlist(process):
+        assert not process
+        return {'title': 'Playlist', 'entries': entradas()}
+    youtube.playlists[PLAYLIST] = playlist
+    # ``watch?v=...&list=...`` sem process volta como um redirecionamento para a playlist
+    assistir = f'https://www.youtube.com/watch?v={video(0)}&list=PLteste'
+    youtube.playlists[assistir] = {'_type': 'url', 'url': PLAYLIST, 'ie_key': 'YoutubeTab'}
+    lidas_no_inicio = []
+    youtube.ao_baixar = lambda _id: lidas_no_inicio.append(len(lidas))
+
+    resumo = downloader.baixar_playlist(assistir, max_workers=1, tamanho_fila=2, streaming=True,
+                                        confirmar=False)
+
+    # O primeiro download começou antes de o gerador chegar ao fim
+    assert lidas_no_inicio[0] < 12
+    assert len(resumo.sucessos) == 12
@@ -0,0 +1,75 @@
+import json
+
+from conftest import original, pedir
+
+
+def test_lista_as_musicas(servidor):
+    resposta, corpo = pedir(servidor, '/api/musicas')
+    assert resposta.status == 200
+    assert sorted(m['arquivo'] for m in json.loads(corpo)) == ['faixa 0.mp3', 'faixa 1.mp3']
+
+    resposta, _ = pedir(servidor, '/api/musicas', {'If-None-Match': resposta.getheader('ETag')})
+    assert resposta.status == 304
+    assert resposta.getheader('Content-Length') is None
+
+
+def test_entrega_arquivo_inteiro_e_intervalos(servidor, biblioteca):
+    dados = original(biblioteca)
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3')
+    assert resposta.status == 200
+    assert corpo == dados
+    assert resposta.getheader('Accept-Ranges') == 'bytes'
+
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3', {'Range': 'bytes=100-199'})
+    assert resposta.status == 206
+    assert corpo == dados[100:200]
+    assert resposta.getheader('Content-Range') == f'bytes 100-199/{len(dados)}'
+
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3', {'Range': 'bytes=-10'})
+    assert resposta.status == 206
+    assert corpo == dados[-10:]
+
+    resposta, _ = pedir(servidor, '/musicas/faixa%200.mp3', {'Range': f'bytes={len(dados)}-'})
+    assert resposta.status == 416
+    assert resposta.getheader('Content-Range') == f'bytes */{len(dados)}'
+
+
+def test_requisicoes_condicionais(servidor, biblioteca):
+    resposta, _ = pedir(servidor, '/musicas/faixa%200.mp3')
+    etag, data = resposta.getheader('ETag'), resposta.getheader('Last-Modified')
+
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3', {'If-None-Match': etag})
+    assert resposta.status == 304
+    assert corpo == b''
+    assert resposta.getheader('Content-Length') is None
+    resposta, _ = pedir(servidor, '/musicas/faixa%200.mp3', {'If-Modified-Since': data})
+    assert resposta.status == 304
+
+    # If-Range com a ETag atual respeita o Range; com outra, manda o arquivo inteiro
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3', {'Range': 'bytes=0-9', 'If-Range': etag})
+    assert resposta.status == 206
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3', {'Range': 'bytes=0-9', 'If-Range': '"velha"'})
+    assert resposta.status == 200
+    assert corpo == original(biblioteca)
+
+
+def test_nao_sai_do_diretorio(servidor):
+    resposta, _ = pedir(servidor, '/musicas/..%2Fbaixador.db')
+    assert resposta.status == 404
+    resposta, _ = pedir(servidor, '/api/musicas', metodo='POST')
+    assert resposta.status == 405
+
+
+
+def test_lista_compara_as_etags_inteiras(servidor):
+    resposta, _ = pedir(servidor, '/api/musicas')
+    etag = resposta.getheader('ETag')
+
+    for cabecalho in (f'W/{etag}', f'"outra", {etag}', '*'):
+        resposta, _ = pedir(servidor, '/api/musicas', {'If-None-Match': cabecalho})
+        assert resposta.status == 304, cabecalho
+    # A ETag aparece dentro do cabeçalho, mas não é um dos valores da lista
+    resposta, _ = pedir(servidor, '/api/musicas', {'If-None-Match': f'"{etag}"'})
+    assert resposta.status == 200
+    resposta, _ = pedir(servidor, '/api/musicas?limite=1', {'If-None-Match': etag})
+    assert resposta.status == 200
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import original, pedir
+
+
+@pytest.fixture
+def ffmpeg_lento(baixador, monkeypatch):
+    """FFmpeg falso que demora um pouco e conta as codificações."""
+    chamadas = []
+    liberar = threading.Event()
+
+    def codificar(cmd, **_kwargs):
+        chamadas.append(cmd)
+        liberar.wait(5)
+        with open(cmd[cmd.index('-i') + 1], 'rb') as origem, open(cmd[-1], 'wb') as destino:
+            destino.write(origem.read()[:1000])
+    monkeypatch.setattr(baixador.subprocess, 'run', codificar)
+    return chamadas, liberar
+
+
+def test_pedidos_simultaneos_fazem_uma_codificacao(baixador, tmp_path, ffmpeg_lento):
+    chamadas, liberar = ffmpeg_lento
+    origem = str(tmp_path / 'faixa.mp3')
+    baixador.gerar_mp3_silencio(origem, 2)
+    cache = baixador.TranscodeCache(str(tmp_path / 'variantes'))
+    futures = [cache.obter(origem, 'mp3-96') for _ in range(8)]
+    liberar.set()
+    caminhos = {f.result(timeout=5) for f in futures}
+    assert len(caminhos) == 1 and len(chamadas) == 1
+
+    assert cache.obter(origem, 'mp3-96').result() in caminhos
+    dados = cache.estatisticas()
+    assert (dados['faltas'], dados['coalescidos'], dados['acertos']) == (1, 7, 1)
+    assert dados['codificacoes'] == 1
+    cache.fechar()
+
+
+def test_cache_apaga_a_variante_menos_usada(baixador, tmp_path, ffmpeg_lento):
+    chamadas, liberar = ffmpeg_lento
+    liberar.set()
+    origens = []
+    for i in range(3):
+        origens.append(str(tmp_path / f'faixa{i}.mp3'))
+        baixador.gerar_mp3_silencio(origens[-1], 1)
+    cache = baixador.TranscodeCache(str(tmp_path / 'variantes'), limite_bytes=2500)
+    a = cache.obter(origens[0], 'mp3-128').result()
+    b = cache.obter(origens[1], 'mp3-128').result()
+    cache.obter(origens[0], 'mp3-128').result()  # ``a`` passa a ser a mais recente
+    time.sleep(0.01)
+    c = cache.obter(origens[2], 'mp3-128').result()
+    assert cache.total_bytes <= 2500
+    assert [os.path.exists(p) for p in (a, b, c)] == [True, False, True]
+
+    # Outro processo reabrindo o cache vê as mesmas entradas
+    cache.fechar()
+    reaberto = baixador.TranscodeCache(str(tmp_path / 'variantes'), limite_bytes=2500)
+    assert reaberto.total_bytes == 2000
+    reaberto.fechar()
+
+
+def test_variante_desconhecida(baixador, tmp_path):
+    origem = str(tmp_path / 'faixa.mp3')
+    baixador.gerar_mp3_silencio(origem, 1)
+    cache = baixador.TranscodeCache(str(tmp_path / 'variantes'))
+    with pytest.raises(KeyError):
+        cache.obter(origem, 'flac')
+    cache.fechar()
+
+
+def test_variante_tem_etag_fraca(servidor, biblioteca):
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3?variante=mp3-128')
+    assert resposta.status == 200
+    assert len(corpo) == len(original(biblioteca)) // 2
+    etag = resposta.getheader('ETag')
+    assert etag.startswith('W/"')
+
+    resposta, _ = pedir(servidor, '/musicas/faixa%200.mp3?variante=mp3-128', {'If-None-Match': etag})
+    assert resposta.status == 304
+    # Outra codificação pode ter bytes diferentes: If-Range numa variante nunca casa
+    resposta, corpo = pedir(servidor, '/musicas/faixa%200.mp3?variante=mp3-128',
+                            {'Range': 'bytes=0-9', 'If-Range': etag})
+    assert resposta.status == 200
+    assert len(corpo) == len(original(biblioteca)) // 2
+
+    resposta, _ = pedir(servidor, '/musicas/faixa%200.mp3?variante=nenhuma')
+    assert resposta.status == 404